@@ -0,0 +1,241 @@
+"""
+Admission control for chat requests.
+
+Each worker runs at most `max_active` chats at once. Further requests wait in
+a bounded queue for at most `max_queue_time` seconds; when the queue is full,
+or the wait runs out, the request is turned away at once with a Retry-After
+estimate instead of piling up until the client times out. Freed slots go to
+waiting sessions in turn, so one session with several requests queued cannot
+starve the others, and a single session or client address may only hold a
+few active-or-queued requests at a time.
+"""
+import asyncio
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Deque, Dict, Optional
+
+
+class AdmissionRejected(Exception):
+    """A request turned away; `status` is the HTTP status to answer with"""
+
+    def __init__(self, reason: str, retry_after: int, status: int = 503):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+        self.status = status
+
+
+class Ticket:
+    """One admitted (or waiting) request; pass it back to release()"""
+
+    __slots__ = ('session', 'client_ip', 'queued_at', 'granted_at', 'released', '_wake')
+
+    def __init__(self, session: str, client_ip: str, wake: Optional[Callable[[], None]] = None):
+        self.session = session
+        self.client_ip = client_ip
+        self.queued_at = time.monotonic()
+        self.granted_at: Optional[float] = None
+        self.released = False
+        self._wake = wake
+
+
+class AdmissionController:
+    """
+    Concurrency limit with a bounded, session-fair wait queue. Thread-safe;
+    acquire() blocks the calling thread and aacquire() waits on the event loop,
+    so one controller serves both the Flask and asyncio apps. A max_active of
+    0 disables admission control.
+    """
+
+    QUEUE_FULL = 'queue_full'
+    QUEUE_TIMEOUT = 'queue_timeout'
+    SESSION_LIMIT = 'session_limit'
+    IP_LIMIT = 'ip_limit'
+
+    def __init__(self, max_active: int = 32, max_queue: int = 64, max_queue_time: float = 5.0,
+                 max_per_session: int = 2, max_per_ip: int = 48, metrics=None):
+        self.max_active = max_active
+        self.max_queue = max_queue
+        self.max_queue_time = max_queue_time
+        self.max_per_session = max_per_session
+        self.max_per_ip = max_per_ip
+        self.metrics = metrics
+        self._lock = threading.Lock()
+        self._active = 0
+        self._queued = 0
+        # session -> its waiting tickets, oldest first; the first session is served next
+        self._waiting: 'OrderedDict[str, Deque[Ticket]]' = OrderedDict()
+        # Active and queued requests per session and per client address
+        self._per_session: Dict[str, int] = {}
+        self._per_ip: Dict[str, int] = {}
+        # Moving average of how long an admitted chat holds its slot (seconds)
+        self._service_time = 1.0
+        self._admitted = 0
+        self._waited = 0
+        self._rejected: Dict[str, int] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_active > 0
+
+    def acquire(self, session: str, client_ip: str, max_wait: Optional[float] = None) -> Ticket:
+        """
+        Wait for a slot, blocking this thread, for at most max_wait seconds if
+        less than max_queue_time (the request's deadline). Raises AdmissionRejected.
+        """
+        event = threading.Event()
+        ticket = self._enter(session, client_ip, event.set)
+        if ticket.granted_at is None and not event.wait(self._queue_time(max_wait)):
+            with self._lock:
+                if self._withdraw(ticket):
+                    raise self._reject(self.QUEUE_TIMEOUT)
+        self._observe_wait(ticket)
+        return ticket
+
+    async def aacquire(self, session: str, client_ip: str, max_wait: Optional[float] = None) -> Ticket:
+        """Wait for a slot without blocking the event loop. Raises AdmissionRejected."""
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(None))
+
+        ticket = self._enter(session, client_ip, wake)
+        if ticket.granted_at is None:
+            try:
+                await asyncio.wait_for(asyncio.shield(granted), self._queue_time(max_wait))
+            except asyncio.TimeoutError:
+                with self._lock:
+                    if self._withdraw(ticket):
+                        raise self._reject(self.QUEUE_TIMEOUT)
+            except asyncio.CancelledError:
+                # The client went away while queued; hand on a slot granted in the meantime
+                with self._lock:
+                    withdrawn = self._withdraw(ticket)
+                if not withdrawn:
+                    self.release(ticket)
+                raise
+        self._observe_wait(ticket)
+        return ticket
+
+    def release(self, ticket: Ticket) -> None:
+        """Free the ticket's slot for the next waiting session; safe to call more than once"""
+        with self._lock:
+            if ticket.released or ticket.granted_at is None:
+                return
+            ticket.released = True
+            self._active -= 1
+            self._leave(ticket)
+            held = time.monotonic() - ticket.granted_at
+            self._service_time += 0.1 * (held - self._service_time)
+            while self._waiting and self._active < self.max_active:
+                self._grant(self._next_waiting())
+
+    def retry_after(self) -> int:
+        """Seconds a turned-away client should wait: the time to drain the current queue"""
+        with self._lock:
+            return self._retry_after()
+
+    def _queue_time(self, max_wait: Optional[float]) -> float:
+        return self.max_queue_time if max_wait is None else min(self.max_queue_time, max_wait)
+
+    def _enter(self, session: str, client_ip: str, wake: Callable[[], None]) -> Ticket:
+        ticket = Ticket(session, client_ip, wake)
+        with self._lock:
+            if not self.enabled:
+                ticket.granted_at = ticket.queued_at
+                ticket.released = True
+                self._admitted += 1
+                return ticket
+            if self.max_per_session and self._per_session.get(session, 0) >= self.max_per_session:
+                raise self._reject(self.SESSION_LIMIT, status=429)
+            if self.max_per_ip and self._per_ip.get(client_ip, 0) >= self.max_per_ip:
+                raise self._reject(self.IP_LIMIT, status=429)
+            if self._active < self.max_active and not self._waiting:
+                self._active += 1
+                ticket.granted_at = ticket.queued_at
+                self._admitted += 1
+            elif self._queued >= self.max_queue:
+                raise self._reject(self.QUEUE_FULL)
+            else:
+                self._waiting.setdefault(session, deque()).append(ticket)
+                self._queued += 1
+                self._waited += 1
+            self._per_session[session] = self._per_session.get(session, 0) + 1
+            self._per_ip[client_ip] = self._per_ip.get(client_ip, 0) + 1
+        return ticket
+
+    def _withdraw(self, ticket: Ticket) -> bool:
+        # Caller must hold self._lock. Takes a ticket out of the queue; False if it was granted a slot first.
+        if ticket.granted_at is not None:
+            return False
+        queue = self._waiting[ticket.session]
+        queue.remove(ticket)
+        if not queue:
+            del self._waiting[ticket.session]
+        self._queued -= 1
+        self._leave(ticket)
+        return True
+
+    def _next_waiting(self) -> Ticket:
+        # Caller must hold self._lock. Round-robin: the served session moves to the back.
+        session, queue = next(iter(self._waiting.items()))
+        ticket = queue.popleft()
+        if queue:
+            self._waiting.move_to_end(session)
+        else:
+            del self._waiting[session]
+        self._queued -= 1
+        return ticket
+
+    def _grant(self, ticket: Ticket) -> None:
+        # Caller must hold self._lock
+        self._active += 1
+        self._admitted += 1
+        ticket.granted_at = time.monotonic()
+        ticket._wake()
+
+    def _leave(self, ticket: Ticket) -> None:
+        # Caller must hold self._lock
+        for counts, key in ((self._per_session, ticket.session), (self._per_ip, ticket.client_ip)):
+            remaining = counts.get(key, 0) - 1
+            if remaining > 0:
+                counts[key] = remaining
+            else:
+                counts.pop(key, None)
+
+    def _retry_after(self) -> int:
+        # Caller must hold self._lock
+        drain = self._service_time * (self._queued + 1) / max(1, self.max_active)
+        return max(1, min(60, math.ceil(drain)))
+
+    def _reject(self, reason: str, status: int = 503) -> AdmissionRejected:
+        # Caller must hold self._lock
+        retry_after = self._retry_after()
+        self._rejected[reason] = self._rejected.get(reason, 0) + 1
+        if self.metrics is not None:
+            self.metrics.inc('chatbot_admission_rejections_total', {'reason': reason})
+        return AdmissionRejected(reason, retry_after, status)
+
+    def _observe_wait(self, ticket: Ticket) -> None:
+        if self.metrics is not None:
+            self.metrics.observe('chatbot_stage_duration_seconds', ticket.granted_at - ticket.queued_at,
+                                 {'stage': 'admission_wait'})
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'active': self._active,
+                'queued': self._queued,
+                'sessions_waiting': len(self._waiting),
+                'max_active': self.max_active,
+                'max_queue': self.max_queue,
+                'admitted': self._admitted,
+                'waited': self._waited,
+                'rejected': dict(self._rejected),
+                'service_time_ms': round(self._service_time * 1000, 1),
+                'retry_after': self._retry_after()
+            }
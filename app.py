@@ -1,172 +1,156 @@
-from flask import Flask, render_template, request, jsonify
+# Started before anything else is imported, so /ready reports the whole import time
+from startup import WorkerStartup
+startup = WorkerStartup()
+
+from flask import Flask, request, jsonify, make_response, Response, session, stream_with_context, g
 from dotenv import load_dotenv
 import os
-import random
-import re
 import logging
-from typing import Dict, List, Optional
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 import json
-from datetime import datetime
 import time
-import requests
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import wraps
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.middleware.proxy_fix import ProxyFix
 
-# Load environment variables
+# Load environment variables before Config reads them
 load_dotenv()
 
+from config import Config
+from classifier import classifier
+from http_client import get_upstream_client
+from response_cache import ResponseCache
+from shared_state import SharedState
+from similarity_index import SimilarityIndex
+from offline_answers import OfflineAnswerEngine
+from conversation_store import create_conversation_store
+from prompt_builder import AssembledPrompt, PromptAssembler
+from providers import ProviderError, create_router
+from admission import AdmissionController, AdmissionRejected
+from resilience import Deadline, DeadlineRegistry
+from metrics import Metrics
+from logging_setup import logging_stats, setup_logging
+from compression import PrecompressedAsset, compress_body
+
 app = Flask(__name__)
+app.secret_key = Config.SECRET_KEY
+# Send Hindi/Telugu/Tamil answers as UTF-8 (3 bytes a character) rather than \uXXXX escapes (6)
+app.json.ensure_ascii = False
+# Largest chat body worth reading: a full-length message, JSON-escaped (at most 12 bytes a character)
+MAX_CHAT_BODY_BYTES = Config.MAX_MESSAGE_LENGTH * 12 + 1024
+app.config['MAX_CONTENT_LENGTH'] = MAX_CHAT_BODY_BYTES * Config.MAX_BATCH_SIZE
+if Config.FORWARDED_HOPS:
+    # Take the client address from X-Forwarded-For so per-address limits see real clients
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=Config.FORWARDED_HOPS)
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('chatbot.log'),
-        logging.StreamHandler()
-    ]
+# Configure logging: handlers run on a background thread, off the request path
+setup_logging(
+    level=Config.LOG_LEVEL,
+    log_file=Config.LOG_FILE,
+    fmt=Config.LOG_FORMAT,
+    max_bytes=Config.LOG_MAX_BYTES,
+    backup_count=Config.LOG_BACKUP_COUNT,
+    rotate_when=Config.LOG_ROTATE_WHEN,
+    max_length=Config.LOG_MAX_LENGTH,
+    access_sample_rate=Config.LOG_ACCESS_SAMPLE_RATE,
+    queue_size=Config.LOG_QUEUE_SIZE
 )
 logger = logging.getLogger(__name__)
+# One line per HTTP request, sampled at LOG_ACCESS_SAMPLE_RATE
+access_logger = logging.getLogger('chatbot.access')
 
-# Check if Gemini API key is available
-GENAI_API_KEY = os.getenv('GENAI_API_KEY')
-USE_GEMINI = bool(GENAI_API_KEY)
-
-# Gemini API configuration
-GEMINI_API_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent"
-
-if USE_GEMINI:
-    logger.info("Gemini API key configured successfully")
-
-# Store conversation history in memory (in production, use a database)
-conversation_history = []
-
-# Dummy responses for different languages
-DUMMY_RESPONSES = {
-    'english': [
-        "Great question! In simple terms, this is a fundamental concept that involves understanding the basic principles. For example, when we look at this topic, we can see how it connects to everyday life through practical applications.",
-        "That's an interesting topic! Let me explain it step by step: First, we need to understand the definition. Then, we can explore some examples to make it clearer. This concept is widely used in various fields.",
-        "Excellent question! This subject has three main components: theory, application, and real-world examples. Understanding these helps us grasp the bigger picture and see how everything connects together."
-    ],
-    'hindi': [
-        "बहुत अच्छा प्रश्न! सरल शब्दों में, यह एक मौलिक अवधारणा है जिसमें बुनियादी सिद्धांतों को समझना शामिल है। उदाहरण के लिए, जब हम इस विषय को देखते हैं, तो हम देख सकते हैं कि यह व्यावहारिक अनुप्रयोगों के माध्यम से रोजमर्रा की जिंदगी से कैसे जुड़ता है।",
-        "यह एक दिलचस्प विषय है! मैं इसे चरणबद्ध तरीके से समझाता हूं: पहले, हमें परिभाषा को समझना होगा। फिर, हम इसे स्पष्ट करने के लिए कुछ उदाहरण देख सकते हैं। यह अवधारणा विभिन्न क्षेत्रों में व्यापक रूप से उपयोग की जाती है।",
-        "उत्कृष्ट प्रश्न! इस विषय के तीन मुख्य घटक हैं: सिद्धांत, अनुप्रयोग, और वास्तविक जीवन के उदाहरण। इन्हें समझना हमें बड़ी तस्वीर को समझने में मदद करता है।"
-    ],
-    'telugu': [
-        "చాలా మంచి ప్రశ్న! సరళంగా చెప్పాలంటే, ఇది ప్రాథమిక సూత్రాలను అర్థం చేసుకోవడంతో కూడిన ఒక ప్రాథమిక భావన. ఉదాహరణకు, మనం ఈ విషయాన్ని చూసినప్పుడు, ఇది ఆచరణాత్మక అనువర్తనాల ద్వారా రోజువారీ జీవితంతో ఎలా అనుసంధానమవుతుందో చూడవచ్చు।",
-        "ఇది ఆసక్తికరమైన విషయం! నేను దీన్ని దశలవారీగా వివరిస్తాను: మొదట, మనం నిర్వచనాన్ని అర్థం చేసుకోవాలి. తర్వాత, దీన్ని స్పష్టం చేయడానికి కొన్ని ఉదాహరణలను చూడవచ్చు. ఈ భావన వివిధ రంగాలలో విస్తృతంగా ఉపయోగించబడుతుంది।",
-        "అద్భుతమైన ప్రశ్న! ఈ విషయానికి మూడు ప్రధాన భాగాలు ఉన్నాయి: సిద్ధాంతం, అనువర్తనం, మరియు వాస్తవ జీవిత ఉదాహరణలు. వీటిని అర్థం చేసుకోవడం మనకు పెద్ద చిత్రాన్ని చూడడంలో సహాయపడుతుంది।"
-    ],
-    'tamil': [
-        "மிகச் சிறந்த கேள்வி! எளிமையான வார்த்தைகளில், இது அடிப்படைக் கொள்கைகளைப் புரிந்துகொள்வதை உள்ளடக்கிய ஒரு அடிப்படைக் கருத்து. உதாஹரணமாக, இந்த தலைப்பைப் பார்க்கும்போது, நடைமுறை பயன்பாடுகள் மூலம் இது அன்றாட வாழ்க்கையுடன் எவ்வாறு இணைகிறது என்பதைக் காணலாம்.",
-        "இது ஒரு சுவாரஸ்யமான தலைப்பு! நான் இதை படிப்படியாக விளக்குகிறேன்: முதலில், நாம் வரையறையைப் புரிந்து கொள்ள வேண்டும். பின்னர், இதை தெளிவுபடுத்த சில உதாரணங்களைப் பார்க்கலாம். இந்தக் கருத்து பல்வேறு துறைகளில் பரவலாகப் பயன்படுத்தப்படுகிறது.",
-        "சிறப்பான கேள்வி! இந்த விஷயத்திற்கு மூன்று முக்கிய கூறுகள் உள்ளன: கோட்பாடு, பயன்பாடு மற்றும் நிஜ வாழ்க்கை உதாரணங்கள். இவற்றைப் புரிந்துகொள்வது பெரிய படத்தைப் பார்க்க உதவுகிறது."
-    ]
-}
+# Delay between words when streaming offline answers (seconds)
+OFFLINE_STREAM_DELAY = float(os.getenv('OFFLINE_STREAM_DELAY', '0.03'))
+
+# Counters, hot answers and provider token buckets every worker on the host maps from SHARED_STATE_FILE
+shared_state = SharedState(
+    Config.SHARED_STATE_FILE,
+    answer_slots=Config.SHARED_ANSWER_SLOTS,
+    answer_bytes=Config.SHARED_ANSWER_BYTES,
+    max_workers=Config.SHARED_STATE_WORKERS
+)
+
+# Cache of generated answers, keyed on normalized message, language and topic
+response_cache = ResponseCache(
+    max_entries=Config.RESPONSE_CACHE_SIZE,
+    ttl=Config.RESPONSE_CACHE_TTL,
+    db_path=Config.RESPONSE_CACHE_DB,
+    shared=shared_state
+)
+# Start with the newest shared answers in memory (built once in the master when gunicorn preloads the app)
+preloaded_answers = response_cache.preload()
+if preloaded_answers:
+    logger.info(f"Response cache preloaded with {preloaded_answers} answers")
+
+# Near-duplicate index over answered questions, so paraphrased repeats skip the LLM too
+similar_questions = SimilarityIndex(
+    threshold=Config.SIMILARITY_THRESHOLD,
+    max_entries=Config.SIMILARITY_MAX_ENTRIES,
+    ttl=Config.RESPONSE_CACHE_TTL,
+    path=Config.SIMILARITY_INDEX_FILE
+)
+
+# Knowledge-base answers for demo mode and upstream failures; the index is memory-mapped
+offline_answers = OfflineAnswerEngine(
+    kb_dir=Config.KNOWLEDGE_BASE_DIR,
+    index_path=Config.KNOWLEDGE_INDEX_FILE,
+    min_score=Config.OFFLINE_MIN_SCORE
+)
+
+# Per-stage latency histograms and counters, merged across workers through METRICS_DIR
+metrics = Metrics(Config.METRICS_DIR, Config.METRICS_FLUSH_INTERVAL)
+
+# Every configured LLM provider (Gemini, OpenAI), each with its own rate limiter (shared by the
+# host's workers with SHARED_STATE_FILE) and circuit breaker; calls go to the fastest healthy
+# one and are hedged to the next when it runs slow
+llm_router = create_router(metrics, shared_state)
+USE_LLM = bool(llm_router.providers)
+
+if USE_LLM:
+    logger.info(f"LLM providers configured: {', '.join(p.name for p in llm_router.providers)}")
+
+# Bounded, session-fair wait queue in front of the chat endpoints; overload is turned away with Retry-After
+admission = AdmissionController(
+    max_active=Config.MAX_ACTIVE_CHATS,
+    max_queue=Config.MAX_QUEUED_CHATS,
+    max_queue_time=Config.MAX_QUEUE_TIME,
+    max_per_session=Config.MAX_CHATS_PER_SESSION,
+    max_per_ip=Config.MAX_CHATS_PER_IP,
+    metrics=metrics
+)
+
+# Deadlines of the chats in flight by session, so clearing a chat cancels its upstream work
+in_flight = DeadlineRegistry()
+
+# The page has no per-request content: render it once and serve precompressed variants with ETags
+index_page = PrecompressedAsset(
+    app.jinja_env.get_template('index.html').render(max_message_length=Config.MAX_MESSAGE_LENGTH).encode('utf-8'),
+    'text/html; charset=utf-8'
+)
 
 def detect_language(text: str) -> str:
     """
     Enhanced language detection with better accuracy and support for mixed text
     """
-    # Remove punctuation and convert to lowercase for better detection
-    clean_text = re.sub(r'[^\w\s]', '', text.lower())
-    
-    # Language-specific character patterns
-    devanagari_chars = len(re.findall(r'[\u0900-\u097F]', text))
-    telugu_chars = len(re.findall(r'[\u0C00-\u0C7F]', text))
-    tamil_chars = len(re.findall(r'[\u0B80-\u0BFF]', text))
-    
-    # Common words in each language for better detection
-    hindi_words = ['क्या', 'है', 'में', 'के', 'का', 'की', 'और', 'या', 'नहीं', 'हैं']
-    telugu_words = ['ఏమిటి', 'అంటే', 'లో', 'కి', 'గా', 'మరియు', 'లేదా', 'కాదు', 'ఉన్నాయి']
-    tamil_words = ['என்ன', 'ஆகும்', 'இல்', 'க்கு', 'ஆக', 'மற்றும்', 'அல்லது', 'இல்லை', 'உள்ளன']
-    
-    # Count language-specific words
-    hindi_word_count = sum(1 for word in hindi_words if word in clean_text)
-    telugu_word_count = sum(1 for word in telugu_words if word in clean_text)
-    tamil_word_count = sum(1 for word in tamil_words if word in clean_text)
-    
-    # Determine language based on character count and word frequency
-    if devanagari_chars > 0 or hindi_word_count > 0:
-        return 'hindi'
-    elif telugu_chars > 0 or telugu_word_count > 0:
-        return 'telugu'
-    elif tamil_chars > 0 or tamil_word_count > 0:
-        return 'tamil'
-    else:
-        return 'english'
+    return classifier.detect_language(text)
 
 def get_educational_context(user_message: str, language: str) -> Dict[str, str]:
     """
     Extract educational context from user message for better responses
     """
-    # Common educational topics and their keywords
-    topics = {
-        'science': ['physics', 'chemistry', 'biology', 'experiment', 'theory', 'law', 'molecule', 'atom'],
-        'mathematics': ['math', 'equation', 'formula', 'calculation', 'geometry', 'algebra', 'calculus'],
-        'history': ['history', 'ancient', 'civilization', 'war', 'king', 'empire', 'century'],
-        'geography': ['geography', 'country', 'continent', 'ocean', 'mountain', 'river', 'climate'],
-        'literature': ['literature', 'poem', 'story', 'novel', 'author', 'writing', 'poetry']
-    }
-    
-    # Language-specific topic keywords
-    hindi_topics = {
-        'science': ['विज्ञान', 'भौतिकी', 'रसायन', 'जीवविज्ञान', 'प्रयोग', 'सिद्धांत'],
-        'mathematics': ['गणित', 'समीकरण', 'सूत्र', 'ज्यामिति', 'बीजगणित'],
-        'history': ['इतिहास', 'प्राचीन', 'सभ्यता', 'युद्ध', 'राजा', 'साम्राज्य'],
-        'geography': ['भूगोल', 'देश', 'महाद्वीप', 'समुद्र', 'पहाड़', 'नदी'],
-        'literature': ['साहित्य', 'कविता', 'कहानी', 'उपन्यास', 'लेखक']
-    }
-    
-    telugu_topics = {
-        'science': ['విజ్ఞానం', 'భౌతిక శాస్త్రం', 'రసాయన శాస్త్రం', 'జీవ శాస్త్రం', 'ప్రయోగం'],
-        'mathematics': ['గణితం', 'సమీకరణం', 'సూత్రం', 'జ్యామితి', 'బీజగణితం'],
-        'history': ['చరిత్ర', 'ప్రాచీన', 'నాగరికత', 'యుద్ధం', 'రాజు'],
-        'geography': ['భూగోళం', 'దేశం', 'ఖండం', 'సముద్రం', 'పర్వతం'],
-        'literature': ['సాహిత్యం', 'కవిత', 'కథ', 'నవల', 'రచయిత']
-    }
-    
-    tamil_topics = {
-        'science': ['அறிவியல்', 'இயற்பியல்', 'வேதியியல்', 'உயிரியல்', 'சோதனை'],
-        'mathematics': ['கணிதம்', 'சமன்பாடு', 'சூத்திரம்', 'வடிவியல்', 'இயற்கணிதம்'],
-        'history': ['வரலாறு', 'பண்டைய', 'நாகரிகம்', 'போர்', 'அரசன்'],
-        'geography': ['புவியியல்', 'நாடு', 'கண்டம்', 'கடல்', 'மலை'],
-        'literature': ['இலக்கியம்', 'கவிதை', 'கதை', 'நாவல்', 'எழுத்தாளர்']
-    }
-    
-    # Select appropriate topic keywords based on language
-    if language == 'hindi':
-        topic_keywords = hindi_topics
-    elif language == 'telugu':
-        topic_keywords = telugu_topics
-    elif language == 'tamil':
-        topic_keywords = tamil_topics
-    else:
-        topic_keywords = topics
-    
-    # Detect topic from user message
-    detected_topic = 'general'
-    max_matches = 0
-    
-    for topic, keywords in topic_keywords.items():
-        matches = sum(1 for keyword in keywords if keyword.lower() in user_message.lower())
-        if matches > max_matches:
-            max_matches = matches
-            detected_topic = topic
-    
-    return {
-        'topic': detected_topic,
-        'language': language,
-        'message_length': len(user_message)
-    }
+    return classifier.get_context(user_message, language)
 
-def get_dummy_response(user_message):
-    """Generate dummy educational response based on detected language"""
-    language = detect_language(user_message)
-    responses = DUMMY_RESPONSES.get(language, DUMMY_RESPONSES['english'])
-    return random.choice(responses)
+def get_offline_response(user_message: str, context: Optional[Dict[str, str]] = None) -> str:
+    """Best-matching knowledge base explanation, in the message's language, without calling an LLM"""
+    if context is None:
+        context = get_educational_context(user_message, detect_language(user_message))
+    with metrics.timer('offline_answer'):
+        return offline_answers.answer(user_message, context['language'], context.get('topic'))
 
-def get_gemini_system_prompt(context: Dict[str, str] = None):
-    """Enhanced system prompt for Gemini with educational context and better structure"""
+def get_system_prompt(context: Dict[str, str] = None):
+    """Enhanced system prompt with educational context and better structure"""
     base_prompt = """You are an AI-powered teacher chatbot with expertise in multiple subjects. Your role is to:
 
 1. **Language Consistency**: Always respond in the SAME language as the user's input (English/Hindi/हिंदी/Telugu/తెలుగు/Tamil/தமிழ்)
@@ -202,122 +186,610 @@ def get_gemini_system_prompt(context: Dict[str, str] = None):
     
     return base_prompt
 
-def generate_gemini_response(user_message: str, context: Dict[str, str]) -> str:
-    """Generate response using Gemini API with direct HTTP requests"""
-    if not USE_GEMINI:
-        return get_dummy_response(user_message)
+# System prompts are rendered once per topic; history is packed into a token budget
+prompt_assembler = PromptAssembler(
+    get_system_prompt,
+    Config.EDUCATIONAL_TOPICS,
+    token_budget=Config.PROMPT_TOKEN_BUDGET,
+    summary_tokens=Config.PROMPT_SUMMARY_TOKENS
+)
+
+# Per-session conversation history (bounded; shared across workers with the sqlite backend).
+# Turns dropped from a session's history are folded into its summary on the way out.
+conversation_store = create_conversation_store(fold=prompt_assembler.fold)
+
+def assemble_prompt(session_id: str, user_message: str,
+                    context: Dict[str, str]) -> Tuple[AssembledPrompt, Optional[Tuple[str, int]]]:
+    """
+    Build the prompt for a session's next message, folding old turns into its
+    summary. Returns the prompt and the summary update to pass to save_summary()
+    once the prompt has been sent.
+    """
+    conversation = conversation_store.get_context(session_id)
+    prompt, summary_update = prompt_assembler.assemble(user_message, context, conversation)
+    logger.info(f"Prompt assembled: {prompt.prompt_bytes} bytes, ~{prompt.estimated_tokens} tokens, "
+                f"{prompt.history_messages} history messages, summary={prompt.has_summary}")
+    return prompt, summary_update
+
+def save_summary(session_id: str, summary_update: Optional[Tuple[str, int]]) -> None:
+    """
+    Persist the summary update of a prompt that has been sent. Prompts that fold
+    turns carry history, so they skip the response cache and go to a provider
+    whenever an LLM is configured; demo mode never sends one.
+    """
+    if USE_LLM and summary_update is not None:
+        conversation_store.set_summary(session_id, *summary_update)
+
+def call_llm(user_message: str, context: Dict[str, str], prompt: Optional[AssembledPrompt] = None,
+             deadline: Optional[Deadline] = None) -> Optional[str]:
+    """
+    Answer through the provider router (fastest healthy provider, hedged and
+    with failover), returning None if no provider could answer before the deadline
+    """
+    if prompt is None:
+        prompt, _ = prompt_assembler.assemble(user_message, context)
+    try:
+        return llm_router.complete(prompt.request, deadline)
+    except Exception as e:
+        logger.error(f"Error generating LLM response: {e}")
+        return None
+
+def generate_llm_response(user_message: str, context: Dict[str, str]) -> str:
+    """Generate a response from the configured LLM providers, or an offline answer"""
+    if not USE_LLM:
+        return get_offline_response(user_message, context)
+    
+    return call_llm(user_message, context) or get_offline_response(user_message, context)
+
+def get_cache_key(user_message: str, context: Dict[str, str]) -> str:
+    return response_cache.make_key(user_message, context['language'], context.get('topic', 'general'))
+
+def lookup_cached_answer(user_message: str, context: Dict[str, str], cache_key: str) -> Optional[str]:
+    """An earlier answer to this question: exact cache first, then a similarly phrased question"""
+    with metrics.timer('cache_lookup'):
+        cached = response_cache.get(cache_key)
+    if cached is not None:
+        metrics.inc('chatbot_cache_lookups_total', {'result': 'exact'})
+        shared_state.add('cache_hits')
+        return cached
+    with metrics.timer('similarity_lookup'):
+        match = similar_questions.lookup(user_message, context['language'], context.get('topic', 'general'))
+    if match is None:
+        metrics.inc('chatbot_cache_lookups_total', {'result': 'miss'})
+        shared_state.add('cache_misses')
+        return None
+    answer, similarity = match
+    logger.info(f"Answered from a similar question (similarity {similarity:.2f})")
+    metrics.inc('chatbot_cache_lookups_total', {'result': 'similar'})
+    shared_state.add('similar_hits')
+    # The same phrasing next time is an exact hit
+    response_cache.set(cache_key, answer)
+    return answer
+
+def store_answer(user_message: str, context: Dict[str, str], cache_key: str, response_text: str) -> None:
+    response_cache.set(cache_key, response_text)
+    shared_state.add('answers_stored')
+    similar_questions.add(user_message, context['language'], context.get('topic', 'general'), response_text)
+
+def generate_cached_response(user_message: str, context: Dict[str, str],
+                             prompt: Optional[AssembledPrompt] = None, deadline: Optional[Deadline] = None):
+    """
+    Answer from the response cache when possible, otherwise call the LLM.
+    Returns (response_text, served_from_cache). Fallback answers are never cached,
+    and neither are answers that depend on earlier turns of the conversation.
+    """
+    if not USE_LLM:
+        return get_offline_response(user_message, context), False
+    
+    cache_key = get_cache_key(user_message, context) if prompt is None or prompt.standalone else None
+    if cache_key:
+        cached = lookup_cached_answer(user_message, context, cache_key)
+        if cached is not None:
+            return cached, True
+    
+    with metrics.timer('llm'):
+        response_text = call_llm(user_message, context, prompt, deadline)
+    if response_text is None:
+        return get_fallback_response(user_message, context, cache_key is None)
+    
+    if cache_key:
+        store_answer(user_message, context, cache_key, response_text)
+    return response_text, False
+
+def get_fallback_response(user_message: str, context: Dict[str, str], check_cache: bool = True):
+    """
+    Answer used when no LLM provider could: a cached answer to the same question if
+    there is one (even for follow-ups), otherwise an offline answer.
+    Returns (response_text, served_from_cache).
+    """
+    shared_state.add('fallbacks')
+    if check_cache:
+        cached = lookup_cached_answer(user_message, context, get_cache_key(user_message, context))
+        if cached is not None:
+            metrics.inc('chatbot_fallbacks_total', {'source': 'cache'})
+            return cached, True
+    metrics.inc('chatbot_fallbacks_total', {'source': 'offline'})
+    return get_offline_response(user_message, context), False
+
+def stream_offline_response(user_message: str, context: Optional[Dict[str, str]] = None) -> Iterator[str]:
+    """Stream an offline answer word by word so streaming works without an LLM"""
+    words = get_offline_response(user_message, context).split(' ')
+    for i, word in enumerate(words):
+        if i > 0 and OFFLINE_STREAM_DELAY > 0:
+            time.sleep(OFFLINE_STREAM_DELAY)
+        yield word if i == 0 else ' ' + word
+
+def generate_llm_response_stream(user_message: str, context: Dict[str, str],
+                                 cache_key: Optional[str] = None,
+                                 prompt: Optional[AssembledPrompt] = None,
+                                 deadline: Optional[Deadline] = None) -> Iterator[str]:
+    """
+    Stream response text chunks from the first provider to start answering.
+    A complete upstream answer is stored in the response cache under cache_key.
+    Empty chunks are heartbeats while waiting for the first one.
+    """
+    if not USE_LLM:
+        yield from stream_offline_response(user_message, context)
+        return
+    
+    if prompt is None:
+        prompt, _ = prompt_assembler.assemble(user_message, context)
     
+    chunks = []
     try:
-        # Create the full prompt
-        system_prompt = get_gemini_system_prompt(context)
-        full_prompt = f"{system_prompt}\n\nUser: {user_message}\n\nPlease respond in {context['language']} language."
-        
-        # Prepare the request
-        headers = {
-            'Content-Type': 'application/json',
-            'X-goog-api-key': GENAI_API_KEY
-        }
-        
-        payload = {
-            "contents": [
-                {
-                    "parts": [
-                        {
-                            "text": full_prompt
-                        }
-                    ]
-                }
-            ]
+        for text in llm_router.stream(prompt.request, deadline, heartbeat=Config.STREAM_HEARTBEAT or None):
+            if text:
+                chunks.append(text)
+            yield text
+    except ProviderError as e:
+        # Never fall back once text has reached the client, otherwise the answer would be mixed
+        logger.error(f"Streaming request failed: {e}")
+        return
+    if chunks:
+        # A cancelled stream (/clear) ends early without an error: its text is only part of the answer
+        if cache_key and (deadline is None or not deadline.cancelled):
+            store_answer(user_message, context, cache_key, ''.join(chunks))
+        return
+    
+    # The caller already checked the cache for standalone prompts
+    cached = lookup_cached_answer(user_message, context, get_cache_key(user_message, context)) \
+        if cache_key is None else None
+    metrics.inc('chatbot_fallbacks_total', {'source': 'cache' if cached is not None else 'offline'})
+    shared_state.add('fallbacks')
+    if cached is not None:
+        yield cached
+    else:
+        yield from stream_offline_response(user_message, context)
+
+def format_sse(data: Dict, event: Optional[str] = None) -> str:
+    """Format a dict as a Server-Sent Events message"""
+    message = f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+    if event:
+        message = f"event: {event}\n{message}"
+    return message
+
+def format_ndjson(data: Dict) -> str:
+    """Format a dict as one line of newline-delimited JSON"""
+    return json.dumps(data, ensure_ascii=False) + '\n'
+
+def parse_batch_messages(data) -> List[str]:
+    """Validate a /chat/batch body, returning its messages stripped. Raises ValueError."""
+    messages = data.get('messages') if isinstance(data, dict) else None
+    if not isinstance(messages, list) or not messages:
+        raise ValueError("'messages' must be a non-empty list")
+    if len(messages) > Config.MAX_BATCH_SIZE:
+        raise ValueError(f"A batch can contain at most {Config.MAX_BATCH_SIZE} messages")
+    return [message.strip() if isinstance(message, str) else '' for message in messages]
+
+def plan_batch(messages: List[str]) -> Tuple[List[Dict[str, str]], Dict[str, List[int]]]:
+    """
+    Classify a batch in one pass and group repeated questions so each is only
+    answered once. Returns the per-message contexts and {cache key: indexes};
+    empty and over-long messages are left out of the groups.
+    """
+    contexts = classifier.classify_many(messages)
+    groups: Dict[str, List[int]] = {}
+    for index, (message, context) in enumerate(zip(messages, contexts)):
+        if message and not message_too_long(message):
+            groups.setdefault(get_cache_key(message, context), []).append(index)
+    return contexts, groups
+
+def format_batch_results(indexes: Iterable[int], contexts: List[Dict[str, str]],
+                         response_text: Optional[str] = None, cached: bool = False,
+                         error: Optional[str] = None) -> str:
+    """NDJSON lines for every batch position that asked the same question"""
+    lines = []
+    for index in indexes:
+        item = {
+            'index': index,
+            'language': contexts[index]['language'],
+            'topic': contexts[index].get('topic', 'general')
         }
-        
-        # Generate response with retry logic for rate limiting
-        max_retries = 3
-        retry_delay = 2  # seconds
-        
-        for attempt in range(max_retries):
+        if error is None:
+            item.update(status='success', response=response_text, cached=cached)
+        else:
+            item.update(status='error', error=error)
+        lines.append(format_ndjson(item))
+    return ''.join(lines)
+
+def answer_batch_message(user_message: str, context: Dict[str, str], deadline: Optional[Deadline] = None):
+    """Answer one batch question as a standalone prompt (batches don't touch session history)"""
+    prompt, _ = prompt_assembler.assemble(user_message, context)
+    return generate_cached_response(user_message, context, prompt, deadline)
+
+def compress_chat_body(body: bytes, accept_encoding: Optional[str], language: str) -> Tuple[bytes, Optional[str]]:
+    """Compress a /chat JSON body for the client, counting its bytes before and after by language"""
+    encoded, encoding = compress_body(body, accept_encoding, Config.COMPRESSION_MIN_SIZE, Config.COMPRESSION_LEVEL)
+    metrics.inc('chatbot_chat_body_bytes_total', {'language': language}, len(body))
+    metrics.inc('chatbot_chat_wire_bytes_total', {'language': language, 'encoding': encoding or 'identity'},
+                len(encoded))
+    return encoded, encoding
+
+def get_session_id() -> str:
+    """Return the caller's session ID, issuing one in the session cookie if needed"""
+    session_id = session.get('sid')
+    if not session_id:
+        session_id = uuid.uuid4().hex
+        session['sid'] = session_id
+    return session_id
+
+TOO_LONG_ERROR = f'Message is too long: please keep it under {Config.MAX_MESSAGE_LENGTH} characters'
+
+def message_too_long(user_message: str) -> bool:
+    return len(user_message) > Config.MAX_MESSAGE_LENGTH
+
+def too_long_body() -> Dict:
+    """Error body for a message over MAX_MESSAGE_LENGTH (sent with 413)"""
+    metrics.inc('chatbot_admission_rejections_total', {'reason': 'too_long'})
+    return {'error': TOO_LONG_ERROR}
+
+REJECTION_MESSAGES = {
+    AdmissionController.SESSION_LIMIT: 'Your previous question is still being answered. Please wait for it to finish.',
+    AdmissionController.IP_LIMIT: 'Too many questions from your network at once. Please try again in a moment.',
+    AdmissionController.QUEUE_FULL: 'The teacher is busy right now. Please try again in a moment.',
+    AdmissionController.QUEUE_TIMEOUT: 'The teacher is busy right now. Please try again in a moment.'
+}
+
+def rejection_body(e: AdmissionRejected) -> Dict:
+    """Error body for a request turned away by admission control (sent with e.status and Retry-After)"""
+    return {
+        'error': REJECTION_MESSAGES[e.reason],
+        'reason': e.reason,
+        'retry_after': e.retry_after
+    }
+
+def request_deadline(requested: Optional[str], cap: float) -> Deadline:
+    """
+    The time budget for a chat request: the X-Request-Timeout header (seconds)
+    when it asks for less than cap, but never under MIN_REQUEST_DEADLINE.
+    A cap of 0 means no deadline.
+    """
+    if cap <= 0:
+        return Deadline()
+    budget = cap
+    if requested:
+        try:
+            budget = min(cap, max(Config.MIN_REQUEST_DEADLINE, float(requested)))
+        except ValueError:
+            pass
+    return Deadline(budget)
+
+def admitted(max_body_bytes: int, deadline_cap: float = Config.REQUEST_DEADLINE):
+    """
+    Run a chat view under admission control. Bodies over max_body_bytes get 413
+    before they are read; overload gets 503 (or 429 for one busy session or
+    address) with Retry-After. The slot is held until the response, including
+    a stream, has been sent. The view finds the request's deadline (queueing
+    counts against it) in g.deadline; clearing the chat cancels it.
+    """
+    def decorate(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.content_length is not None and request.content_length > max_body_bytes:
+                return jsonify(too_long_body()), 413
+            deadline = request_deadline(request.headers.get('X-Request-Timeout'), deadline_cap)
+            session_id = get_session_id()
             try:
-                response = requests.post(GEMINI_API_URL, headers=headers, json=payload, timeout=30)
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    if 'candidates' in data and len(data['candidates']) > 0:
-                        return data['candidates'][0]['content']['parts'][0]['text']
-                    else:
-                        logger.error("Unexpected response format from Gemini API")
-                        return get_dummy_response(user_message)
-                        
-                elif response.status_code == 429:  # Rate limit
-                    if attempt < max_retries - 1:
-                        logger.warning(f"Rate limit hit, retrying in {retry_delay} seconds... (attempt {attempt + 1}/{max_retries})")
-                        time.sleep(retry_delay)
-                        retry_delay *= 2  # Exponential backoff
-                        continue
-                    else:
-                        logger.error("Rate limit exceeded, falling back to dummy response")
-                        return get_dummy_response(user_message)
-                else:
-                    logger.error(f"Gemini API error: {response.status_code} - {response.text}")
-                    return get_dummy_response(user_message)
-                    
-            except requests.exceptions.Timeout:
-                logger.error("Request timeout")
-                return get_dummy_response(user_message)
-            except requests.exceptions.RequestException as e:
-                logger.error(f"Request failed: {e}")
-                return get_dummy_response(user_message)
-                    
-    except Exception as e:
-        logger.error(f"Error generating Gemini response: {e}")
-        return get_dummy_response(user_message)
+                ticket = admission.acquire(session_id, request.remote_addr or '', max_wait=deadline.remaining())
+            except AdmissionRejected as e:
+                return jsonify(rejection_body(e)), e.status, {'Retry-After': str(e.retry_after)}
+            g.deadline = deadline
+            in_flight.add(session_id, deadline)
+
+            def finish():
+                in_flight.discard(session_id, deadline)
+                admission.release(ticket)
+
+            try:
+                response = make_response(view(*args, **kwargs))
+            except BaseException:
+                finish()
+                raise
+            response.call_on_close(finish)
+            return response
+        return wrapper
+    return decorate
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = request.endpoint or 'unknown'
+    metrics.inc('chatbot_http_requests_total', {'endpoint': endpoint, 'status': response.status_code})
+    metrics.maybe_flush()
+    duration_ms = round((time.perf_counter() - g.get('request_started', time.perf_counter())) * 1000, 1)
+    access_logger.info(f"{request.method} {request.path} {response.status_code} {duration_ms}ms",
+                       extra={'method': request.method, 'path': request.path, 'endpoint': endpoint,
+                              'status': response.status_code, 'duration_ms': duration_ms})
+    return response
+
+@app.errorhandler(RequestEntityTooLarge)
+def request_too_large(e):
+    return jsonify(too_long_body()), 413
 
 @app.route('/')
 def index():
-    return render_template('index.html')
+    status, body, headers = index_page.respond(request.headers)
+    return Response(body, status=status, headers=headers)
 
 @app.route('/chat', methods=['POST'])
+@admitted(MAX_CHAT_BODY_BYTES)
 def chat_endpoint():
     try:
+        started = time.perf_counter()
         user_message = request.json.get('message', '').strip()
         
         if not user_message:
             return jsonify({'error': 'Message cannot be empty'}), 400
+        if message_too_long(user_message):
+            return jsonify(too_long_body()), 413
         
         # Detect language and get educational context
-        detected_language = detect_language(user_message)
-        context = get_educational_context(user_message, detected_language)
+        with metrics.timer('detect_language'):
+            detected_language = detect_language(user_message)
+        with metrics.timer('educational_context'):
+            context = get_educational_context(user_message, detected_language)
+        session_id = get_session_id()
+        with metrics.timer('prompt_assembly'):
+            prompt, summary_update = assemble_prompt(session_id, user_message, context)
         
-        if USE_GEMINI:
-            # Use Gemini API
-            response_text = generate_gemini_response(user_message, context)
-            
-            # Store in conversation history (as simple strings)
-            conversation_history.append({'role': 'user', 'content': user_message})
-            conversation_history.append({'role': 'assistant', 'content': response_text})
-        else:
-            # Use dummy responses
-            response_text = get_dummy_response(user_message)
-            
-            # Store in conversation history (as simple strings)
-            conversation_history.append({'role': 'user', 'content': user_message})
-            conversation_history.append({'role': 'assistant', 'content': response_text})
+        # Use the response cache / LLM providers (offline answers in demo mode)
+        with metrics.timer('generate'):
+            response_text, cached = generate_cached_response(user_message, context, prompt, g.deadline)
+        metrics.observe('chatbot_response_bytes', len(response_text.encode('utf-8')), {'language': detected_language})
         
-        return jsonify({
-            'response': response_text,
-            'status': 'success',
-            'mode': 'gemini' if USE_GEMINI else 'demo',
-            'language': detected_language,
-            'topic': context.get('topic', 'general')
-        })
+        # Store in the caller's conversation history, unless it was cleared meanwhile
+        if not g.deadline.cancelled:
+            with metrics.timer('history_store'):
+                save_summary(session_id, summary_update)
+                conversation_store.append_exchange(session_id, user_message, response_text)
+        
+        with metrics.timer('serialization'):
+            response = jsonify({
+                'response': response_text,
+                'status': 'success',
+                'mode': 'llm' if USE_LLM else 'demo',
+                'language': detected_language,
+                'topic': context.get('topic', 'general'),
+                'cached': cached,
+                'prompt_bytes': prompt.prompt_bytes,
+                'prompt_tokens': prompt.estimated_tokens
+            })
+        with metrics.timer('compression'):
+            body, encoding = compress_chat_body(response.get_data(), request.headers.get('Accept-Encoding'),
+                                                detected_language)
+            response.set_data(body)
+            response.headers['Vary'] = 'Accept-Encoding'
+            if encoding:
+                response.headers['Content-Encoding'] = encoding
+        metrics.observe('chatbot_stage_duration_seconds', time.perf_counter() - started, {'stage': 'chat_total'})
+        return response
         
     except Exception as e:
         logger.error(f"Error in chat endpoint: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/chat/stream', methods=['POST'])
+@admitted(MAX_CHAT_BODY_BYTES)
+def chat_stream_endpoint():
+    """Stream the answer to the browser as Server-Sent Events"""
+    started = time.perf_counter()
+    user_message = (request.get_json(silent=True) or {}).get('message', '').strip()
+    
+    if not user_message:
+        return jsonify({'error': 'Message cannot be empty'}), 400
+    if message_too_long(user_message):
+        return jsonify(too_long_body()), 413
+    
+    session_id = get_session_id()
+    detected_language = detect_language(user_message)
+    context = get_educational_context(user_message, detected_language)
+    prompt, summary_update = assemble_prompt(session_id, user_message, context)
+    
+    cache_key = get_cache_key(user_message, context) if USE_LLM and prompt.standalone else None
+    cached_text = lookup_cached_answer(user_message, context, cache_key) if cache_key else None
+    deadline = g.deadline
+    
+    def generate():
+        yield format_sse({
+            'mode': 'llm' if USE_LLM else 'demo',
+            'language': detected_language,
+            'topic': context.get('topic', 'general'),
+            'cached': cached_text is not None,
+            'prompt_bytes': prompt.prompt_bytes,
+            'prompt_tokens': prompt.estimated_tokens
+        }, event='meta')
+        
+        if cached_text is not None:
+            source = iter([cached_text])
+        else:
+            source = generate_llm_response_stream(user_message, context, cache_key=cache_key, prompt=prompt,
+                                                  deadline=deadline)
+        
+        chunks = []
+        ttfb = None
+        finished = False
+        try:
+            for chunk in source:
+                if not chunk:
+                    # Still waiting for the first chunk; writing fails once the client has gone
+                    yield ': keepalive\n\n'
+                    continue
+                if ttfb is None:
+                    ttfb = time.perf_counter() - started
+                chunks.append(chunk)
+                yield format_sse({'text': chunk})
+            finished = True
+        except Exception as e:
+            finished = True
+            logger.error(f"Error in chat stream: {e}")
+            yield format_sse({'error': str(e)}, event='error')
+            return
+        finally:
+            if not finished:
+                # The client went away: cancel the upstream request now rather than when the generator is collected
+                deadline.cancel('disconnect')
+                if hasattr(source, 'close'):
+                    source.close()
+        
+        total = time.perf_counter() - started
+        answer = ''.join(chunks)
+        if not deadline.cancelled:
+            save_summary(session_id, summary_update)
+            conversation_store.append_exchange(session_id, user_message, answer)
+        
+        metrics.observe('chatbot_stage_duration_seconds', ttfb if ttfb is not None else total, {'stage': 'stream_ttfb'})
+        metrics.observe('chatbot_stage_duration_seconds', total, {'stage': 'stream_total'})
+        metrics.observe('chatbot_response_bytes', len(answer.encode('utf-8')), {'language': detected_language})
+        ttfb_ms = round((ttfb if ttfb is not None else total) * 1000, 1)
+        total_ms = round(total * 1000, 1)
+        logger.info(f"Streamed response: ttfb={ttfb_ms}ms total={total_ms}ms chunks={len(chunks)}")
+        yield format_sse({'status': 'success', 'ttfb_ms': ttfb_ms, 'total_ms': total_ms}, event='done')
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/chat/batch', methods=['POST'])
+@admitted(MAX_CHAT_BODY_BYTES * Config.MAX_BATCH_SIZE, Config.BATCH_DEADLINE)
+def chat_batch_endpoint():
+    """
+    Answer a list of questions concurrently, streaming one NDJSON line per
+    question as soon as its answer is ready, then a summary line
+    """
+    started = time.perf_counter()
+    try:
+        messages = parse_batch_messages(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    contexts, groups = plan_batch(messages)
+    deadline = g.deadline
+    
+    def generate():
+        errors = 0
+        finished = False
+        empty = [i for i, message in enumerate(messages) if not message]
+        if empty:
+            errors += len(empty)
+            yield format_batch_results(empty, contexts, error='Message must be a non-empty string')
+        too_long = [i for i, message in enumerate(messages) if message_too_long(message)]
+        if too_long:
+            errors += len(too_long)
+            metrics.inc('chatbot_admission_rejections_total', {'reason': 'too_long'}, len(too_long))
+            yield format_batch_results(too_long, contexts, error=TOO_LONG_ERROR)
+        
+        executor = ThreadPoolExecutor(max_workers=max(1, min(Config.BATCH_CONCURRENCY, len(groups))))
+        try:
+            futures = {
+                executor.submit(answer_batch_message, messages[indexes[0]], contexts[indexes[0]], deadline): indexes
+                for indexes in groups.values()
+            }
+            for future in as_completed(futures):
+                indexes = futures[future]
+                try:
+                    response_text, cached = future.result()
+                except Exception as e:
+                    logger.error(f"Error answering batch item {indexes[0]}: {e}")
+                    errors += len(indexes)
+                    yield format_batch_results(indexes, contexts, error=str(e))
+                else:
+                    metrics.observe('chatbot_response_bytes', len(response_text.encode('utf-8')),
+                                    {'language': contexts[indexes[0]]['language']})
+                    yield format_batch_results(indexes, contexts, response_text, cached)
+            finished = True
+        finally:
+            # Drop queued work and cancel the upstream calls in flight if the client went away mid-batch
+            if not finished:
+                deadline.cancel('disconnect')
+            executor.shutdown(wait=False, cancel_futures=True)
+        
+        total = time.perf_counter() - started
+        metrics.observe('chatbot_stage_duration_seconds', total, {'stage': 'batch_total'})
+        total_ms = round(total * 1000, 1)
+        logger.info(f"Batch answered: items={len(messages)} unique={len(groups)} errors={errors} total={total_ms}ms")
+        yield format_ndjson({
+            'status': 'done',
+            'items': len(messages),
+            'unique': len(groups),
+            'errors': errors,
+            'total_ms': total_ms
+        })
+    
+    return Response(generate(), mimetype='application/x-ndjson',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/stats')
+def stats():
+    """Runtime statistics for this worker process"""
+    return jsonify({
+        'pid': os.getpid(),
+        'upstream': get_upstream_client().stats(),
+        'cache': response_cache.stats(),
+        'shared_state': shared_state.stats(),
+        'similar_questions': similar_questions.stats(),
+        'offline_answers': offline_answers.stats(),
+        'conversations': conversation_store.stats(),
+        'providers': llm_router.stats(),
+        'admission': admission.stats(),
+        'deadlines': in_flight.stats(),
+        'startup': startup.stats(),
+        'logging': logging_stats(),
+        'page': index_page.stats()
+    })
+
+@app.route('/ready')
+def ready():
+    """Readiness check: 200 once this worker has warmed its upstream connections, 503 until then"""
+    return jsonify(startup.stats()), 200 if startup.ready else 503
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus metrics for every worker sharing METRICS_DIR"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/clear', methods=['POST'])
 def clear_chat():
-    global conversation_history
-    conversation_history = []
-    return jsonify({'status': 'success', 'message': 'Chat history cleared'})
+    session_id = get_session_id()
+    # Stop answering questions from the cleared conversation
+    cancelled = in_flight.cancel(session_id, 'clear')
+    conversation_store.clear(session_id)
+    return jsonify({'status': 'success', 'message': 'Chat history cleared', 'cancelled': cancelled})
+
+def warm_up() -> None:
+    """
+    Open this worker's upstream connections before it takes traffic; gunicorn.conf.py
+    calls this in each worker after the fork, and /ready reports it
+    """
+    startup.warm_up(get_upstream_client(), [provider.url for provider in llm_router.providers],
+                    Config.UPSTREAM_WARM_CONNECTIONS)
+
+startup.loaded()
 
 if __name__ == '__main__':
+    warm_up()
     app.run(debug=True, host='0.0.0.0', port=5000)
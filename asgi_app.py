@@ -0,0 +1,532 @@
+"""
+Asyncio serving mode for the AI Teacher Chatbot.
+
+Serves the same `/`, `/chat`, `/chat/stream` and `/clear` contract as app.py,
+but upstream LLM calls and rate-limit backoff never block the worker, so a
+single process can hold hundreds of in-flight chats.
+
+    gunicorn -c gunicorn_async.conf.py asgi_app:app
+"""
+import asyncio
+import contextlib
+import functools
+import logging
+import os
+import time
+import uuid
+from typing import AsyncIterator, Callable, Dict, List, Optional
+
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.sessions import SessionMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from app import (
+    MAX_CHAT_BODY_BYTES,
+    OFFLINE_STREAM_DELAY,
+    TOO_LONG_ERROR,
+    USE_LLM,
+    admission,
+    assemble_prompt,
+    compress_chat_body,
+    detect_language,
+    format_batch_results,
+    format_ndjson,
+    format_sse,
+    get_cache_key,
+    get_educational_context,
+    get_fallback_response,
+    get_offline_response,
+    in_flight,
+    index_page,
+    llm_router,
+    lookup_cached_answer,
+    message_too_long,
+    metrics,
+    offline_answers,
+    parse_batch_messages,
+    plan_batch,
+    prompt_assembler,
+    conversation_store,
+    rejection_body,
+    request_deadline,
+    response_cache,
+    save_summary,
+    shared_state,
+    similar_questions,
+    startup,
+    store_answer,
+    too_long_body,
+)
+from admission import AdmissionRejected
+from config import Config
+from prompt_builder import AssembledPrompt
+from http_client import get_async_upstream_client
+from logging_setup import logging_stats
+from providers import ProviderError
+from resilience import Deadline
+
+logger = logging.getLogger(__name__)
+access_logger = logging.getLogger('chatbot.access')
+
+
+async def call_llm_async(user_message: str, context: Dict[str, str], prompt: Optional[AssembledPrompt] = None,
+                         deadline: Optional[Deadline] = None) -> Optional[str]:
+    """Non-blocking call_llm: returns None if no answer could be generated before the deadline"""
+    if prompt is None:
+        prompt, _ = prompt_assembler.assemble(user_message, context)
+    try:
+        return await llm_router.acomplete(prompt.request, deadline)
+    except Exception as e:
+        logger.error(f"Error generating LLM response: {e}")
+        return None
+
+
+async def generate_cached_response_async(user_message: str, context: Dict[str, str],
+                                         prompt: Optional[AssembledPrompt] = None,
+                                         deadline: Optional[Deadline] = None):
+    """Async generate_cached_response: returns (response_text, served_from_cache)"""
+    if not USE_LLM:
+        return get_offline_response(user_message, context), False
+
+    cache_key = get_cache_key(user_message, context) if prompt is None or prompt.standalone else None
+    if cache_key:
+        cached = lookup_cached_answer(user_message, context, cache_key)
+        if cached is not None:
+            return cached, True
+
+    with metrics.timer('llm'):
+        response_text = await call_llm_async(user_message, context, prompt, deadline)
+    if response_text is None:
+        return get_fallback_response(user_message, context, cache_key is None)
+
+    if cache_key:
+        store_answer(user_message, context, cache_key, response_text)
+    return response_text, False
+
+
+async def stream_offline_response_async(user_message: str,
+                                        context: Optional[Dict[str, str]] = None) -> AsyncIterator[str]:
+    words = get_offline_response(user_message, context).split(' ')
+    for i, word in enumerate(words):
+        if i > 0 and OFFLINE_STREAM_DELAY > 0:
+            await asyncio.sleep(OFFLINE_STREAM_DELAY)
+        yield word if i == 0 else ' ' + word
+
+
+async def generate_llm_response_stream_async(user_message: str, context: Dict[str, str],
+                                             cache_key: Optional[str] = None,
+                                             prompt: Optional[AssembledPrompt] = None,
+                                             deadline: Optional[Deadline] = None) -> AsyncIterator[str]:
+    """Async generate_llm_response_stream"""
+    if not USE_LLM:
+        async for chunk in stream_offline_response_async(user_message, context):
+            yield chunk
+        return
+
+    if prompt is None:
+        prompt, _ = prompt_assembler.assemble(user_message, context)
+
+    chunks = []
+    try:
+        async for text in llm_router.astream(prompt.request, deadline, heartbeat=Config.STREAM_HEARTBEAT or None):
+            if text:
+                chunks.append(text)
+            yield text
+    except ProviderError as e:
+        logger.error(f"Streaming request failed: {e}")
+        return
+    if chunks:
+        # A cancelled stream (/clear) ends early without an error: its text is only part of the answer
+        if cache_key and (deadline is None or not deadline.cancelled):
+            store_answer(user_message, context, cache_key, ''.join(chunks))
+        return
+
+    cached = lookup_cached_answer(user_message, context, get_cache_key(user_message, context)) \
+        if cache_key is None else None
+    metrics.inc('chatbot_fallbacks_total', {'source': 'cache' if cached is not None else 'offline'})
+    shared_state.add('fallbacks')
+    if cached is not None:
+        yield cached
+    else:
+        async for chunk in stream_offline_response_async(user_message, context):
+            yield chunk
+
+
+def get_session_id(request: Request) -> str:
+    """Return the caller's session ID, issuing one in the session cookie if needed"""
+    session_id = request.session.get('sid')
+    if not session_id:
+        session_id = uuid.uuid4().hex
+        request.session['sid'] = session_id
+    return session_id
+
+
+class AdmittedResponse:
+    """Sends the wrapped response, then frees its admission slot (also if the client went away)"""
+
+    def __init__(self, response: Response, finish: Callable[[], None]):
+        self.response = response
+        self.finish = finish
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await self.response(scope, receive, send)
+        finally:
+            self.finish()
+            # A stream abandoned mid-answer: close it now so its upstream requests are cancelled
+            body_iterator = getattr(self.response, 'body_iterator', None)
+            if hasattr(body_iterator, 'aclose'):
+                await body_iterator.aclose()
+
+
+async def cancel_on_disconnect(request: Request, deadline: Deadline) -> None:
+    """Cancel the request's deadline when its client disconnects; start it once the body has been read"""
+    while (await request.receive())['type'] != 'http.disconnect':
+        pass
+    deadline.cancel('disconnect')
+
+
+def admitted(max_body_bytes: int, deadline_cap: float = Config.REQUEST_DEADLINE):
+    """
+    Async counterpart of app.admitted for Starlette endpoints; the deadline is in
+    request.state.deadline and is also cancelled when the client disconnects
+    """
+    def decorate(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(request: Request):
+            content_length = request.headers.get('content-length', '')
+            if content_length.isdigit() and int(content_length) > max_body_bytes:
+                return JSONResponse(too_long_body(), status_code=413)
+            deadline = request_deadline(request.headers.get('x-request-timeout'), deadline_cap)
+            session_id = get_session_id(request)
+            client_ip = request.client.host if request.client else ''
+            try:
+                ticket = await admission.aacquire(session_id, client_ip, max_wait=deadline.remaining())
+            except AdmissionRejected as e:
+                return JSONResponse(rejection_body(e), status_code=e.status,
+                                    headers={'Retry-After': str(e.retry_after)})
+            request.state.deadline = deadline
+            in_flight.add(session_id, deadline)
+            watcher = None
+
+            def finish():
+                if watcher is not None:
+                    watcher.cancel()
+                in_flight.discard(session_id, deadline)
+                admission.release(ticket)
+
+            try:
+                # Read the body first: after that the only message left to receive is the disconnect.
+                # A client that goes away before sending it raises ClientDisconnect, which must free the slot too.
+                await request.body()
+                watcher = asyncio.ensure_future(cancel_on_disconnect(request, deadline))
+                response = await endpoint(request)
+            except BaseException:
+                finish()
+                raise
+            return AdmittedResponse(response, finish)
+        return wrapper
+    return decorate
+
+
+async def read_message(request: Request) -> str:
+    try:
+        data = await request.json()
+    except ValueError:
+        data = {}
+    return (data.get('message', '') if isinstance(data, dict) else '').strip()
+
+
+async def index(request: Request):
+    status, body, headers = index_page.respond(request.headers)
+    return Response(body, status_code=status, headers=headers)
+
+
+@admitted(MAX_CHAT_BODY_BYTES)
+async def chat_endpoint(request: Request):
+    try:
+        started = time.perf_counter()
+        user_message = await read_message(request)
+
+        if not user_message:
+            return JSONResponse({'error': 'Message cannot be empty'}, status_code=400)
+        if message_too_long(user_message):
+            return JSONResponse(too_long_body(), status_code=413)
+
+        with metrics.timer('detect_language'):
+            detected_language = detect_language(user_message)
+        with metrics.timer('educational_context'):
+            context = get_educational_context(user_message, detected_language)
+        session_id = get_session_id(request)
+        with metrics.timer('prompt_assembly'):
+            prompt, summary_update = assemble_prompt(session_id, user_message, context)
+
+        with metrics.timer('generate'):
+            response_text, cached = await generate_cached_response_async(user_message, context, prompt,
+                                                                         request.state.deadline)
+        metrics.observe('chatbot_response_bytes', len(response_text.encode('utf-8')), {'language': detected_language})
+
+        if not request.state.deadline.cancelled:
+            with metrics.timer('history_store'):
+                save_summary(session_id, summary_update)
+                conversation_store.append_exchange(session_id, user_message, response_text)
+
+        with metrics.timer('serialization'):
+            response = JSONResponse({
+                'response': response_text,
+                'status': 'success',
+                'mode': 'llm' if USE_LLM else 'demo',
+                'language': detected_language,
+                'topic': context.get('topic', 'general'),
+                'cached': cached,
+                'prompt_bytes': prompt.prompt_bytes,
+                'prompt_tokens': prompt.estimated_tokens
+            })
+        with metrics.timer('compression'):
+            response.body, encoding = compress_chat_body(response.body, request.headers.get('accept-encoding'),
+                                                         detected_language)
+            response.headers['Content-Length'] = str(len(response.body))
+            response.headers['Vary'] = 'Accept-Encoding'
+            if encoding:
+                response.headers['Content-Encoding'] = encoding
+        metrics.observe('chatbot_stage_duration_seconds', time.perf_counter() - started, {'stage': 'chat_total'})
+        return response
+
+    except Exception as e:
+        logger.error(f"Error in chat endpoint: {e}")
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+
+@admitted(MAX_CHAT_BODY_BYTES)
+async def chat_stream_endpoint(request: Request):
+    started = time.perf_counter()
+    user_message = await read_message(request)
+
+    if not user_message:
+        return JSONResponse({'error': 'Message cannot be empty'}, status_code=400)
+    if message_too_long(user_message):
+        return JSONResponse(too_long_body(), status_code=413)
+
+    session_id = get_session_id(request)
+    detected_language = detect_language(user_message)
+    context = get_educational_context(user_message, detected_language)
+    prompt, summary_update = assemble_prompt(session_id, user_message, context)
+    cache_key = get_cache_key(user_message, context) if USE_LLM and prompt.standalone else None
+    cached_text = lookup_cached_answer(user_message, context, cache_key) if cache_key else None
+    deadline = request.state.deadline
+
+    async def generate():
+        yield format_sse({
+            'mode': 'llm' if USE_LLM else 'demo',
+            'language': detected_language,
+            'topic': context.get('topic', 'general'),
+            'cached': cached_text is not None,
+            'prompt_bytes': prompt.prompt_bytes,
+            'prompt_tokens': prompt.estimated_tokens
+        }, event='meta')
+
+        chunks = []
+        ttfb = None
+        source = None
+        finished = False
+        try:
+            if cached_text is not None:
+                ttfb = time.perf_counter() - started
+                chunks.append(cached_text)
+                yield format_sse({'text': cached_text})
+            else:
+                source = generate_llm_response_stream_async(user_message, context, cache_key=cache_key,
+                                                            prompt=prompt, deadline=deadline)
+                async for chunk in source:
+                    if not chunk:
+                        # Still waiting for the first chunk; writing fails once the client has gone
+                        yield ': keepalive\n\n'
+                        continue
+                    if ttfb is None:
+                        ttfb = time.perf_counter() - started
+                    chunks.append(chunk)
+                    yield format_sse({'text': chunk})
+            finished = True
+        except Exception as e:
+            finished = True
+            logger.error(f"Error in chat stream: {e}")
+            yield format_sse({'error': str(e)}, event='error')
+            return
+        finally:
+            if not finished:
+                # The client went away: cancel the upstream request now rather than when the generator is collected
+                deadline.cancel('disconnect')
+                if source is not None:
+                    await source.aclose()
+
+        total = time.perf_counter() - started
+        answer = ''.join(chunks)
+        if not deadline.cancelled:
+            save_summary(session_id, summary_update)
+            conversation_store.append_exchange(session_id, user_message, answer)
+
+        metrics.observe('chatbot_stage_duration_seconds', ttfb if ttfb is not None else total, {'stage': 'stream_ttfb'})
+        metrics.observe('chatbot_stage_duration_seconds', total, {'stage': 'stream_total'})
+        metrics.observe('chatbot_response_bytes', len(answer.encode('utf-8')), {'language': detected_language})
+
+        ttfb_ms = round((ttfb if ttfb is not None else total) * 1000, 1)
+        total_ms = round(total * 1000, 1)
+        logger.info(f"Streamed response: ttfb={ttfb_ms}ms total={total_ms}ms chunks={len(chunks)}")
+        yield format_sse({'status': 'success', 'ttfb_ms': ttfb_ms, 'total_ms': total_ms}, event='done')
+
+    return StreamingResponse(generate(), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@admitted(MAX_CHAT_BODY_BYTES * Config.MAX_BATCH_SIZE, Config.BATCH_DEADLINE)
+async def chat_batch_endpoint(request: Request):
+    started = time.perf_counter()
+    try:
+        messages = parse_batch_messages(await request.json())
+    except ValueError as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+
+    contexts, groups = plan_batch(messages)
+    semaphore = asyncio.Semaphore(Config.BATCH_CONCURRENCY)
+    deadline = request.state.deadline
+
+    async def answer(indexes: List[int]):
+        message, context = messages[indexes[0]], contexts[indexes[0]]
+        async with semaphore:
+            try:
+                prompt, _ = prompt_assembler.assemble(message, context)
+                response_text, cached = await generate_cached_response_async(message, context, prompt, deadline)
+            except Exception as e:
+                logger.error(f"Error answering batch item {indexes[0]}: {e}")
+                return format_batch_results(indexes, contexts, error=str(e)), len(indexes)
+        metrics.observe('chatbot_response_bytes', len(response_text.encode('utf-8')), {'language': context['language']})
+        return format_batch_results(indexes, contexts, response_text, cached), 0
+
+    async def generate():
+        errors = 0
+        finished = False
+        empty = [i for i, message in enumerate(messages) if not message]
+        if empty:
+            errors += len(empty)
+            yield format_batch_results(empty, contexts, error='Message must be a non-empty string')
+        too_long = [i for i, message in enumerate(messages) if message_too_long(message)]
+        if too_long:
+            errors += len(too_long)
+            metrics.inc('chatbot_admission_rejections_total', {'reason': 'too_long'}, len(too_long))
+            yield format_batch_results(too_long, contexts, error=TOO_LONG_ERROR)
+
+        tasks = [asyncio.ensure_future(answer(indexes)) for indexes in groups.values()]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                lines, failed = await next_done
+                errors += failed
+                yield lines
+            finished = True
+        finally:
+            # Drop remaining work and cancel the upstream calls in flight if the client went away mid-batch
+            if not finished:
+                deadline.cancel('disconnect')
+            for task in tasks:
+                task.cancel()
+
+        total = time.perf_counter() - started
+        metrics.observe('chatbot_stage_duration_seconds', total, {'stage': 'batch_total'})
+        total_ms = round(total * 1000, 1)
+        logger.info(f"Batch answered: items={len(messages)} unique={len(groups)} errors={errors} total={total_ms}ms")
+        yield format_ndjson({
+            'status': 'done',
+            'items': len(messages),
+            'unique': len(groups),
+            'errors': errors,
+            'total_ms': total_ms
+        })
+
+    return StreamingResponse(generate(), media_type='application/x-ndjson',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+async def stats(request: Request):
+    return JSONResponse({
+        'pid': os.getpid(),
+        'upstream': get_async_upstream_client().stats(),
+        'cache': response_cache.stats(),
+        'shared_state': shared_state.stats(),
+        'similar_questions': similar_questions.stats(),
+        'offline_answers': offline_answers.stats(),
+        'conversations': conversation_store.stats(),
+        'providers': llm_router.stats(),
+        'admission': admission.stats(),
+        'deadlines': in_flight.stats(),
+        'startup': startup.stats(),
+        'logging': logging_stats(),
+        'page': index_page.stats()
+    })
+
+
+async def ready(request: Request):
+    return JSONResponse(startup.stats(), status_code=200 if startup.ready else 503)
+
+
+async def metrics_endpoint(request: Request):
+    return PlainTextResponse(metrics.render(), media_type='text/plain; version=0.0.4')
+
+
+async def clear_chat(request: Request):
+    session_id = get_session_id(request)
+    cancelled = in_flight.cancel(session_id, 'clear')
+    conversation_store.clear(session_id)
+    return JSONResponse({'status': 'success', 'message': 'Chat history cleared', 'cancelled': cancelled})
+
+
+class MetricsMiddleware:
+    """Count and access-log responses by endpoint and status, like the Flask app's after_request hook"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+
+        async def send_with_metrics(message):
+            if message['type'] == 'http.response.start':
+                endpoint = getattr(scope.get('endpoint'), '__name__', 'unknown')
+                status = message['status']
+                metrics.inc('chatbot_http_requests_total', {'endpoint': endpoint, 'status': status})
+                metrics.maybe_flush()
+                duration_ms = round((time.perf_counter() - started) * 1000, 1)
+                access_logger.info(f"{scope['method']} {scope['path']} {status} {duration_ms}ms",
+                                   extra={'method': scope['method'], 'path': scope['path'], 'endpoint': endpoint,
+                                          'status': status, 'duration_ms': duration_ms})
+            await send(message)
+
+        await self.app(scope, receive, send_with_metrics)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    # Connections belong to the worker's event loop, so they are warmed here rather than in the master
+    await startup.awarm_up(get_async_upstream_client(), [provider.url for provider in llm_router.providers],
+                           Config.UPSTREAM_WARM_CONNECTIONS)
+    yield
+
+
+app = Starlette(lifespan=lifespan, middleware=[
+    Middleware(MetricsMiddleware),
+    Middleware(SessionMiddleware, secret_key=Config.SECRET_KEY)
+], routes=[
+    Route('/', index),
+    Route('/chat', chat_endpoint, methods=['POST']),
+    Route('/chat/stream', chat_stream_endpoint, methods=['POST']),
+    Route('/chat/batch', chat_batch_endpoint, methods=['POST']),
+    Route('/stats', stats),
+    Route('/ready', ready),
+    Route('/metrics', metrics_endpoint),
+    Route('/clear', clear_chat, methods=['POST']),
+])
@@ -0,0 +1,208 @@
+"""
+Microbenchmark: precompiled classifier vs the original per-request implementation.
+
+Checks that both give identical results on a generated multilingual corpus,
+then times language + topic detection for message lengths up to
+Config.MAX_MESSAGE_LENGTH.
+
+    python benchmarks/bench_classifier.py [--json results.json]
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import timeit
+from typing import Dict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config  # noqa: E402
+from classifier import LanguageTopicClassifier  # noqa: E402
+from bench_utils import write_results  # noqa: E402
+
+
+def legacy_detect_language(text: str) -> str:
+    """detect_language as it was before the precompiled classifier"""
+    # Remove punctuation and convert to lowercase for better detection
+    clean_text = re.sub(r'[^\w\s]', '', text.lower())
+    
+    # Language-specific character patterns
+    devanagari_chars = len(re.findall(r'[\u0900-\u097F]', text))
+    telugu_chars = len(re.findall(r'[\u0C00-\u0C7F]', text))
+    tamil_chars = len(re.findall(r'[\u0B80-\u0BFF]', text))
+    
+    # Common words in each language for better detection
+    hindi_words = ['क्या', 'है', 'में', 'के', 'का', 'की', 'और', 'या', 'नहीं', 'हैं']
+    telugu_words = ['ఏమిటి', 'అంటే', 'లో', 'కి', 'గా', 'మరియు', 'లేదా', 'కాదు', 'ఉన్నాయి']
+    tamil_words = ['என்ன', 'ஆகும்', 'இல்', 'க்கு', 'ஆக', 'மற்றும்', 'அல்லது', 'இல்லை', 'உள்ளன']
+    
+    # Count language-specific words
+    hindi_word_count = sum(1 for word in hindi_words if word in clean_text)
+    telugu_word_count = sum(1 for word in telugu_words if word in clean_text)
+    tamil_word_count = sum(1 for word in tamil_words if word in clean_text)
+    
+    # Determine language based on character count and word frequency
+    if devanagari_chars > 0 or hindi_word_count > 0:
+        return 'hindi'
+    elif telugu_chars > 0 or telugu_word_count > 0:
+        return 'telugu'
+    elif tamil_chars > 0 or tamil_word_count > 0:
+        return 'tamil'
+    else:
+        return 'english'
+
+def legacy_get_educational_context(user_message: str, language: str) -> Dict[str, str]:
+    """get_educational_context as it was before the precompiled classifier"""
+    # Common educational topics and their keywords
+    topics = {
+        'science': ['physics', 'chemistry', 'biology', 'experiment', 'theory', 'law', 'molecule', 'atom'],
+        'mathematics': ['math', 'equation', 'formula', 'calculation', 'geometry', 'algebra', 'calculus'],
+        'history': ['history', 'ancient', 'civilization', 'war', 'king', 'empire', 'century'],
+        'geography': ['geography', 'country', 'continent', 'ocean', 'mountain', 'river', 'climate'],
+        'literature': ['literature', 'poem', 'story', 'novel', 'author', 'writing', 'poetry']
+    }
+    
+    # Language-specific topic keywords
+    hindi_topics = {
+        'science': ['विज्ञान', 'भौतिकी', 'रसायन', 'जीवविज्ञान', 'प्रयोग', 'सिद्धांत'],
+        'mathematics': ['गणित', 'समीकरण', 'सूत्र', 'ज्यामिति', 'बीजगणित'],
+        'history': ['इतिहास', 'प्राचीन', 'सभ्यता', 'युद्ध', 'राजा', 'साम्राज्य'],
+        'geography': ['भूगोल', 'देश', 'महाद्वीप', 'समुद्र', 'पहाड़', 'नदी'],
+        'literature': ['साहित्य', 'कविता', 'कहानी', 'उपन्यास', 'लेखक']
+    }
+    
+    telugu_topics = {
+        'science': ['విజ్ఞానం', 'భౌతిక శాస్త్రం', 'రసాయన శాస్త్రం', 'జీవ శాస్త్రం', 'ప్రయోగం'],
+        'mathematics': ['గణితం', 'సమీకరణం', 'సూత్రం', 'జ్యామితి', 'బీజగణితం'],
+        'history': ['చరిత్ర', 'ప్రాచీన', 'నాగరికత', 'యుద్ధం', 'రాజు'],
+        'geography': ['భూగోళం', 'దేశం', 'ఖండం', 'సముద్రం', 'పర్వతం'],
+        'literature': ['సాహిత్యం', 'కవిత', 'కథ', 'నవల', 'రచయిత']
+    }
+    
+    tamil_topics = {
+        'science': ['அறிவியல்', 'இயற்பியல்', 'வேதியியல்', 'உயிரியல்', 'சோதனை'],
+        'mathematics': ['கணிதம்', 'சமன்பாடு', 'சூத்திரம்', 'வடிவியல்', 'இயற்கணிதம்'],
+        'history': ['வரலாறு', 'பண்டைய', 'நாகரிகம்', 'போர்', 'அரசன்'],
+        'geography': ['புவியியல்', 'நாடு', 'கண்டம்', 'கடல்', 'மலை'],
+        'literature': ['இலக்கியம்', 'கவிதை', 'கதை', 'நாவல்', 'எழுத்தாளர்']
+    }
+    
+    # Select appropriate topic keywords based on language
+    if language == 'hindi':
+        topic_keywords = hindi_topics
+    elif language == 'telugu':
+        topic_keywords = telugu_topics
+    elif language == 'tamil':
+        topic_keywords = tamil_topics
+    else:
+        topic_keywords = topics
+    
+    # Detect topic from user message
+    detected_topic = 'general'
+    max_matches = 0
+    
+    for topic, keywords in topic_keywords.items():
+        matches = sum(1 for keyword in keywords if keyword.lower() in user_message.lower())
+        if matches > max_matches:
+            max_matches = matches
+            detected_topic = topic
+    
+    return {
+        'topic': detected_topic,
+        'language': language,
+        'message_length': len(user_message)
+    }
+
+
+FILLER = {
+    'english': ['what', 'is', 'the', 'how', 'does', 'explain', 'please', 'and', 'why', 'of', '?', ','],
+    'hindi': ['क्या', 'है', 'में', 'के', 'का', 'और', 'कैसे', 'बताएं', '?', '।'],
+    'telugu': ['ఏమిటి', 'అంటే', 'లో', 'మరియు', 'ఎలా', 'వివరించండి', '?'],
+    'tamil': ['என்ன', 'மற்றும்', 'எப்படி', 'விளக்கவும்', 'இல்லை', '?']
+}
+
+
+def random_message(rng: random.Random, length: int, language: str = None) -> str:
+    """Build a message of `length` characters mixing filler and topic keywords"""
+    language = language or rng.choice(list(FILLER))
+    keywords = [kw for lang_keywords in Config.EDUCATIONAL_TOPICS.values()
+                for kw in lang_keywords.get(language, [])]
+    words = []
+    size = 0
+    while size < length:
+        pool = keywords if rng.random() < 0.25 else FILLER[language]
+        # Occasionally mix in English words
+        if rng.random() < 0.05:
+            pool = FILLER['english']
+        word = rng.choice(pool)
+        if rng.random() < 0.1:
+            word = word.upper()
+        words.append(word)
+        size += len(word) + 1
+    return ' '.join(words)[:length]
+
+
+def check_equivalence(classifier: LanguageTopicClassifier, samples: int = 1000) -> int:
+    rng = random.Random(1234)
+    for i in range(samples):
+        message = random_message(rng, rng.randint(1, Config.MAX_MESSAGE_LENGTH))
+        expected_language = legacy_detect_language(message)
+        actual_language = classifier.detect_language(message)
+        if expected_language != actual_language:
+            raise AssertionError(f"Language mismatch for {message!r}: {expected_language} != {actual_language}")
+        for language in Config.SUPPORTED_LANGUAGES:
+            expected = legacy_get_educational_context(message, language)
+            actual = classifier.get_context(message, language)
+            if expected != actual:
+                raise AssertionError(f"Context mismatch for {message!r} ({language}): {expected} != {actual}")
+    return samples
+
+
+def bench(func, number: int) -> float:
+    """Best of 5 runs, in microseconds per call"""
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--json', help='Write results to this file')
+    parser.add_argument('--samples', type=int, default=1000, help='Messages used for the equivalence check')
+    args = parser.parse_args()
+
+    classifier = LanguageTopicClassifier()
+    print(f"Equivalence check: {check_equivalence(classifier, args.samples)} messages identical")
+
+    rng = random.Random(42)
+    lengths = [16, 64, 256, 1024, Config.MAX_MESSAGE_LENGTH]
+    results = []
+    print(f"{'length':>7} {'language':>9} {'legacy us':>10} {'new us':>8} {'speedup':>8}")
+    for length in lengths:
+        for language in FILLER:
+            message = random_message(rng, length, language)
+            number = max(20, 20000 // length)
+
+            def legacy():
+                legacy_get_educational_context(message, legacy_detect_language(message))
+
+            def new():
+                classifier.classify(message)
+
+            legacy_us = bench(legacy, number)
+            new_us = bench(new, number)
+            results.append({'length': length, 'language': language,
+                            'legacy_us': round(legacy_us, 2), 'new_us': round(new_us, 2)})
+            print(f"{length:>7} {language:>9} {legacy_us:>10.2f} {new_us:>8.2f} {legacy_us / new_us:>7.1f}x")
+
+    batch = [random_message(rng, rng.randint(16, 256)) for _ in range(100)]
+    batch_legacy = bench(lambda: [legacy_get_educational_context(m, legacy_detect_language(m)) for m in batch], 20)
+    batch_new = bench(lambda: classifier.classify_many(batch), 20)
+    print(f"batch of 100: legacy {batch_legacy:.1f}us, classify_many {batch_new:.1f}us")
+
+    if args.json:
+        write_results(args.json, {'benchmark': 'classifier', 'results': results,
+                                  'batch_100': {'legacy_us': round(batch_legacy, 2), 'new_us': round(batch_new, 2)}})
+
+
+if __name__ == '__main__':
+    main()
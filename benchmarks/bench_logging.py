@@ -0,0 +1,129 @@
+"""
+Per-request logging overhead: the original basicConfig setup vs the queue pipeline.
+
+The original setup formats and writes every record to chatbot.log and stderr
+on the calling thread. The pipeline (logging_setup.py) only renders the
+message and enqueues it; a listener thread does the JSON encoding and I/O.
+Each simulated request logs what a /chat request logs (an access line and an
+info line) and every 20th request also logs an upstream error with a large
+response body. Timings are for the logging calls on the request thread only.
+
+    python benchmarks/bench_logging.py --requests 20000 --threads 8
+"""
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import logging_setup  # noqa: E402
+from bench_utils import write_results  # noqa: E402
+
+ERROR_BODY = json.dumps({'error': {'code': 500, 'message': 'Internal error. ' * 1500}})
+
+
+def configure_legacy(log_file: str, stream) -> None:
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[logging.FileHandler(log_file), logging.StreamHandler(stream)],
+        force=True
+    )
+
+
+def configure_pipeline(log_file: str, stream, sample_rate: float) -> None:
+    logging_setup.setup_logging(log_file=log_file, access_sample_rate=sample_rate)
+    # Keep the terminal quiet: point the listener's stderr handler at the sink
+    for handler in logging_setup._handlers:
+        if isinstance(handler, logging.StreamHandler) and not isinstance(handler, logging.FileHandler):
+            handler.setStream(stream)
+
+
+def simulate(requests_per_thread: int, threads: int, legacy: bool) -> List[float]:
+    logger = logging.getLogger('app')
+    access_logger = logging.getLogger('chatbot.access')
+    timings: List[float] = []
+    lock = threading.Lock()
+
+    def worker(offset: int):
+        local = []
+        for i in range(requests_per_thread):
+            n = offset + i
+            started = time.perf_counter()
+            logger.info("Streamed response: ttfb=120.5ms total=830.2ms chunks=8")
+            if n % 20 == 0:
+                body = ERROR_BODY if legacy else logging_setup.truncate(ERROR_BODY)
+                logger.error(f"Gemini API error: 500 - {body}")
+            access_logger.info("POST /chat 200 830.2ms",
+                               extra={'method': 'POST', 'path': '/chat', 'endpoint': 'chat_endpoint',
+                                      'status': 200, 'duration_ms': 830.2})
+            local.append(time.perf_counter() - started)
+        with lock:
+            timings.extend(local)
+
+    pool = [threading.Thread(target=worker, args=(t * requests_per_thread,)) for t in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return timings
+
+
+def summarize(timings: List[float], log_file: str) -> Dict:
+    ordered = sorted(timings)
+    return {
+        'mean_us': round(statistics.fmean(ordered) * 1e6, 2),
+        'p50_us': round(ordered[len(ordered) // 2] * 1e6, 2),
+        'p99_us': round(ordered[int(len(ordered) * 0.99)] * 1e6, 2),
+        'log_bytes': os.path.getsize(log_file)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=20000, help='Simulated requests in total')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--sample-rate', type=float, default=0.1, help='Access-line sample rate for the pipeline')
+    parser.add_argument('--json', help='Write results to this file')
+    args = parser.parse_args()
+
+    per_thread = max(1, args.requests // args.threads)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp, open(os.devnull, 'w') as sink:
+        legacy_file = os.path.join(tmp, 'legacy.log')
+        configure_legacy(legacy_file, sink)
+        timings = simulate(per_thread, args.threads, legacy=True)
+        logging.shutdown()
+        results['basicConfig'] = summarize(timings, legacy_file)
+
+        pipeline_file = os.path.join(tmp, 'pipeline.log')
+        configure_pipeline(pipeline_file, sink, args.sample_rate)
+        timings = simulate(per_thread, args.threads, legacy=False)
+        logging_setup._stop_listener()  # drain the queue before measuring the file
+        results['queue_pipeline'] = summarize(timings, pipeline_file)
+        results['queue_pipeline']['dropped'] = logging_setup.logging_stats()['dropped']
+
+    print(f"{per_thread * args.threads} requests on {args.threads} threads "
+          f"(per-request logging time on the request thread)")
+    for name, r in results.items():
+        print(f"{name:>15}: mean {r['mean_us']:>8.2f}us  p50 {r['p50_us']:>8.2f}us  "
+              f"p99 {r['p99_us']:>9.2f}us  log {r['log_bytes'] / 1024:>9.1f} KiB")
+
+    if args.json:
+        write_results(args.json, {'benchmark': 'logging', 'requests': per_thread * args.threads,
+                                  'threads': args.threads, 'sample_rate': args.sample_rate, 'results': results})
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""
+Benchmark the offline answer engine (BM25 over knowledge_base/).
+
+Times the index build, a cold load of the memory-mapped index, and query
+latency per language, and checks retrieval accuracy on a set of labelled
+questions (top-1 explanation, or no answer for off-syllabus questions).
+
+    python benchmarks/bench_offline_answers.py [--json results.json]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config  # noqa: E402
+from classifier import classifier  # noqa: E402
+from offline_answers import OfflineAnswerEngine, build_index, write_index  # noqa: E402
+from bench_utils import percentile, write_results  # noqa: E402
+
+# (question, expected entry id or None when nothing should match)
+LABELLED = {
+    'english': [
+        ('what is photosynthesis', 'photosynthesis'),
+        ('how do plants make food from sunlight', 'photosynthesis'),
+        ("explain newton's third law", 'newtons_laws'),
+        ('what is inertia', 'newtons_laws'),
+        ('what are protons and electrons', 'atom_structure'),
+        ('why does ice melt into water', 'states_of_matter'),
+        ('pythagoras theorem with example', 'pythagorean_theorem'),
+        ('how to solve a quadratic equation', 'quadratic_equations'),
+        ('how do I add fractions', 'fractions'),
+        ('tell me about harappa and mohenjo-daro', 'indus_valley_civilization'),
+        ('who built the taj mahal', 'mughal_empire'),
+        ('when did india get independence', 'indian_independence'),
+        ('explain evaporation and condensation', 'water_cycle'),
+        ('why does it rain in june', 'monsoon'),
+        ('how many continents are there', 'continents_and_oceans'),
+        ('what is the plot of a story', 'elements_of_a_story'),
+        ('difference between simile and metaphor', 'figures_of_speech'),
+        ('how should I revise for exams', 'how_to_study'),
+        ('what is a black hole', None),
+        ('who won the cricket world cup', None),
+    ],
+    'hindi': [
+        ('प्रकाश संश्लेषण क्या है', 'photosynthesis'),
+        ('न्यूटन का तीसरा नियम समझाइए', 'newtons_laws'),
+        ('परमाणु की संरचना बताइए', 'atom_structure'),
+        ('पाइथागोरस प्रमेय क्या है', 'pythagorean_theorem'),
+        ('भिन्न कैसे जोड़ते हैं', 'fractions'),
+        ('सिंधु घाटी सभ्यता के बारे में बताइए', 'indus_valley_civilization'),
+        ('ताजमहल किसने बनवाया', 'mughal_empire'),
+        ('जल चक्र समझाइए', 'water_cycle'),
+        ('मानसून क्या है', 'monsoon'),
+        ('उपमा और रूपक अलंकार में अंतर', 'figures_of_speech'),
+        ('परीक्षा की तैयारी कैसे करें', 'how_to_study'),
+        ('ब्लैक होल क्या है', None),
+    ],
+    'telugu': [
+        ('కిరణజన్య సంయోగక్రియ అంటే ఏమిటి', 'photosynthesis'),
+        ('న్యూటన్ గమన నియమాలు వివరించండి', 'newtons_laws'),
+        ('పైథాగరస్ సిద్ధాంతం అంటే ఏమిటి', 'pythagorean_theorem'),
+        ('వర్గ సమీకరణాలు ఎలా సాధించాలి', 'quadratic_equations'),
+        ('మొఘల్ సామ్రాజ్యం గురించి చెప్పండి', 'mughal_empire'),
+        ('భారత స్వాతంత్ర్య పోరాటం గురించి చెప్పండి', 'indian_independence'),
+        ('రుతుపవనాలు అంటే ఏమిటి', 'monsoon'),
+        ('ఖండాలు ఎన్ని ఉన్నాయి', 'continents_and_oceans'),
+        ('కథలోని పాత్రలు మరియు నేపథ్యం', 'elements_of_a_story'),
+        ('కృష్ణ బిలం అంటే ఏమిటి', None),
+    ],
+    'tamil': [
+        ('ஒளிச்சேர்க்கை என்றால் என்ன', 'photosynthesis'),
+        ('நியூட்டனின் இயக்க விதிகளை விளக்கவும்', 'newtons_laws'),
+        ('அணுவின் அமைப்பு பற்றி சொல்லுங்கள்', 'atom_structure'),
+        ('திண்மம் திரவம் வாயு', 'states_of_matter'),
+        ('பின்னங்களை எப்படி கூட்டுவது', 'fractions'),
+        ('சிந்து சமவெளி நாகரிகம் பற்றி', 'indus_valley_civilization'),
+        ('நீர் சுழற்சி என்றால் என்ன', 'water_cycle'),
+        ('உவமை அணி என்றால் என்ன', 'figures_of_speech'),
+        ('தேர்வுக்கு எப்படி படிப்பது', 'how_to_study'),
+        ('கருந்துளை என்றால் என்ன', None),
+    ],
+}
+
+
+def summary_us(latencies: List[float]) -> dict:
+    return {
+        'p50_us': round(percentile(latencies, 50) * 1e6, 1),
+        'p99_us': round(percentile(latencies, 99) * 1e6, 1),
+        'max_us': round(max(latencies, default=0) * 1e6, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--json', help='Write results to this file')
+    parser.add_argument('--kb', default=Config.KNOWLEDGE_BASE_DIR, help='Knowledge base directory')
+    parser.add_argument('--repeat', type=int, default=200, help='Times each question is asked')
+    args = parser.parse_args()
+
+    builds = []
+    for _ in range(5):
+        started = time.perf_counter()
+        build_index(args.kb)
+        builds.append(time.perf_counter() - started)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        index_path = os.path.join(tmp, 'knowledge_base.idx')
+        index_bytes = write_index(args.kb, index_path)
+        loads = []
+        for _ in range(20):
+            started = time.perf_counter()
+            engine = OfflineAnswerEngine(args.kb, index_path, Config.OFFLINE_MIN_SCORE)
+            loads.append(time.perf_counter() - started)
+        stats = engine.stats()
+        print(f"index: {stats['documents']} documents, {stats['terms']} terms, {index_bytes} bytes; "
+              f"build {min(builds) * 1000:.1f}ms, load {min(loads) * 1000:.2f}ms")
+
+        results = []
+        misses = []
+        print(f"{'language':>9} {'questions':>9} {'accuracy':>9} {'p50 us':>8} {'p99 us':>8}")
+        for language, questions in LABELLED.items():
+            correct = 0
+            latencies = []
+            for question, expected in questions:
+                topic = classifier.detect_topic(question, classifier.detect_language(question))
+                found = engine.search(question, language, topic, k=1)
+                best = found[0]['id'] if found and found[0]['score'] >= engine.min_score else None
+                if best == expected:
+                    correct += 1
+                else:
+                    misses.append({'language': language, 'question': question, 'expected': expected, 'got': best})
+                for _ in range(args.repeat):
+                    started = time.perf_counter()
+                    engine.answer(question, language, topic)
+                    latencies.append(time.perf_counter() - started)
+            row = {'language': language, 'questions': len(questions),
+                   'accuracy': round(correct / len(questions), 3), **summary_us(latencies)}
+            results.append(row)
+            print(f"{language:>9} {len(questions):>9} {row['accuracy']:>9.1%} {row['p50_us']:>8.1f} {row['p99_us']:>8.1f}")
+        for miss in misses:
+            print(f"  miss ({miss['language']}): {miss['question']!r} expected {miss['expected']}, got {miss['got']}")
+
+    if args.json:
+        write_results(args.json, {
+            'benchmark': 'offline_answers',
+            'index': {'documents': stats['documents'], 'terms': stats['terms'], 'bytes': index_bytes,
+                      'build_ms': round(min(builds) * 1000, 2), 'load_ms': round(min(loads) * 1000, 3)},
+            'results': results,
+            'misses': misses
+        })
+
+
+if __name__ == '__main__':
+    main()
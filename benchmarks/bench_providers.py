@@ -0,0 +1,180 @@
+"""
+Benchmark provider routing and hedging against two local stub providers.
+
+Starts one stub speaking the Gemini API and one speaking OpenAI chat
+completions, each with its own latency profile (by default a fast provider
+with a long tail and a slower, steady one), then sends the same calls
+through four routers: each provider alone, both with latency-aware routing,
+and both with routing plus hedging. Reports per-call latency (time to the
+answer, or to the first chunk when streaming), how many upstream requests
+each call cost and how often the hedge won. The hedged router also runs on
+the asyncio path, where losing requests are cancelled outright; the sync
+path hedges only streams, so its hedged complete calls match routed ones.
+
+    python benchmarks/bench_providers.py --calls 300 --concurrency 8
+    python benchmarks/bench_providers.py --gemini-latency-ms 300 --gemini-spread 1.0 \\
+        --openai-latency-ms 400 --openai-dist uniform --openai-error-rate 0.02
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from bench_utils import latency_summary, write_results  # noqa: E402
+from gemini_stub import LATENCY_DISTRIBUTIONS, start_stub, stub_openai_url, stub_url  # noqa: E402
+
+QUESTION = "What is photosynthesis?\n\nPlease respond in english language."
+
+
+def add_provider_arguments(parser: argparse.ArgumentParser, name: str, latency_ms: float, dist: str,
+                           spread: float) -> None:
+    parser.add_argument(f'--{name}-latency-ms', type=float, default=latency_ms)
+    parser.add_argument(f'--{name}-dist', choices=LATENCY_DISTRIBUTIONS, default=dist)
+    parser.add_argument(f'--{name}-spread', type=float, default=spread)
+    parser.add_argument(f'--{name}-error-rate', type=float, default=0.0)
+
+
+def start_provider_stub(args: argparse.Namespace, name: str, seed: int):
+    return start_stub(latency_ms=getattr(args, f'{name}_latency_ms'), latency_dist=getattr(args, f'{name}_dist'),
+                      latency_spread=getattr(args, f'{name}_spread'),
+                      error_rate=getattr(args, f'{name}_error_rate'), chunks=args.chunks, seed=seed)
+
+
+def build_router(kind: str, stubs: Dict, args: argparse.Namespace):
+    from providers import GeminiProvider, OpenAIProvider, ProviderRouter
+    from resilience import AdaptiveRateLimiter, CircuitBreaker, UpstreamGuard
+
+    def guard():
+        # Generous limits: the benchmark measures routing, not throttling
+        return UpstreamGuard(AdaptiveRateLimiter(rate=1000, burst=1000, max_rate=1000),
+                             CircuitBreaker(failure_threshold=20, reset_timeout=1),
+                             max_retries=3, base_delay=0.05, max_delay=0.2)
+
+    gemini = GeminiProvider(stub_url(stubs['gemini']), 'stub', guard(), window=args.window)
+    openai = OpenAIProvider(stub_openai_url(stubs['openai']), 'stub', 'stub', guard(), window=args.window)
+    providers = {'gemini': [gemini], 'openai': [openai]}.get(kind, [gemini, openai])
+    return ProviderRouter(providers, hedge=kind == 'hedged', hedge_percentile=args.hedge_percentile,
+                          min_samples=args.min_samples, threads=args.concurrency * 2)
+
+
+def call_sync(router, request, stream: bool) -> float:
+    started = time.perf_counter()
+    if stream:
+        latency = float('nan')
+        for _ in router.stream(request):
+            if latency != latency:
+                latency = time.perf_counter() - started
+        return latency
+    answer = router.complete(request)
+    return time.perf_counter() - started if answer else float('nan')
+
+
+async def call_async(router, request, stream: bool) -> float:
+    started = time.perf_counter()
+    if stream:
+        latency = float('nan')
+        async for _ in router.astream(request):
+            if latency != latency:
+                latency = time.perf_counter() - started
+        return latency
+    answer = await router.acomplete(request)
+    return time.perf_counter() - started if answer else float('nan')
+
+
+def run_sync(router, request, stream: bool, calls: int, concurrency: int) -> List[float]:
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(lambda _: call_sync(router, request, stream), range(calls)))
+
+
+def run_async(router, request, stream: bool, calls: int, concurrency: int) -> List[float]:
+    async def run():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one():
+            async with semaphore:
+                return await call_async(router, request, stream)
+        return await asyncio.gather(*(one() for _ in range(calls)))
+    return asyncio.run(run())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=300, help='Measured calls per router and kind')
+    parser.add_argument('--warmup', type=int, default=60, help='Unmeasured calls first, so the router has latency samples')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--chunks', type=int, default=8, help='Chunks per streamed answer')
+    parser.add_argument('--window', type=int, default=200, help='Latency samples kept per provider')
+    parser.add_argument('--min-samples', type=int, default=20)
+    parser.add_argument('--hedge-percentile', type=float, default=95)
+    add_provider_arguments(parser, 'gemini', 200, 'lognormal', 1.0)
+    add_provider_arguments(parser, 'openai', 350, 'uniform', 0.25)
+    parser.add_argument('--json', help='Write results to this file')
+    parser.add_argument('--verbose', action='store_true', help='Show router log output')
+    args = parser.parse_args()
+
+    os.environ.setdefault('UPSTREAM_POOL_SIZE', str(args.concurrency * 2))
+    from prompt_builder import ChatRequest
+    if not args.verbose:
+        logging.disable(logging.CRITICAL)
+
+    request = ChatRequest('You are a teacher.', [{'role': 'user', 'content': QUESTION}])
+    results = []
+    print(f"{'router':>8} {'path':>5} {'kind':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8} "
+          f"{'failed':>7} {'upstream/call':>13} {'hedged':>7} {'hedge won':>9}")
+    for kind in ('complete', 'stream'):
+        for name, path in (('gemini', 'sync'), ('openai', 'sync'), ('routed', 'sync'),
+                           ('hedged', 'sync'), ('hedged', 'async')):
+            # Fresh stubs with the same seeds, so every router sees the same latency sequence
+            stubs = {'gemini': start_provider_stub(args, 'gemini', 1), 'openai': start_provider_stub(args, 'openai', 2)}
+            router = build_router(name, stubs, args)
+            run = run_async if path == 'async' else run_sync
+            stream = kind == 'stream'
+            run(router, request, stream, args.warmup, args.concurrency)
+            before = {key: stub.stub.requests for key, stub in stubs.items()}
+            calls_before = router.stats()
+            latencies = run(router, request, stream, args.calls, args.concurrency)
+            stats = router.stats()
+            for stub in stubs.values():
+                stub.shutdown()
+
+            answered = [latency for latency in latencies if latency == latency]
+            upstream = sum(stub.stub.requests - before[key] for key, stub in stubs.items())
+            hedged = stats['hedged'] - calls_before['hedged']
+            row = {
+                'router': name,
+                'path': path,
+                'kind': kind,
+                'calls': args.calls,
+                **latency_summary(answered),
+                'error_rate': round(1 - len(answered) / len(latencies), 4),
+                'upstream_per_call': round(upstream / args.calls, 3),
+                'hedge_rate': round(hedged / args.calls, 4),
+                'hedge_win_rate': round((stats['hedge_wins'] - calls_before['hedge_wins']) / hedged, 4) if hedged else 0.0,
+                'ranking': stats['ranking']
+            }
+            results.append(row)
+            print(f"{name:>8} {path:>5} {kind:>8} {row['p50_ms']:>8.1f} {row['p95_ms']:>8.1f} {row['p99_ms']:>8.1f} "
+                  f"{row['max_ms']:>8.1f} {row['error_rate']:>7.2%} {row['upstream_per_call']:>13.3f} "
+                  f"{row['hedge_rate']:>7.1%} {row['hedge_win_rate']:>9.1%}")
+
+    if args.json:
+        write_results(args.json, {
+            'benchmark': 'providers',
+            'profiles': {name: {'latency_ms': getattr(args, f'{name}_latency_ms'), 'dist': getattr(args, f'{name}_dist'),
+                                'spread': getattr(args, f'{name}_spread'),
+                                'error_rate': getattr(args, f'{name}_error_rate')}
+                         for name in ('gemini', 'openai')},
+            'results': results
+        })
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+"""
+Cross-worker shared state: throughput, contention and hit rate at 1, 4 and 16 workers.
+
+Each worker is a forked process that answers a stream of questions drawn
+from a Zipf distribution over --questions distinct questions, the way
+/chat does: a response cache lookup, a host-wide counter update, and on a
+miss a token from the provider's rate limiter and a cache store of a
+~1.5 KB answer. `local` gives every worker its own LRU, limiter and
+counters (the state before shared_state.py); `shared` adds the
+memory-mapped hot-answer table, counters and token bucket every worker
+maps from one file. For each worker count it reports lookups per second
+across all workers, per-lookup latency, how many lookups missed (each one
+a model call), how many upstream tokens the limiters handed out against a
+budget of --rate per second plus the burst, and for the shared file how
+often a lock was contended and a lock-free read had to retry.
+
+    python benchmarks/bench_shared_state.py --workers 1,4,16 --lookups 20000
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from bench_utils import percentile, write_results  # noqa: E402
+from resilience import AdaptiveRateLimiter  # noqa: E402
+from response_cache import ResponseCache  # noqa: E402
+from shared_state import SharedState  # noqa: E402
+
+MODES = ('local', 'shared')
+ANSWER = 'प्रकाश संश्लेषण वह प्रक्रिया है जिससे पौधे भोजन बनाते हैं। Photosynthesis turns light into sugar. ' * 12
+
+
+def zipf_weights(n: int, s: float) -> List[float]:
+    return [1 / (rank ** s) for rank in range(1, n + 1)]
+
+
+def worker(mode: str, index: int, args, state_path: str, barrier, results) -> None:
+    shared = SharedState(state_path, answer_slots=args.slots) if mode == 'shared' else SharedState()
+    cache = ResponseCache(max_entries=args.cache_size, shared=shared)
+    limiter = AdaptiveRateLimiter(rate=args.rate, burst=args.rate, max_rate=args.rate, increase=0)
+    if mode == 'shared':
+        limiter.share(shared, 'rate_limit:bench')
+    rng = random.Random(index)
+    keys = [ResponseCache.make_key(f'question {i}', 'english', 'science') for i in range(args.questions)]
+    draws = rng.choices(keys, weights=zipf_weights(args.questions, args.zipf), k=args.lookups)
+    local_counts: Dict[str, int] = {}
+    timings = []
+    misses = granted = 0
+
+    barrier.wait()
+    started = time.perf_counter()
+    for key in draws:
+        t = time.perf_counter()
+        answer = cache.get(key)
+        outcome = 'cache_hits' if answer is not None else 'cache_misses'
+        if shared.enabled:
+            shared.add(outcome)
+        else:
+            local_counts[outcome] = local_counts.get(outcome, 0) + 1
+        timings.append(time.perf_counter() - t)
+        if answer is None:
+            misses += 1
+            if limiter.reserve(max_wait=0) is not None:
+                granted += 1
+            cache.set(key, ANSWER)
+    elapsed = time.perf_counter() - started
+    results.put({
+        'elapsed': elapsed,
+        'timings': timings,
+        'misses': misses,
+        'granted': granted,
+        'shared': shared.stats().get('this_worker', {})
+    })
+
+
+def run(mode: str, workers: int, args) -> Dict:
+    context = multiprocessing.get_context('fork')
+    barrier = context.Barrier(workers)
+    results = context.Queue()
+    with tempfile.TemporaryDirectory(dir='/dev/shm' if os.path.isdir('/dev/shm') else None) as tmp:
+        state_path = os.path.join(tmp, 'state')
+        if mode == 'shared':
+            # Created up front, as the preloading gunicorn master does
+            SharedState(state_path, answer_slots=args.slots).close()
+        processes = [context.Process(target=worker, args=(mode, i, args, state_path, barrier, results))
+                     for i in range(workers)]
+        for process in processes:
+            process.start()
+        rows = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+
+    timings = [t for row in rows for t in row['timings']]
+    wall = max(row['elapsed'] for row in rows)
+    lookups = len(timings)
+    locks = sum(row['shared'].get('locks', 0) for row in rows)
+    return {
+        'mode': mode,
+        'workers': workers,
+        'lookup_rps': round(lookups / wall),
+        'p50_us': round(percentile(timings, 50) * 1e6, 2),
+        'p99_us': round(percentile(timings, 99) * 1e6, 2),
+        'misses': sum(row['misses'] for row in rows),
+        'hit_ratio': round(1 - sum(row['misses'] for row in rows) / lookups, 4),
+        'upstream_tokens': sum(row['granted'] for row in rows),
+        'token_budget': round(args.rate + args.rate * wall),
+        'locks': locks,
+        'contended': sum(row['shared'].get('contended', 0) for row in rows),
+        'contention_ratio': round(sum(row['shared'].get('contended', 0) for row in rows) / locks, 4) if locks else 0.0,
+        'read_retries': sum(row['shared'].get('read_retries', 0) for row in rows),
+        'torn_reads': sum(row['shared'].get('torn_reads', 0) for row in rows)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', default='1,4,16', help='Comma-separated worker counts')
+    parser.add_argument('--lookups', type=int, default=20000, help='Questions answered by each worker')
+    parser.add_argument('--questions', type=int, default=5000, help='Distinct questions')
+    parser.add_argument('--zipf', type=float, default=1.1, help='Zipf exponent of question popularity')
+    parser.add_argument('--cache-size', type=int, default=1024, help="Each worker's LRU entries")
+    parser.add_argument('--slots', type=int, default=4096, help='Shared hot-answer slots')
+    parser.add_argument('--rate', type=float, default=50, help='Provider requests/s (and burst) for the whole host')
+    parser.add_argument('--modes', default=','.join(MODES))
+    parser.add_argument('--json', help='Write results to this file')
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'mode':>7} {'workers':>7} {'lookups/s':>10} {'p50 us':>7} {'p99 us':>7} {'hit ratio':>9} "
+          f"{'misses':>7} {'tokens':>7} {'budget':>7} {'contended':>9} {'retries':>7}")
+    for workers in (int(n) for n in args.workers.split(',')):
+        for mode in args.modes.split(','):
+            row = run(mode, workers, args)
+            results.append(row)
+            print(f"{mode:>7} {workers:>7} {row['lookup_rps']:>10} {row['p50_us']:>7.2f} {row['p99_us']:>7.2f} "
+                  f"{row['hit_ratio']:>9.4f} {row['misses']:>7} {row['upstream_tokens']:>7} "
+                  f"{row['token_budget']:>7} {row['contention_ratio']:>9.4f} {row['read_retries']:>7}")
+
+    if args.json:
+        write_results(args.json, {'benchmark': 'shared_state', 'lookups_per_worker': args.lookups,
+                                  'questions': args.questions, 'zipf': args.zipf, 'results': results})
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Benchmark the paraphrase tier (similarity_index.py) for accuracy and latency.
+
+Each pair stores the first question's answer and looks up the second.
+Paraphrases must reuse it; different questions that share almost all of
+their words ("World War I" / "World War II", "father" / "mother") must not,
+because a wrong cached answer is worse than a model call. Exits with status
+1 if any different question is answered from the other's cache entry.
+
+    python benchmarks/bench_similarity.py [--json results.json]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config  # noqa: E402
+from similarity_index import SimilarityIndex  # noqa: E402
+from bench_utils import percentile, write_results  # noqa: E402
+
+# (stored question, asked question, language, topic)
+SAME = [
+    ('What is photosynthesis?', 'Explain photosynthesis', 'english', 'science'),
+    ('Explain the causes of World War I', 'What were the causes of World War I?', 'english', 'history'),
+    ("Explain Newton's third law", "Tell me about Newton's third law", 'english', 'science'),
+    ('What is the Pythagorean theorem', 'Please explain the pythagorean theorem', 'english', 'mathematics'),
+    ('Explain the water cycle', 'What is the water cycle?', 'english', 'geography'),
+    ('What is the Pythagorean theorem', 'What is the pythagorian theorem', 'english', 'mathematics'),
+    ('प्रकाश संश्लेषण क्या है', 'प्रकाश संश्लेषण के बारे में बताइए', 'hindi', 'science'),
+    ('prakash sanshleshan kya hai', 'prakash sanshleshan ke baare mein batao', 'hindi', 'science'),
+    ('కిరణజన్య సంయోగక్రియ అంటే ఏమిటి', 'కిరణజన్య సంయోగక్రియ గురించి చెప్పండి', 'telugu', 'science'),
+    ('ஒளிச்சேர்க்கை என்றால் என்ன', 'ஒளிச்சேர்க்கை பற்றி சொல்லுங்கள்', 'tamil', 'science'),
+]
+DIFFERENT = [
+    ('Explain the causes of World War II', 'Explain the causes of World War I', 'english', 'history'),
+    ('Who is the mother of the Indian constitution?', 'Who is the father of the Indian constitution?',
+     'english', 'history'),
+    ('What is vitamin A', 'What is vitamin C', 'english', 'science'),
+    ('Explain the Battle of Panipat II', 'Explain the Battle of Panipat III', 'english', 'history'),
+    ('What is a plant cell', 'What is an animal cell', 'english', 'science'),
+    ('Explain mitosis', 'Explain meiosis', 'english', 'science'),
+    ('What is the area of a circle', 'What is the area of a square', 'english', 'mathematics'),
+    ('What is 5+3', 'What is 5-3', 'english', 'mathematics'),
+    ('प्रथम विश्व युद्ध के कारण', 'द्वितीय विश्व युद्ध के कारण', 'hindi', 'history'),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--json', help='Write results to this file')
+    parser.add_argument('--threshold', type=float, default=Config.SIMILARITY_THRESHOLD)
+    parser.add_argument('--repeat', type=int, default=200, help='Times each lookup is timed')
+    args = parser.parse_args()
+
+    results = []
+    wrong = []
+    for kind, pairs in (('same', SAME), ('different', DIFFERENT)):
+        correct = 0
+        latencies = []
+        for stored, asked, language, topic in pairs:
+            index = SimilarityIndex(threshold=args.threshold)
+            index.add(stored, language, topic, stored)
+            found = index.lookup(asked, language, topic)
+            if (found is not None) == (kind == 'same'):
+                correct += 1
+            else:
+                wrong.append({'kind': kind, 'stored': stored, 'asked': asked,
+                              'similarity': found[1] if found else None})
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                index.lookup(asked, language, topic)
+                latencies.append(time.perf_counter() - started)
+        results.append({'pairs': kind, 'count': len(pairs), 'accuracy': round(correct / len(pairs), 3),
+                        'p50_us': round(percentile(latencies, 50) * 1e6, 1),
+                        'p99_us': round(percentile(latencies, 99) * 1e6, 1)})
+
+    print(f"{'pairs':>9} {'count':>5} {'accuracy':>9} {'p50 us':>8} {'p99 us':>8}")
+    for row in results:
+        print(f"{row['pairs']:>9} {row['count']:>5} {row['accuracy']:>9.1%} {row['p50_us']:>8.1f} {row['p99_us']:>8.1f}")
+    for miss in wrong:
+        outcome = f"matched at {miss['similarity']:.2f}" if miss['similarity'] is not None else 'missed'
+        print(f"  {miss['kind']}: {miss['asked']!r} vs {miss['stored']!r} {outcome}")
+
+    if args.json:
+        write_results(args.json, {'benchmark': 'similarity', 'threshold': args.threshold,
+                                  'results': results, 'wrong': wrong})
+    if any(miss['kind'] == 'different' for miss in wrong):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+"""
+Measure app import time, worker cold start and per-worker resident memory.
+
+First imports the app in fresh interpreters and reports how long that takes.
+Then starts gunicorn with gunicorn.conf.py twice against the local Gemini
+stub: once preloading the app in the master (workers share its tables and
+indexes copy-on-write) and once with every worker importing it itself. For
+each run it reports the time from launch until every worker has warmed its
+upstream connections and is ready, and each worker's resident memory read
+from /proc/<pid>/smaps_rollup: RSS, PSS (its fair share of pages it shares
+with the master and the other workers) and private pages, first idle and
+then after a round of chats. Linux only.
+
+    python benchmarks/bench_startup.py --workers 4 --imports 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from bench_utils import ROOT, GunicornServer, write_results  # noqa: E402
+from gemini_stub import start_stub, stub_url  # noqa: E402
+from startup import resident_memory  # noqa: E402
+
+IMPORT_SCRIPT = """
+import json, time
+started = time.perf_counter()
+import app
+print(json.dumps({'wall_ms': (time.perf_counter() - started) * 1000, 'app_import_ms': app.startup.import_ms}))
+"""
+
+MODES = {'preload': 'True', 'per_worker': 'False'}
+
+
+def measure_imports(runs: int, env: Dict[str, str]) -> Dict:
+    """Import the app in `runs` fresh interpreters"""
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', IMPORT_SCRIPT], cwd=ROOT, env=env, check=True,
+                                capture_output=True, text=True).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+    walls = [sample['wall_ms'] for sample in samples]
+    return {
+        'runs': runs,
+        'median_ms': round(statistics.median(walls), 1),
+        'min_ms': round(min(walls), 1),
+        'max_ms': round(max(walls), 1),
+        'app_reported_ms': round(statistics.median(sample['app_import_ms'] for sample in samples), 1)
+    }
+
+
+def children(pid: int) -> List[int]:
+    """Processes whose parent is pid"""
+    found = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # The command name may contain spaces; the parent PID follows its closing parenthesis
+                if int(f.read().rsplit(')', 1)[1].split()[1]) == pid:
+                    found.append(int(entry))
+        except (OSError, IndexError, ValueError):
+            pass
+    return found
+
+
+def ready_workers(log_path: str) -> Dict[int, Dict]:
+    """Worker PID -> its 'Worker ready' log record"""
+    ready = {}
+    try:
+        with open(log_path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get('message', '').startswith('Worker ready'):
+                    ready[record['pid']] = record
+    except OSError:
+        pass
+    return ready
+
+
+def memory_summary(master: int, workers: List[int]) -> Dict:
+    """Average per-worker memory in MB, plus the total PSS of master and workers (the real footprint)"""
+    readings = [resident_memory(pid) for pid in workers]
+    readings = [reading for reading in readings if reading]
+    master_pss = resident_memory(master).get('pss_kb', 0)
+
+    def average(*fields) -> float:
+        return round(statistics.mean(sum(reading.get(field, 0) for field in fields) for reading in readings) / 1024, 1)
+
+    return {
+        'worker_rss_mb': average('rss_kb'),
+        'worker_pss_mb': average('pss_kb'),
+        'worker_shared_mb': average('shared_clean_kb', 'shared_dirty_kb'),
+        'worker_private_mb': average('private_clean_kb', 'private_dirty_kb'),
+        'total_pss_mb': round((master_pss + sum(reading.get('pss_kb', 0) for reading in readings)) / 1024, 1)
+    }
+
+
+def send_chats(base_url: str, chats: int) -> None:
+    def one(i: int):
+        try:
+            requests.post(base_url + '/chat', json={'message': f'What is photosynthesis? #{i}'}, timeout=30)
+        except requests.RequestException:
+            pass
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(one, range(chats)))
+
+
+def run_mode(mode: str, workers: int, chats: int, env: Dict[str, str], timeout: float) -> Dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        log_path = os.path.join(tmp, 'startup.log')
+        mode_env = {**env, 'GUNICORN_PRELOAD': MODES[mode], 'LOG_FILE': log_path, 'WEB_CONCURRENCY': str(workers)}
+        launched = time.perf_counter()
+        with GunicornServer(['-c', 'gunicorn.conf.py', 'app:app', '--workers', str(workers)], mode_env,
+                            ready_timeout=timeout) as server:
+            deadline = time.monotonic() + timeout
+            while len(ready_workers(log_path)) < workers:
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"Only {len(ready_workers(log_path))} of {workers} workers became ready")
+                time.sleep(0.02)
+            # The log line is written off the request path, so this slightly overstates the time
+            ready_s = time.perf_counter() - launched
+            ready = requests.get(server.base_url + '/ready', timeout=5).json()
+            master = server.process.pid
+            pids = children(master)
+            idle = memory_summary(master, pids)
+            send_chats(server.base_url, chats)
+            busy = memory_summary(master, pids)
+    return {
+        'mode': mode,
+        'workers': workers,
+        'ready_s': round(ready_s, 3),
+        'preloaded': ready['preloaded'],
+        'warm_connections': sum(ready['warm_connections'].values()),
+        'idle': idle,
+        'after_chats': busy
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--imports', type=int, default=5, help='Fresh-interpreter imports to time')
+    parser.add_argument('--chats', type=int, default=200, help='Chats sent before the second memory reading')
+    parser.add_argument('--modes', default=','.join(MODES))
+    parser.add_argument('--timeout', type=float, default=60, help='Seconds to wait for the workers')
+    parser.add_argument('--json', help='Write results to this file')
+    args = parser.parse_args()
+    if not os.path.exists('/proc/self/smaps_rollup'):
+        parser.error("needs Linux /proc/<pid>/smaps_rollup to read worker memory")
+
+    stub = start_stub()
+    env = dict(os.environ, LLM_PROVIDERS='gemini', GENAI_API_KEY='stub', GEMINI_API_URL=stub_url(stub),
+               METRICS_DIR='')
+
+    imports = measure_imports(args.imports, env)
+    print(f"App import: median {imports['median_ms']}ms (min {imports['min_ms']}, max {imports['max_ms']}; "
+          f"{imports['app_reported_ms']}ms as reported by the app)")
+
+    results = []
+    print(f"{'mode':>10} {'ready s':>8} {'state':>11} {'RSS MB':>7} {'PSS MB':>7} {'shared MB':>9} "
+          f"{'private MB':>10} {'total PSS MB':>12}")
+    for mode in args.modes.split(','):
+        row = run_mode(mode, args.workers, args.chats, env, args.timeout)
+        results.append(row)
+        for state in ('idle', 'after_chats'):
+            memory = row[state]
+            print(f"{mode:>10} {row['ready_s']:>8.2f} {state:>11} {memory['worker_rss_mb']:>7.1f} "
+                  f"{memory['worker_pss_mb']:>7.1f} {memory['worker_shared_mb']:>9.1f} "
+                  f"{memory['worker_private_mb']:>10.1f} {memory['total_pss_mb']:>12.1f}")
+    stub.shutdown()
+
+    if args.json:
+        write_results(args.json, {'benchmark': 'startup', 'imports': imports, 'results': results})
+
+
+if __name__ == '__main__':
+    main()
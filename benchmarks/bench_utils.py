@@ -0,0 +1,115 @@
+"""Helpers shared by the benchmark scripts: servers, percentiles and result files."""
+import json
+import os
+import platform
+import socket
+import subprocess
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def latency_summary(latencies: List[float], prefix: str = '') -> Dict:
+    """p50/p95/p99/max in milliseconds for a list of latencies in seconds"""
+    return {
+        f'{prefix}p50_ms': round(percentile(latencies, 50) * 1000, 1),
+        f'{prefix}p95_ms': round(percentile(latencies, 95) * 1000, 1),
+        f'{prefix}p99_ms': round(percentile(latencies, 99) * 1000, 1),
+        f'{prefix}max_ms': round(max(latencies, default=0) * 1000, 1),
+    }
+
+
+def wait_ready(base_url: str, timeout: float = 30, process: Optional[subprocess.Popen] = None) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode} before becoming ready")
+        try:
+            if requests.get(base_url + '/', timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Server at {base_url} did not become ready")
+
+
+class GunicornServer:
+    """Run `gunicorn <args>` from the repo root on a free port for the duration of a with-block"""
+
+    def __init__(self, args: List[str], env: Optional[Dict[str, str]] = None, ready_timeout: float = 30):
+        self.port = free_port()
+        self.base_url = f'http://127.0.0.1:{self.port}'
+        self.command = ['gunicorn'] + args + ['--bind', f'127.0.0.1:{self.port}']
+        self.env = dict(os.environ, **(env or {}))
+        self.ready_timeout = ready_timeout
+        self.process = None
+
+    def __enter__(self) -> 'GunicornServer':
+        self.process = subprocess.Popen(self.command, cwd=ROOT, env=self.env,
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_ready(self.base_url, self.ready_timeout, self.process)
+        except Exception:
+            self.__exit__()
+            raise
+        return self
+
+    def __exit__(self, *exc):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        return False
+
+
+def git_revision() -> Dict:
+    def git(*args) -> str:
+        try:
+            return subprocess.run(['git', *args], cwd=ROOT, capture_output=True, text=True, timeout=10).stdout.strip()
+        except (OSError, subprocess.SubprocessError):
+            return ''
+    return {'commit': git('rev-parse', '--short', 'HEAD') or 'unknown', 'dirty': bool(git('status', '--porcelain', '-uno'))}
+
+
+def run_metadata() -> Dict:
+    return {
+        **git_revision(),
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count()
+    }
+
+
+def default_results_path(benchmark: str) -> str:
+    """benchmarks/results/<commit>/<benchmark>.json"""
+    return os.path.join(RESULTS_DIR, git_revision()['commit'], f'{benchmark}.json')
+
+
+def write_results(path: str, results: Dict) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump({'meta': run_metadata(), **results}, f, indent=2, ensure_ascii=False)
+    print(f"Results written to {path}")
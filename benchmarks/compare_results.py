@@ -0,0 +1,105 @@
+"""
+Compare two benchmark runs and flag regressions.
+
+Takes two result files, or two benchmarks/results/<commit>/ directories (files
+with the same name are compared). Latencies (`*_ms`, `*_us`, `*_s`) and
+error/fallback rates are better when lower; `rps` and `accuracy` are better when higher.
+Exits with status 1 if any metric got worse by more than --threshold.
+
+    python benchmarks/compare_results.py benchmarks/results/abc1234 benchmarks/results/def5678
+"""
+import argparse
+import json
+import os
+import sys
+from typing import Dict, Iterator, Optional, Tuple
+
+LOWER_IS_BETTER = ('_ms', '_us', '_s', 'error_rate', 'fallback_rate')
+HIGHER_IS_BETTER = ('rps', 'accuracy')
+
+
+def direction(key: str) -> Optional[int]:
+    """-1 when lower is better, 1 when higher is better, None for values that are not compared"""
+    if key.startswith('legacy') or key == 'meta':
+        return None
+    if key.endswith(HIGHER_IS_BETTER):
+        return 1
+    if key.endswith(LOWER_IS_BETTER):
+        return -1
+    return None
+
+
+def flatten(data, path: str = '') -> Iterator[Tuple[str, str, float]]:
+    """(path, leaf key, value) for every numeric leaf"""
+    if isinstance(data, dict):
+        for key, value in data.items():
+            if key == 'meta':
+                continue
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                yield f'{path}{key}', key, value
+            else:
+                yield from flatten(value, f'{path}{key}.')
+    elif isinstance(data, list):
+        for index, item in enumerate(data):
+            # Name list entries by their identifying fields (e.g. length/language) rather than position
+            label = '/'.join(str(v) for k, v in item.items() if isinstance(v, (str, int)) and direction(k) is None) \
+                if isinstance(item, dict) else ''
+            yield from flatten(item, f'{path}[{label or index}].')
+
+
+def load(path: str) -> Dict[str, dict]:
+    if os.path.isdir(path):
+        results = {}
+        for name in sorted(os.listdir(path)):
+            if name.endswith('.json'):
+                with open(os.path.join(path, name)) as f:
+                    results[name[:-5]] = json.load(f)
+        return results
+    with open(path) as f:
+        return {os.path.basename(path)[:-5]: json.load(f)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--threshold', type=float, default=0.10, help='Relative change counted as a regression')
+    parser.add_argument('--all', action='store_true', help='Show unchanged metrics too')
+    args = parser.parse_args()
+
+    baseline, candidate = load(args.baseline), load(args.candidate)
+    if len(baseline) == 1 and len(candidate) == 1:
+        # Two single files: compare them even if their names differ
+        baseline = {'': next(iter(baseline.values()))}
+        candidate = {'': next(iter(candidate.values()))}
+
+    regressions = 0
+    print(f"{'metric':<70} {'baseline':>12} {'candidate':>12} {'change':>8}")
+    for name in sorted(set(baseline) & set(candidate)):
+        old = {path: (key, value) for path, key, value in flatten(baseline[name])}
+        new = {path: (key, value) for path, key, value in flatten(candidate[name])}
+        for path in sorted(old.keys() & new.keys()):
+            key, before = old[path]
+            after = new[path][1]
+            sign = direction(key)
+            if sign is None:
+                continue
+            change = (after - before) / before if before else (0.0 if after == before else float('inf'))
+            worse = -sign * change > args.threshold
+            better = sign * change > args.threshold
+            if not (worse or better or args.all):
+                continue
+            regressions += worse
+            marker = 'REGRESSION' if worse else ('improved' if better else '')
+            label = f'{name}:{path}' if name else path
+            print(f"{label:<70} {before:>12g} {after:>12g} {change * 100:>+7.1f}% {marker}")
+
+    missing = sorted(set(baseline) ^ set(candidate))
+    if missing:
+        print(f"Only in one run: {', '.join(missing)}")
+    print(f"{regressions} regression(s) beyond {args.threshold * 100:.0f}%")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
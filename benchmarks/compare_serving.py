@@ -0,0 +1,92 @@
+"""
+Compare the sync (gunicorn app:app) and asyncio (asgi_app:app) deployments.
+
+Starts the local Gemini stub with a fixed upstream latency, launches each
+deployment with the same number of worker processes, fires a burst of
+concurrent /chat requests with unique messages (so the response cache never
+hits) and reports throughput and latency percentiles.
+
+    python benchmarks/compare_serving.py --workers 2 --concurrency 100 --latency-ms 500
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_utils import GunicornServer, latency_summary, write_results  # noqa: E402
+from gemini_stub import start_stub, stub_url  # noqa: E402
+
+MODES = {
+    'sync': ['app:app', '--worker-class', 'sync', '--threads', '1'],
+    'async': ['-c', 'gunicorn_async.conf.py', 'asgi_app:app'],
+}
+
+
+def run_burst(base_url: str, concurrency: int, request_timeout: float) -> Dict:
+    def one(i: int):
+        started = time.perf_counter()
+        try:
+            response = requests.post(base_url + '/chat', json={'message': f'What is photosynthesis? #{i}'},
+                                     timeout=request_timeout)
+            ok = response.status_code == 200
+        except requests.RequestException:
+            ok = False
+        return ok, time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(concurrency)))
+    wall = time.perf_counter() - started
+
+    latencies = [elapsed for ok, elapsed in results if ok]
+    errors = sum(1 for ok, _ in results if not ok)
+    return {
+        'requests': concurrency,
+        'errors': errors,
+        'wall_s': round(wall, 3),
+        'throughput_rps': round(len(latencies) / wall, 2),
+        **latency_summary(latencies)
+    }
+
+
+def run_mode(mode: str, workers: int, upstream_url: str, concurrency: int, request_timeout: float) -> Dict:
+    env = {'LLM_PROVIDERS': 'gemini', 'GENAI_API_KEY': 'stub', 'GEMINI_API_URL': upstream_url,
+           'WEB_CONCURRENCY': str(workers)}
+    with GunicornServer(MODES[mode] + ['--workers', str(workers), '--timeout', '120'], env) as server:
+        return run_burst(server.base_url, concurrency, request_timeout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--concurrency', type=int, default=100, help='Simultaneous /chat requests')
+    parser.add_argument('--latency-ms', type=float, default=500, help='Stub upstream latency')
+    parser.add_argument('--modes', default='sync,async')
+    parser.add_argument('--json', help='Write results to this file')
+    args = parser.parse_args()
+
+    stub = start_stub(latency_ms=args.latency_ms)
+    upstream_url = stub_url(stub)
+    request_timeout = max(60.0, args.concurrency * args.latency_ms / 1000)
+
+    results = {}
+    for mode in args.modes.split(','):
+        results[mode] = run_mode(mode, args.workers, upstream_url, args.concurrency, request_timeout)
+        r = results[mode]
+        print(f"{mode:>6}: {r['throughput_rps']:>7.2f} req/s  wall {r['wall_s']:>7.2f}s  "
+              f"p50 {r['p50_ms']:>8.1f}ms  p95 {r['p95_ms']:>8.1f}ms  errors {r['errors']}")
+
+    if args.json:
+        write_results(args.json, {'benchmark': 'compare_serving', 'workers': args.workers,
+                                  'concurrency': args.concurrency, 'latency_ms': args.latency_ms,
+                                  'results': results})
+
+
+if __name__ == '__main__':
+    main()
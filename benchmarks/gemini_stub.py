@@ -0,0 +1,253 @@
+"""
+Local stand-in for the Gemini generateContent API (and OpenAI chat completions).
+
+Answers `...:generateContent` and `...:streamGenerateContent?alt=sse` (and
+OpenAI-format completions and streams on `/v1/chat/completions`) with a
+canned answer after a delay drawn from a configurable distribution, so the
+app can be exercised without an API key or network access. A status schedule
+makes it misbehave on cue (e.g. every third request throttled, with a
+Retry-After header); an error rate injects failures at random instead:
+
+    python benchmarks/gemini_stub.py --port 8900 --latency-ms 500
+    python benchmarks/gemini_stub.py --latency-dist lognormal --latency-ms 800 --latency-spread 0.6
+    python benchmarks/gemini_stub.py --schedule 200,200,429 --retry-after 1
+    python benchmarks/gemini_stub.py --error-rate 0.05 --error-statuses 429,503
+    GENAI_API_KEY=stub \
+    GEMINI_API_URL=http://127.0.0.1:8900/v1beta/models/stub:generateContent python app.py
+    OPENAI_API_KEY=stub OPENAI_API_URL=http://127.0.0.1:8901/v1/chat/completions python app.py
+"""
+import argparse
+import json
+import math
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterable, List, Optional
+
+ANSWER = (
+    "Great question! Photosynthesis is the process plants use to turn light, water and "
+    "carbon dioxide into glucose and oxygen. For example, a leaf in sunlight is a tiny food factory."
+)
+
+
+def gemini_payload(text: str) -> bytes:
+    return json.dumps({'candidates': [{'content': {'parts': [{'text': text}], 'role': 'model'}}]}).encode('utf-8')
+
+
+def openai_payload(text: str) -> bytes:
+    return json.dumps({'object': 'chat.completion', 'choices': [
+        {'index': 0, 'message': {'role': 'assistant', 'content': text}, 'finish_reason': 'stop'}]}).encode('utf-8')
+
+
+def openai_chunk(text: str) -> bytes:
+    return json.dumps({'object': 'chat.completion.chunk', 'choices': [
+        {'index': 0, 'delta': {'content': text}, 'finish_reason': None}]}).encode('utf-8')
+
+
+def error_payload(status: int) -> bytes:
+    return json.dumps({'error': {'code': status, 'message': f'Stub error {status}'}}).encode('utf-8')
+
+
+LATENCY_DISTRIBUTIONS = ('fixed', 'uniform', 'exponential', 'lognormal')
+
+
+class StubConfig:
+    """
+    Live settings of a running stub. Latency is `latency_ms` on average:
+    fixed, uniform within +/- latency_spread (a fraction of the mean),
+    exponential, or lognormal with sigma latency_spread (a long tail).
+    """
+
+    def __init__(self, latency_ms: float = 0.0, chunks: int = 8, answer: str = ANSWER,
+                 schedule: Optional[Iterable[int]] = None, retry_after: Optional[float] = None,
+                 latency_dist: str = 'fixed', latency_spread: float = 0.5, error_rate: float = 0.0,
+                 error_statuses: Iterable[int] = (503,), seed: Optional[int] = None):
+        if latency_dist not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency distribution: {latency_dist}")
+        self.latency_ms = latency_ms
+        self.latency_dist = latency_dist
+        self.latency_spread = latency_spread
+        self.chunks = chunks
+        self.answer = answer
+        self.retry_after = retry_after
+        self.error_rate = error_rate
+        self.error_statuses = list(error_statuses)
+        self.requests = 0
+        self.statuses = {}
+        self.lock = threading.Lock()
+        self.random = random.Random(seed)
+        self.set_schedule(schedule)
+
+    def sample_latency(self) -> float:
+        """Seconds to wait before answering"""
+        mean = self.latency_ms / 1000
+        if mean <= 0 or self.latency_dist == 'fixed':
+            return max(mean, 0.0)
+        with self.lock:
+            if self.latency_dist == 'uniform':
+                return self.random.uniform(mean * (1 - self.latency_spread), mean * (1 + self.latency_spread))
+            if self.latency_dist == 'exponential':
+                return self.random.expovariate(1 / mean)
+            # Lognormal with the requested mean
+            sigma = self.latency_spread
+            return self.random.lognormvariate(math.log(mean) - sigma ** 2 / 2, sigma)
+
+    def set_schedule(self, schedule: Optional[Iterable[int]]) -> None:
+        """Statuses to answer with, in order and repeating; None means always 200"""
+        with self.lock:
+            self.schedule: List[int] = list(schedule or [200])
+            self._position = 0
+
+    def next_status(self) -> int:
+        with self.lock:
+            self.requests += 1
+            status = self.schedule[self._position % len(self.schedule)]
+            self._position += 1
+            if status == 200 and self.error_rate and self.random.random() < self.error_rate:
+                status = self.random.choice(self.error_statuses)
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            return status
+
+
+class GeminiStubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    stub: StubConfig = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        status = self.stub.next_status()
+        openai = '/chat/completions' in self.path
+
+        if status != 200:
+            headers = {'Retry-After': f'{self.stub.retry_after:g}'} if status == 429 and self.stub.retry_after else {}
+            self._send_json(status, error_payload(status), headers)
+        elif ':streamGenerateContent' in self.path:
+            self._stream(gemini_payload)
+        elif openai and json.loads(body or b'{}').get('stream'):
+            self._stream(openai_chunk, done=True)
+        else:
+            time.sleep(self.stub.sample_latency())
+            self._send_json(200, (openai_payload if openai else gemini_payload)(self.stub.answer))
+
+    def do_HEAD(self):
+        # Like the real APIs: any path answers, keeping the connection open (used to warm up pools)
+        self.send_response(404)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def _send_json(self, status: int, body: bytes, headers: Optional[dict] = None):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream(self, encode, done: bool = False):
+        words = self.stub.answer.split(' ')
+        per_chunk = max(1, -(-len(words) // self.stub.chunks))
+        pieces = [' '.join(words[i:i + per_chunk]) for i in range(0, len(words), per_chunk)]
+        delay = self.stub.sample_latency() / max(len(pieces), 1)
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for i, piece in enumerate(pieces):
+            time.sleep(delay)
+            text = piece if i == 0 else ' ' + piece
+            self._write_event(encode(text))
+        if done:
+            self._write_event(b'[DONE]')
+        self.wfile.write(b'0\r\n\r\n')
+
+    def _write_event(self, data: bytes):
+        event = b'data: ' + data + b'\r\n\r\n'
+        self.wfile.write(f'{len(event):x}\r\n'.encode() + event + b'\r\n')
+        self.wfile.flush()
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Load tests open hundreds of connections at once
+    request_queue_size = 1024
+
+    def handle_error(self, request, client_address):
+        # Clients may hang up before the answer is written (e.g. a hedged request that lost)
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            super().handle_error(request, client_address)
+
+
+def start_stub(port: int = 0, host: str = '127.0.0.1', **options) -> StubServer:
+    """Start the stub on a background thread; `server.stub` holds its live config"""
+    stub = StubConfig(**options)
+    handler = type('Handler', (GeminiStubHandler,), {'stub': stub})
+    server = StubServer((host, port), handler)
+    server.stub = stub
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def stub_url(server: StubServer, model: Optional[str] = 'stub') -> str:
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}/v1beta/models/{model}:generateContent"
+
+
+def stub_openai_url(server: StubServer) -> str:
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}/v1/chat/completions"
+
+
+def add_stub_arguments(parser: argparse.ArgumentParser, latency_ms: float = 0.0) -> None:
+    """Stub behaviour options, shared by the benchmarks that start a stub"""
+    parser.add_argument('--latency-ms', type=float, default=latency_ms, help='Mean delay before each answer')
+    parser.add_argument('--latency-dist', choices=LATENCY_DISTRIBUTIONS, default='fixed')
+    parser.add_argument('--latency-spread', type=float, default=0.5,
+                        help='Uniform: +/- fraction of the mean; lognormal: sigma')
+    parser.add_argument('--chunks', type=int, default=8, help='Chunks per streamed answer')
+    parser.add_argument('--schedule', default='200', help='Comma-separated statuses to cycle through, e.g. 200,429,503')
+    parser.add_argument('--retry-after', type=float, help='Retry-After seconds sent with 429s')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests failed at random')
+    parser.add_argument('--error-statuses', default='503', help='Statuses used for random failures')
+    parser.add_argument('--seed', type=int, default=1234, help='Seed for latency and error sampling')
+
+
+def stub_options(args: argparse.Namespace) -> dict:
+    return {
+        'latency_ms': args.latency_ms,
+        'latency_dist': args.latency_dist,
+        'latency_spread': args.latency_spread,
+        'chunks': args.chunks,
+        'schedule': [int(status) for status in args.schedule.split(',')],
+        'retry_after': args.retry_after,
+        'error_rate': args.error_rate,
+        'error_statuses': [int(status) for status in args.error_statuses.split(',')],
+        'seed': args.seed
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    server = start_stub(args.port, args.host, **stub_options(args))
+    print(f"Gemini stub listening on {stub_url(server)} (OpenAI format on {stub_openai_url(server)})")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,290 @@
+"""
+Load test the app under several gunicorn configurations against the local Gemini stub.
+
+Each configuration is started with GEMINI_API_URL pointing at the stub. Then
+`--users` virtual users with their own session cookie run a closed loop for
+`--duration` seconds. Each loop sends a /chat (or, for `--stream-ratio` of
+them, a /chat/stream), and sends /clear every `--clear-every` chats. Questions
+come from a multilingual corpus, and `--repeat-ratio` of them are drawn from
+a small hot set so the response cache is exercised.
+
+With `--replay LOG`, the users instead replay the request sequence found in a
+log file: werkzeug lines in the old text chatbot.log, or JSON access lines
+from the current logging setup. `--replay-speed` keeps the original pacing
+(1 = real time, 10 = ten times faster; 0 = back to back).
+
+Results (requests/s, p50/p95/p99, error and fallback rates per endpoint)
+are printed and saved under benchmarks/results/<commit>/load_test.json.
+
+    python benchmarks/load_test.py --configs sync:1,sync:4,gthread:2x8,async:2 --users 32 --duration 20
+    python benchmarks/load_test.py --latency-dist lognormal --latency-ms 800 --error-rate 0.05 --error-statuses 429,503
+    python benchmarks/load_test.py --replay chatbot.log --replay-speed 0 --configs sync:2
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_utils import GunicornServer, default_results_path, latency_summary, write_results  # noqa: E402
+from gemini_stub import ANSWER, add_stub_arguments, start_stub, stub_options, stub_url  # noqa: E402
+
+QUESTIONS = [
+    'What is photosynthesis?',
+    'Explain the Pythagorean theorem with an example',
+    'Who built the Taj Mahal and why?',
+    'Which is the longest river in the world?',
+    'What is a metaphor in poetry?',
+    'How do atoms form molecules?',
+    'Solve the equation 2x + 3 = 11',
+    'विज्ञान में प्रयोग क्यों जरूरी है?',
+    'गणित में समीकरण क्या होता है?',
+    'भारत का इतिहास बताइए',
+    'గణితం లో సమీకరణం అంటే ఏమిటి?',
+    'భారతదేశ చరిత్ర గురించి చెప్పండి',
+    'அறிவியல் சோதனை என்றால் என்ன?',
+    'தமிழ் இலக்கியம் பற்றி சொல்லுங்கள்',
+]
+
+REPLAYABLE = {('GET', '/'), ('POST', '/chat'), ('POST', '/chat/stream'), ('POST', '/clear'), ('GET', '/stats')}
+
+_WERKZEUG_LINE = re.compile(r'\[(\d{2}/\w{3}/\d{4} \d{2}:\d{2}:\d{2})\] "(GET|POST) (\S+) HTTP/[\d.]+"')
+
+
+def parse_config(spec: str) -> Tuple[str, List[str], Dict[str, str]]:
+    """'sync:4', 'gthread:4x8' or 'async:2' -> (name, gunicorn args, env)"""
+    kind, _, size = spec.partition(':')
+    workers, _, threads = (size or '1').partition('x')
+    if kind == 'sync':
+        return spec, ['app:app', '--workers', workers, '--worker-class', 'sync', '--threads', '1'], {}
+    if kind == 'gthread':
+        return spec, ['app:app', '--workers', workers, '--worker-class', 'gthread', '--threads', threads or '8'], {}
+    if kind == 'async':
+        return spec, ['-c', 'gunicorn_async.conf.py', 'asgi_app:app', '--workers', workers], {'WEB_CONCURRENCY': workers}
+    raise ValueError(f"Unknown configuration: {spec}")
+
+
+def parse_log(path: str) -> List[Tuple[float, str, str]]:
+    """(seconds since the first request, method, path) for each request logged in path"""
+    entries = []
+    with open(path, encoding='utf-8', errors='replace') as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('{'):
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get('logger') != 'chatbot.access' or 'path' not in record:
+                    continue
+                when = datetime.fromisoformat(record['time']).timestamp()
+                entries.append((when, record['method'], record['path']))
+                continue
+            match = _WERKZEUG_LINE.search(line)
+            if match:
+                when = datetime.strptime(match.group(1), '%d/%b/%Y %H:%M:%S').timestamp()
+                entries.append((when, match.group(2), match.group(3)))
+    entries = [entry for entry in entries if (entry[1], entry[2]) in REPLAYABLE]
+    if not entries:
+        return []
+    start = entries[0][0]
+    return [(when - start, method, path) for when, method, path in entries]
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples: Dict[str, List[Tuple[bool, float, Optional[float], bool]]] = {}
+
+    def add(self, endpoint: str, ok: bool, elapsed: float, ttfb: Optional[float] = None, fallback: bool = False):
+        with self.lock:
+            self.samples.setdefault(endpoint, []).append((ok, elapsed, ttfb, fallback))
+
+    def summary(self, wall: float) -> Dict:
+        endpoints = {}
+        all_latencies, total, errors = [], 0, 0
+        for endpoint, samples in sorted(self.samples.items()):
+            latencies = [elapsed for ok, elapsed, _, _ in samples if ok]
+            failed = sum(1 for ok, *_ in samples if not ok)
+            stats = {
+                'requests': len(samples),
+                'errors': failed,
+                'error_rate': round(failed / len(samples), 4),
+                'rps': round(len(samples) / wall, 2),
+                **latency_summary(latencies)
+            }
+            ttfbs = [ttfb for ok, _, ttfb, _ in samples if ok and ttfb is not None]
+            if ttfbs:
+                stats.update(latency_summary(ttfbs, prefix='ttfb_'))
+            if endpoint in ('chat', 'stream'):
+                stats['fallback_rate'] = round(sum(1 for ok, _, _, fb in samples if ok and fb) / max(len(latencies), 1), 4)
+            endpoints[endpoint] = stats
+            all_latencies.extend(latencies)
+            total += len(samples)
+            errors += failed
+        return {
+            'requests': total,
+            'errors': errors,
+            'error_rate': round(errors / total, 4) if total else 0.0,
+            'rps': round(total / wall, 2),
+            'wall_s': round(wall, 2),
+            **latency_summary(all_latencies),
+            'endpoints': endpoints
+        }
+
+
+def send(session: requests.Session, base_url: str, method: str, path: str, message: str,
+         recorder: Recorder, timeout: float) -> None:
+    endpoint = {'/chat': 'chat', '/chat/stream': 'stream', '/clear': 'clear', '/': 'index', '/stats': 'stats'}[path]
+    started = time.perf_counter()
+    ttfb, fallback = None, False
+    try:
+        if path == '/chat/stream':
+            with session.post(base_url + path, json={'message': message}, stream=True, timeout=timeout) as response:
+                ok = response.status_code == 200
+                text = []
+                for line in response.iter_lines(decode_unicode=True):
+                    if line and line.startswith('data:') and '"text"' in line:
+                        if ttfb is None:
+                            ttfb = time.perf_counter() - started
+                        text.append(json.loads(line[5:]).get('text', ''))
+                fallback = ok and ''.join(text) != ANSWER
+        elif method == 'POST':
+            body = {'message': message} if path == '/chat' else None
+            response = session.post(base_url + path, json=body, timeout=timeout)
+            ok = response.status_code == 200
+            if ok and path == '/chat':
+                fallback = response.json().get('response') != ANSWER
+        else:
+            response = session.get(base_url + path, timeout=timeout)
+            ok = response.status_code == 200
+    except (requests.RequestException, ValueError):
+        ok = False
+    recorder.add(endpoint, ok, time.perf_counter() - started, ttfb, fallback)
+
+
+def pick_question(rng: random.Random, repeat_ratio: float, user: int, n: int) -> str:
+    question = rng.choice(QUESTIONS)
+    if rng.random() < repeat_ratio:
+        return question
+    return f"{question} ({user}-{n})"
+
+
+def run_closed_loop(base_url: str, args: argparse.Namespace) -> Dict:
+    recorder = Recorder()
+    deadline = time.perf_counter() + args.duration
+
+    def user(index: int):
+        rng = random.Random(args.seed + index)
+        session = requests.Session()
+        n = 0
+        while time.perf_counter() < deadline:
+            n += 1
+            path = '/chat/stream' if rng.random() < args.stream_ratio else '/chat'
+            send(session, base_url, 'POST', path, pick_question(rng, args.repeat_ratio, index, n),
+                 recorder, args.request_timeout)
+            if args.clear_every and n % args.clear_every == 0:
+                send(session, base_url, 'POST', '/clear', '', recorder, args.request_timeout)
+
+    return run_users(user, args.users, recorder)
+
+
+def run_replay(base_url: str, entries: List[Tuple[float, str, str]], args: argparse.Namespace) -> Dict:
+    recorder = Recorder()
+
+    def user(index: int):
+        rng = random.Random(args.seed + index)
+        session = requests.Session()
+        started = time.perf_counter()
+        for n, (offset, method, path) in enumerate(entries):
+            if args.replay_speed > 0:
+                delay = offset / args.replay_speed - (time.perf_counter() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            send(session, base_url, method, path, pick_question(rng, args.repeat_ratio, index, n),
+                 recorder, args.request_timeout)
+
+    return run_users(user, args.users, recorder)
+
+
+def run_users(user, count: int, recorder: Recorder) -> Dict:
+    threads = [threading.Thread(target=user, args=(i,)) for i in range(count)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recorder.summary(time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--configs', default='sync:1,sync:4,gthread:2x8,async:2',
+                        help='Comma-separated gunicorn setups: sync:<workers>, gthread:<workers>x<threads>, async:<workers>')
+    parser.add_argument('--users', type=int, default=32, help='Concurrent virtual users')
+    parser.add_argument('--duration', type=float, default=15, help='Seconds per configuration (closed loop)')
+    parser.add_argument('--stream-ratio', type=float, default=0.0, help='Fraction of chats sent to /chat/stream')
+    parser.add_argument('--repeat-ratio', type=float, default=0.2, help='Fraction of questions from the hot set')
+    parser.add_argument('--clear-every', type=int, default=10, help='Send /clear after this many chats (0 = never)')
+    parser.add_argument('--replay', help='Replay the requests found in this log file instead of the closed loop')
+    parser.add_argument('--replay-speed', type=float, default=0, help='Replay pacing factor (0 = back to back)')
+    parser.add_argument('--request-timeout', type=float, default=60)
+    parser.add_argument('--json', help='Results file (default: benchmarks/results/<commit>/load_test.json)')
+    add_stub_arguments(parser, latency_ms=300)
+    args = parser.parse_args()
+
+    entries = []
+    if args.replay:
+        entries = parse_log(args.replay)
+        if not entries:
+            parser.error(f"No replayable requests found in {args.replay}")
+        print(f"Replaying {len(entries)} requests from {args.replay} with {args.users} user(s)")
+
+    stub = start_stub(**stub_options(args))
+    env = {
+        'LLM_PROVIDERS': 'gemini',
+        'GENAI_API_KEY': 'stub',
+        'GEMINI_API_URL': stub_url(stub),
+        'LOG_FILE': '',
+        'LOG_LEVEL': 'WARNING',
+    }
+
+    results = {}
+    for spec in args.configs.split(','):
+        name, gunicorn_args, config_env = parse_config(spec)
+        try:
+            with GunicornServer(gunicorn_args + ['--timeout', '120'], {**env, **config_env}) as server:
+                if entries:
+                    results[name] = run_replay(server.base_url, entries, args)
+                else:
+                    results[name] = run_closed_loop(server.base_url, args)
+        except RuntimeError as e:
+            print(f"{name:>12}: skipped ({e})")
+            results[name] = {'error': str(e)}
+            continue
+        r = results[name]
+        print(f"{name:>12}: {r['rps']:>8.2f} req/s  p50 {r['p50_ms']:>8.1f}ms  p95 {r['p95_ms']:>8.1f}ms  "
+              f"p99 {r['p99_ms']:>8.1f}ms  errors {r['error_rate'] * 100:.2f}%")
+        for endpoint, e in r['endpoints'].items():
+            extra = f"  fallback {e['fallback_rate'] * 100:.1f}%" if 'fallback_rate' in e else ''
+            ttfb = f"  ttfb p95 {e['ttfb_p95_ms']:.1f}ms" if 'ttfb_p95_ms' in e else ''
+            print(f"{'':>12}  {endpoint:>7}: {e['requests']:>6} req  p50 {e['p50_ms']:>8.1f}ms  "
+                  f"p99 {e['p99_ms']:>8.1f}ms  errors {e['error_rate'] * 100:.2f}%{extra}{ttfb}")
+
+    settings = {key: value for key, value in vars(args).items() if key != 'json'}
+    write_results(args.json or default_results_path('load_test'),
+                  {'benchmark': 'load_test', 'settings': settings,
+                   'upstream_requests': stub.stub.requests, 'results': results})
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""
+Drive the Gemini rate limiter and circuit breaker through a scripted outage.
+
+Runs app.py in-process against the local Gemini stub and walks through four
+phases: healthy, throttled (429 + Retry-After), hard outage (503) and
+recovery. Each phase fires a burst of concurrent /chat-equivalent calls with
+unique messages (so the response cache never hits) and reports how many were
+answered upstream, how many fell back, how many upstream requests they cost
+and the limiter/breaker state afterwards. Exits non-zero if the breaker did
+not open during the outage or did not close again after recovery, or if a
+half-open breaker re-opens when the local rate limiter (not the upstream)
+turns its trial call away.
+
+    python benchmarks/resilience_scenario.py --concurrency 20
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from bench_utils import write_results  # noqa: E402
+from gemini_stub import ANSWER, start_stub, stub_url  # noqa: E402
+from resilience import AdaptiveRateLimiter, CircuitBreaker, UpstreamGuard  # noqa: E402
+
+
+def run_phase(app_module, stub, name: str, concurrency: int) -> Dict:
+    requests_before = stub.stub.requests
+
+    def one(i: int) -> bool:
+        context = {'language': 'english', 'topic': 'science'}
+        text, _ = app_module.generate_cached_response(f'{name} question #{i} about photosynthesis', context)
+        return text == ANSWER
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        answered = sum(pool.map(one, range(concurrency)))
+    wall = time.perf_counter() - started
+
+    guard = app_module.llm_router.provider('gemini').guard.stats()
+    return {
+        'phase': name,
+        'calls': concurrency,
+        'answered': answered,
+        'fallback': concurrency - answered,
+        'upstream_requests': stub.stub.requests - requests_before,
+        'wall_s': round(wall, 3),
+        'limiter_rate': guard['rate_limiter']['rate'],
+        'breaker': guard['circuit_breaker']['state']
+    }
+
+
+def half_open_throttle_check() -> bool:
+    """A half-open trial refused by the local limiter must leave the breaker half-open, not re-open it"""
+    guard = UpstreamGuard(AdaptiveRateLimiter(rate=0.5, burst=1, min_rate=0.5), CircuitBreaker(1, reset_timeout=0.05))
+    guard.breaker.record_failure()
+    time.sleep(0.1)
+    assert guard.admit(max_wait=0) is not None  # the trial call takes the only token
+    guard.on_cancel()
+    refused = guard.admit(max_wait=0)
+    breaker = guard.breaker.stats()
+    return refused is None and breaker['state'] == CircuitBreaker.HALF_OPEN and breaker['opened'] == 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--latency-ms', type=float, default=50)
+    parser.add_argument('--reset-timeout', type=float, default=2.0, help='Circuit breaker reset timeout')
+    parser.add_argument('--pause', type=float, default=2.0, help='Seconds between phases')
+    parser.add_argument('--json', help='Write results to this file')
+    parser.add_argument('--verbose', action='store_true', help='Show app log output')
+    args = parser.parse_args()
+
+    stub = start_stub(latency_ms=args.latency_ms)
+    os.environ.update({
+        'LLM_PROVIDERS': 'gemini',
+        'GENAI_API_KEY': 'stub',
+        'GEMINI_API_URL': stub_url(stub),
+        'BREAKER_RESET_TIMEOUT': str(args.reset_timeout),
+        'RETRY_BASE_DELAY': '0.2',
+        'RETRY_MAX_DELAY': '1',
+        'RATE_LIMIT_MAX_WAIT': '3',
+        'RESPONSE_CACHE_DB': '',
+    })
+    import app as app_module
+    guard = app_module.llm_router.provider('gemini').guard
+    if not args.verbose:
+        logging.disable(logging.CRITICAL)
+
+    results = [run_phase(app_module, stub, 'healthy', args.concurrency)]
+
+    time.sleep(args.pause)
+    stub.stub.retry_after = 1
+    stub.stub.set_schedule([429, 429, 200])
+    results.append(run_phase(app_module, stub, 'throttled', args.concurrency))
+
+    time.sleep(args.pause)
+    stub.stub.set_schedule([503])
+    results.append(run_phase(app_module, stub, 'outage', args.concurrency))
+    opened = guard.breaker.stats()['opened'] > 0
+
+    stub.stub.set_schedule([200])
+    time.sleep(args.reset_timeout)
+    results.append(run_phase(app_module, stub, 'recovery', args.concurrency))
+    recovered = results[-1]['breaker'] == 'closed'
+
+    print(f"{'phase':>10} {'calls':>6} {'answered':>9} {'fallback':>9} {'upstream':>9} "
+          f"{'wall s':>8} {'rate/s':>7} breaker")
+    for r in results:
+        print(f"{r['phase']:>10} {r['calls']:>6} {r['answered']:>9} {r['fallback']:>9} "
+              f"{r['upstream_requests']:>9} {r['wall_s']:>8.2f} {r['limiter_rate']:>7.2f} {r['breaker']}")
+    print(json.dumps(guard.stats(), indent=2))
+
+    if args.json:
+        write_results(args.json, {'benchmark': 'resilience_scenario', 'concurrency': args.concurrency,
+                                  'results': results, 'final': guard.stats()})
+
+    if not (opened and recovered):
+        print("FAIL: breaker did not open during the outage and close after recovery")
+        sys.exit(1)
+    if not half_open_throttle_check():
+        print("FAIL: a half-open trial refused by the local rate limiter re-opened the breaker")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
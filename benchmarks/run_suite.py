@@ -0,0 +1,61 @@
+"""
+Run the benchmark suite and save every result under benchmarks/results/<commit>/.
+
+    python benchmarks/run_suite.py            # full run
+    python benchmarks/run_suite.py --quick    # shorter load test, for a pre-merge check
+    python benchmarks/compare_results.py benchmarks/results/<old> benchmarks/results/<new>
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_utils import BENCH_DIR, ROOT, RESULTS_DIR, git_revision  # noqa: E402
+
+
+def suite(quick: bool):
+    load_args = ['--configs', 'sync:2,gthread:2x8,async:2', '--users', '16', '--duration', '5'] if quick else \
+        ['--configs', 'sync:1,sync:4,gthread:2x8,async:2', '--users', '32', '--duration', '15']
+    return [
+        ('classifier', 'bench_classifier.py', []),
+        ('offline_answers', 'bench_offline_answers.py', ['--repeat', '50' if quick else '200']),
+        ('similarity', 'bench_similarity.py', ['--repeat', '50' if quick else '200']),
+        ('logging', 'bench_logging.py', ['--requests', '5000' if quick else '20000']),
+        ('providers', 'bench_providers.py', ['--calls', '100' if quick else '300']),
+        ('shared_state', 'bench_shared_state.py', ['--lookups', '5000' if quick else '20000']),
+        ('startup', 'bench_startup.py', ['--workers', '2' if quick else '4', '--imports', '3' if quick else '5']),
+        ('load_test', 'load_test.py', load_args + ['--latency-dist', 'lognormal', '--latency-ms', '300']),
+        ('load_test_faults', 'load_test.py', load_args + ['--latency-ms', '300', '--error-rate', '0.05',
+                                                          '--error-statuses', '429,503', '--stream-ratio', '0.25']),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--quick', action='store_true')
+    parser.add_argument('--only', help='Comma-separated benchmark names to run')
+    args = parser.parse_args()
+
+    out_dir = os.path.join(RESULTS_DIR, git_revision()['commit'])
+    os.makedirs(out_dir, exist_ok=True)
+    only = set(args.only.split(',')) if args.only else None
+
+    failed = []
+    for name, script, extra in suite(args.quick):
+        if only and name not in only:
+            continue
+        print(f"== {name}")
+        command = [sys.executable, os.path.join(BENCH_DIR, script), *extra, '--json', os.path.join(out_dir, f'{name}.json')]
+        if subprocess.run(command, cwd=ROOT).returncode != 0:
+            failed.append(name)
+
+    print(f"Results in {out_dir}")
+    if failed:
+        print(f"Failed: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
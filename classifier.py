@@ -0,0 +1,119 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from config import Config
+
+
+def _utf8_prefixes(start: int, end: int) -> Tuple[bytes, ...]:
+    """
+    Two-byte UTF-8 prefixes covering the codepoints start..end.
+
+    Every 64-codepoint run in U+0800..U+FFFF encodes with a unique lead byte
+    pair, so counting the prefixes in the encoded text counts the codepoints.
+    """
+    if not (0x0800 <= start <= end <= 0xFFFF) or start % 64 or (end + 1) % 64:
+        raise ValueError(f"Script range {start:#06x}-{end:#06x} must be 64-aligned within U+0800..U+FFFF")
+    return tuple(
+        bytes([0xE0 | (cp >> 12), 0x80 | ((cp >> 6) & 0x3F)])
+        for cp in range(start, end + 1, 64)
+    )
+
+
+class LanguageTopicClassifier:
+    """
+    Language and topic classifier whose tables are built once from Config.
+
+    Language detection counts script codepoints in a single UTF-8 encoding of
+    the text. Topic detection lowercases the message once and checks the
+    precompiled keyword table of the detected language.
+    """
+
+    def __init__(self, topics: Optional[Dict[str, Dict[str, List[str]]]] = None,
+                 scripts: Optional[Dict[str, Tuple[int, int]]] = None,
+                 default_language: str = Config.DEFAULT_LANGUAGE):
+        topics = topics if topics is not None else Config.EDUCATIONAL_TOPICS
+        scripts = scripts if scripts is not None else Config.LANGUAGE_SCRIPTS
+        self.default_language = default_language
+        self.topics = tuple(topics)
+
+        # (language, utf-8 prefixes) in detection priority order
+        self._scripts = tuple(
+            (language, _utf8_prefixes(start, end))
+            for language, (start, end) in scripts.items()
+        )
+
+        # language -> ((lowercased keyword, topic index), ...)
+        languages = set(Config.SUPPORTED_LANGUAGES) | {
+            language for lang_keywords in topics.values() for language in lang_keywords
+        }
+        self._keywords = {}
+        for language in languages:
+            table = []
+            for index, lang_keywords in enumerate(topics.values()):
+                # Same fallback as Config.get_topic_keywords
+                keywords = lang_keywords.get(language, lang_keywords.get(default_language, []))
+                table.extend((keyword.lower(), index) for keyword in keywords)
+            self._keywords[language] = tuple(table)
+
+    def script_histogram(self, text: str) -> Dict[str, int]:
+        """Count the codepoints of each configured script in the text"""
+        if text.isascii():
+            return {language: 0 for language, _ in self._scripts}
+        encoded = text.encode('utf-8', 'surrogatepass')
+        return {
+            language: sum(encoded.count(prefix) for prefix in prefixes)
+            for language, prefixes in self._scripts
+        }
+
+    def detect_language(self, text: str) -> str:
+        """Return the highest-priority language whose script appears in the text"""
+        if text.isascii():
+            return self.default_language
+        encoded = text.encode('utf-8', 'surrogatepass')
+        for language, prefixes in self._scripts:
+            for prefix in prefixes:
+                if prefix in encoded:
+                    return language
+        return self.default_language
+
+    def detect_topic(self, text: str, language: str) -> str:
+        """Return the topic with the most distinct keyword matches (first topic wins ties)"""
+        keywords = self._keywords.get(language) or self._keywords[self.default_language]
+        lowered = text.lower()
+        counts = [0] * len(self.topics)
+        for keyword, index in keywords:
+            if keyword in lowered:
+                counts[index] += 1
+
+        detected_topic = 'general'
+        max_matches = 0
+        for index, matches in enumerate(counts):
+            if matches > max_matches:
+                max_matches = matches
+                detected_topic = self.topics[index]
+        return detected_topic
+
+    def get_context(self, text: str, language: str) -> Dict:
+        return {
+            'topic': self.detect_topic(text, language),
+            'language': language,
+            'message_length': len(text)
+        }
+
+    def classify(self, text: str) -> Dict:
+        """Detect language and topic in one call"""
+        return self.get_context(text, self.detect_language(text))
+
+    def classify_many(self, texts: Iterable[str]) -> List[Dict]:
+        """Classify a batch of messages, classifying repeated messages only once"""
+        results = {}
+        contexts = []
+        for text in texts:
+            context = results.get(text)
+            if context is None:
+                context = results[text] = self.classify(text)
+            contexts.append(dict(context))
+        return contexts
+
+
+# Built once at import so worker processes share the read-only tables
+classifier = LanguageTopicClassifier()
@@ -0,0 +1,129 @@
+import gzip
+import hashlib
+import logging
+from typing import Dict, Mapping, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+try:
+    import brotli
+except ImportError:  # brotli variants are optional; gzip is always available
+    brotli = None
+
+# Preferred order when the client accepts several encodings equally
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def parse_accept_encoding(header: Optional[str]) -> Dict[str, float]:
+    """Map each coding in an Accept-Encoding header to its q-value"""
+    accepted = {}
+    for part in (header or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+def choose_encoding(header: Optional[str], available=ENCODINGS) -> Optional[str]:
+    """Best encoding from `available` the client accepts, or None for identity"""
+    accepted = parse_accept_encoding(header)
+    wildcard = accepted.get('*', 0.0)
+    best, best_q = None, 0.0
+    for coding in available:
+        q = accepted.get(coding, wildcard)
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+def compress(body: bytes, encoding: str, level: int = 6) -> bytes:
+    """Compress with `level` on gzip's 1-9 scale (mapped onto brotli's 0-11 quality)"""
+    if encoding == 'br':
+        return brotli.compress(body, quality=min(11, round(level * 11 / 9)))
+    # mtime=0 keeps the output, and so the ETags of precompressed variants, stable across restarts
+    return gzip.compress(body, compresslevel=level, mtime=0)
+
+
+def compress_body(body: bytes, accept_encoding: Optional[str], min_size: int = 512,
+                  level: int = 6) -> Tuple[bytes, Optional[str]]:
+    """
+    Compress a dynamic response body for the client, returning (body, content encoding).
+
+    Bodies smaller than `min_size` are returned as-is: below roughly one packet
+    the CPU cost buys no transfer time.
+    """
+    if len(body) < min_size:
+        return body, None
+    encoding = choose_encoding(accept_encoding)
+    if encoding is None:
+        return body, None
+    compressed = compress(body, encoding, level)
+    if len(compressed) >= len(body):
+        return body, None
+    return compressed, encoding
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header matches `etag` (weak comparison, as RFC 9110 requires)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+
+class PrecompressedAsset:
+    """
+    A static response body rendered once, with gzip/brotli variants built at maximum compression.
+
+    Each variant gets its own strong ETag (a representation with a different
+    Content-Encoding is a different entity), so caches and 304 checks never mix
+    them up.
+    """
+
+    def __init__(self, body: bytes, content_type: str, cache_control: str = 'no-cache'):
+        self.content_type = content_type
+        self.cache_control = cache_control
+        digest = hashlib.sha256(body).hexdigest()[:20]
+        self.variants: Dict[Optional[str], Tuple[bytes, str]] = {None: (body, f'"{digest}"')}
+        for encoding in ENCODINGS:
+            compressed = compress(body, encoding, level=9)
+            if len(compressed) < len(body):
+                self.variants[encoding] = (compressed, f'"{digest}-{encoding}"')
+        sizes = ', '.join(f"{encoding}={size}B" for encoding, size in self.stats().items())
+        logger.info(f"Precompressed asset: {sizes}")
+
+    def respond(self, headers: Mapping[str, str]) -> Tuple[int, bytes, Dict[str, str]]:
+        """(status, body, headers) for a GET with the given request headers"""
+        encoding = choose_encoding(headers.get('Accept-Encoding'), [e for e in self.variants if e])
+        body, etag = self.variants[encoding]
+        response_headers = {
+            'ETag': etag,
+            'Cache-Control': self.cache_control,
+            'Vary': 'Accept-Encoding'
+        }
+        if etag_matches(headers.get('If-None-Match'), etag):
+            return 304, b'', response_headers
+        response_headers['Content-Type'] = self.content_type
+        if encoding:
+            response_headers['Content-Encoding'] = encoding
+        return 200, body, response_headers
+
+    def stats(self) -> Dict:
+        return {(encoding or 'identity'): len(data) for encoding, (data, _) in self.variants.items()}
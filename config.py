@@ -8,16 +8,116 @@ class Config:
     SECRET_KEY = os.getenv('SECRET_KEY', 'your-secret-key-change-in-production')
     DEBUG = os.getenv('FLASK_DEBUG', 'False').lower() == 'true'
     
-    # OpenAI Configuration
+    # Gemini Configuration
+    GENAI_API_KEY = os.getenv('GENAI_API_KEY')
+    GEMINI_API_URL = os.getenv(
+        'GEMINI_API_URL',
+        "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent"
+    )
+    
+    # OpenAI Configuration (any OpenAI-compatible chat completions endpoint)
     OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+    OPENAI_API_URL = os.getenv('OPENAI_API_URL', 'https://api.openai.com/v1/chat/completions')
     OPENAI_MODEL = os.getenv('OPENAI_MODEL', 'gpt-3.5-turbo')
     OPENAI_TEMPERATURE = float(os.getenv('OPENAI_TEMPERATURE', '0.5'))
     OPENAI_MAX_TOKENS = int(os.getenv('OPENAI_MAX_TOKENS', '1000'))
     
+    # LLM Provider Routing: providers with an API key, in order of preference until latencies are known
+    LLM_PROVIDERS = [name.strip() for name in os.getenv('LLM_PROVIDERS', 'gemini,openai').split(',') if name.strip()]
+    PROVIDER_WINDOW = int(os.getenv('PROVIDER_WINDOW', '200'))
+    PROVIDER_MIN_SAMPLES = int(os.getenv('PROVIDER_MIN_SAMPLES', '20'))
+    PROVIDER_THREADS = int(os.getenv('PROVIDER_THREADS', '64'))
+    # A duplicate goes to the next provider once the first is slower than its observed HEDGE_PERCENTILE
+    HEDGE_REQUESTS = os.getenv('HEDGE_REQUESTS', 'True').lower() == 'true'
+    HEDGE_PERCENTILE = float(os.getenv('HEDGE_PERCENTILE', '95'))
+    HEDGE_MIN_DELAY = float(os.getenv('HEDGE_MIN_DELAY', '0.05'))
+    HEDGE_MAX_DELAY = float(os.getenv('HEDGE_MAX_DELAY', '10'))
+    
+    # Upstream HTTP Client Configuration
+    UPSTREAM_POOL_SIZE = int(os.getenv('UPSTREAM_POOL_SIZE', '10'))
+    UPSTREAM_CONNECT_TIMEOUT = float(os.getenv('UPSTREAM_CONNECT_TIMEOUT', '5'))
+    UPSTREAM_READ_TIMEOUT = float(os.getenv('UPSTREAM_READ_TIMEOUT', '30'))
+    UPSTREAM_KEEPALIVE = os.getenv('UPSTREAM_KEEPALIVE', 'True').lower() == 'true'
+    UPSTREAM_HTTP2 = os.getenv('UPSTREAM_HTTP2', 'False').lower() == 'true'
+    # The asyncio serving mode multiplexes many chats per process, so it needs a larger pool
+    ASYNC_UPSTREAM_POOL_SIZE = int(os.getenv('ASYNC_UPSTREAM_POOL_SIZE', '256'))
+    # Connections each worker opens to every provider before it takes traffic (0 skips the warm-up)
+    UPSTREAM_WARM_CONNECTIONS = int(os.getenv('UPSTREAM_WARM_CONNECTIONS', '2'))
+    
+    # Upstream Resilience Configuration (per provider and worker process; rate limits per host with SHARED_STATE_FILE)
+    RATE_LIMIT_RPS = float(os.getenv('RATE_LIMIT_RPS', '10'))
+    RATE_LIMIT_BURST = float(os.getenv('RATE_LIMIT_BURST', '20'))
+    RATE_LIMIT_MIN_RPS = float(os.getenv('RATE_LIMIT_MIN_RPS', '0.5'))
+    RATE_LIMIT_MAX_RPS = float(os.getenv('RATE_LIMIT_MAX_RPS', '50'))
+    RATE_LIMIT_MAX_WAIT = float(os.getenv('RATE_LIMIT_MAX_WAIT', '10'))
+    BREAKER_FAILURE_THRESHOLD = int(os.getenv('BREAKER_FAILURE_THRESHOLD', '5'))
+    BREAKER_RESET_TIMEOUT = float(os.getenv('BREAKER_RESET_TIMEOUT', '30'))
+    UPSTREAM_MAX_RETRIES = int(os.getenv('UPSTREAM_MAX_RETRIES', '3'))
+    RETRY_BASE_DELAY = float(os.getenv('RETRY_BASE_DELAY', '2'))
+    RETRY_MAX_DELAY = float(os.getenv('RETRY_MAX_DELAY', '8'))
+    
+    # Response Cache Configuration
+    RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', '1024'))
+    RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', '86400'))
+    RESPONSE_CACHE_DB = os.getenv('RESPONSE_CACHE_DB', '')
+    
+    # Shared State (memory-mapped file every worker on the host maps: counters, hot answers, token buckets; empty disables)
+    SHARED_STATE_FILE = os.getenv('SHARED_STATE_FILE', '')
+    SHARED_ANSWER_SLOTS = int(os.getenv('SHARED_ANSWER_SLOTS', '1024'))
+    SHARED_ANSWER_BYTES = int(os.getenv('SHARED_ANSWER_BYTES', '8192'))
+    SHARED_STATE_WORKERS = int(os.getenv('SHARED_STATE_WORKERS', '128'))
+    
+    # Similar Question Index (paraphrased repeats of answered questions; threshold 0 disables)
+    SIMILARITY_THRESHOLD = float(os.getenv('SIMILARITY_THRESHOLD', '0.8'))
+    SIMILARITY_MAX_ENTRIES = int(os.getenv('SIMILARITY_MAX_ENTRIES', '10000'))
+    SIMILARITY_INDEX_FILE = os.getenv('SIMILARITY_INDEX_FILE', '')
+    
+    # Offline Answers (BM25 over knowledge_base/, used without Gemini or when it fails)
+    KNOWLEDGE_BASE_DIR = os.getenv('KNOWLEDGE_BASE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'knowledge_base'))
+    KNOWLEDGE_INDEX_FILE = os.getenv('KNOWLEDGE_INDEX_FILE', 'knowledge_base.idx')
+    OFFLINE_MIN_SCORE = float(os.getenv('OFFLINE_MIN_SCORE', '3.0'))
+    
+    # Compression Configuration (/chat JSON; the page is always precompressed)
+    COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', '512'))
+    COMPRESSION_LEVEL = int(os.getenv('COMPRESSION_LEVEL', '6'))
+    
     # Chat Configuration
     MAX_CONVERSATION_HISTORY = int(os.getenv('MAX_CONVERSATION_HISTORY', '20'))
     MAX_MESSAGE_LENGTH = int(os.getenv('MAX_MESSAGE_LENGTH', '2000'))
     
+    # Admission Control (per worker process): chats answered at once, then a bounded queue served
+    # round-robin by session; MAX_ACTIVE_CHATS=0 turns it off
+    MAX_ACTIVE_CHATS = int(os.getenv('MAX_ACTIVE_CHATS', '32'))
+    MAX_QUEUED_CHATS = int(os.getenv('MAX_QUEUED_CHATS', '64'))
+    MAX_QUEUE_TIME = float(os.getenv('MAX_QUEUE_TIME', '5'))
+    # Active plus queued chats one session or client address may hold (a classroom may share one address)
+    MAX_CHATS_PER_SESSION = int(os.getenv('MAX_CHATS_PER_SESSION', '2'))
+    MAX_CHATS_PER_IP = int(os.getenv('MAX_CHATS_PER_IP', '48'))
+    # Reverse proxies in front of the app whose X-Forwarded-For is trusted for the client address
+    FORWARDED_HOPS = int(os.getenv('FORWARDED_HOPS', '0'))
+    
+    # Request Deadlines (seconds): clients may ask for less with an X-Request-Timeout header,
+    # never more than the cap; REQUEST_DEADLINE=0 turns deadlines off
+    REQUEST_DEADLINE = float(os.getenv('REQUEST_DEADLINE', '25'))
+    MIN_REQUEST_DEADLINE = float(os.getenv('MIN_REQUEST_DEADLINE', '2'))
+    BATCH_DEADLINE = float(os.getenv('BATCH_DEADLINE', '120'))
+    # Keep-alive comment sent on /chat/stream while waiting for the first chunk, to notice gone clients
+    STREAM_HEARTBEAT = float(os.getenv('STREAM_HEARTBEAT', '2'))
+    
+    # Batch Configuration (/chat/batch)
+    MAX_BATCH_SIZE = int(os.getenv('MAX_BATCH_SIZE', '100'))
+    BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', '16'))
+    
+    # Prompt Assembly Configuration (estimated tokens)
+    PROMPT_TOKEN_BUDGET = int(os.getenv('PROMPT_TOKEN_BUDGET', '2000'))
+    PROMPT_SUMMARY_TOKENS = int(os.getenv('PROMPT_SUMMARY_TOKENS', '300'))
+    
+    # Conversation Store Configuration ('memory' or 'sqlite')
+    CONVERSATION_BACKEND = os.getenv('CONVERSATION_BACKEND', 'memory')
+    CONVERSATION_DB = os.getenv('CONVERSATION_DB', 'conversations.db')
+    CONVERSATION_TTL = float(os.getenv('CONVERSATION_TTL', str(6 * 3600)))
+    CONVERSATION_MEMORY_BUDGET = int(os.getenv('CONVERSATION_MEMORY_BUDGET', str(32 * 1024 * 1024)))
+    
     # Supported Languages
     SUPPORTED_LANGUAGES = {
         'english': 'English',
@@ -26,6 +126,15 @@ class Config:
         'tamil': 'தமிழ்'
     }
     
+    # Unicode blocks that identify each language's script, in detection priority order.
+    # Text without any of these scripts is treated as English.
+    LANGUAGE_SCRIPTS = {
+        'hindi': (0x0900, 0x097F),   # Devanagari
+        'telugu': (0x0C00, 0x0C7F),  # Telugu
+        'tamil': (0x0B80, 0x0BFF)    # Tamil
+    }
+    DEFAULT_LANGUAGE = 'english'
+    
     # Educational Topics
     EDUCATIONAL_TOPICS = {
         'science': {
@@ -60,9 +169,20 @@ class Config:
         }
     }
     
+    # Metrics Configuration: with a directory, every worker's metrics are merged into /metrics
+    METRICS_DIR = os.getenv('METRICS_DIR', '')
+    METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', '1'))
+    
     # Logging Configuration
     LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
     LOG_FILE = os.getenv('LOG_FILE', 'chatbot.log')
+    LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')  # 'json' lines or 'text'
+    LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', str(10 * 1024 * 1024)))
+    LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', '5'))
+    LOG_ROTATE_WHEN = os.getenv('LOG_ROTATE_WHEN', '')  # e.g. 'midnight' for daily rotation instead of by size
+    LOG_MAX_LENGTH = int(os.getenv('LOG_MAX_LENGTH', '2000'))
+    LOG_ACCESS_SAMPLE_RATE = float(os.getenv('LOG_ACCESS_SAMPLE_RATE', '0.1'))
+    LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
     
     @classmethod
     def get_topic_keywords(cls, language: str) -> Dict[str, list]:
@@ -0,0 +1,377 @@
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from typing import Callable, Dict, List, Optional
+
+from config import Config
+from prompt_builder import ConversationContext
+
+logger = logging.getLogger(__name__)
+
+# Compact role codes stored with each entry
+_ROLE_CODES = {'user': 'u', 'assistant': 'a'}
+_ROLE_NAMES = {code: role for role, code in _ROLE_CODES.items()}
+
+
+class ConversationStore(ABC):
+    """
+    Per-session conversation history.
+
+    Each session keeps at most `max_messages` entries (oldest dropped first);
+    with a `fold` function, entries not yet in the running summary are folded
+    into it as they are dropped. Sessions idle for longer than `ttl` seconds
+    are evicted, and when the stored history exceeds `memory_budget` bytes the
+    least recently used sessions are evicted until it fits.
+    """
+
+    def __init__(self, max_messages: int = 20, ttl: float = 6 * 3600, memory_budget: int = 32 * 1024 * 1024,
+                 fold: Optional[Callable[[str, List[Dict]], str]] = None):
+        self.max_messages = max_messages
+        self.ttl = ttl
+        self.memory_budget = memory_budget
+        self.fold = fold
+
+    @abstractmethod
+    def append(self, session_id: str, role: str, content: str) -> None:
+        """Add one message to the session's history"""
+
+    def append_exchange(self, session_id: str, user_message: str, response_text: str) -> None:
+        self.append(session_id, 'user', user_message)
+        self.append(session_id, 'assistant', response_text)
+
+    def get_history(self, session_id: str) -> List[Dict[str, str]]:
+        return [{'role': m['role'], 'content': m['content']} for m in self.get_context(session_id).messages]
+
+    @abstractmethod
+    def get_context(self, session_id: str) -> ConversationContext:
+        """Stored messages (each with a monotonically increasing 'seq') plus the running summary"""
+
+    @abstractmethod
+    def set_summary(self, session_id: str, summary: str, summary_upto: int) -> None:
+        """Save the running summary of the messages up to seq summary_upto, unless a newer one is saved"""
+
+    @abstractmethod
+    def clear(self, session_id: str) -> None:
+        """Forget the session's history and summary"""
+
+    @abstractmethod
+    def stats(self) -> Dict:
+        """Sessions and stored history, for /stats"""
+
+
+class _Session:
+    __slots__ = ('entries', 'size', 'last_seen', 'appended', 'summary', 'summary_upto')
+
+    def __init__(self, max_messages: int):
+        self.entries = deque(maxlen=max_messages)
+        self.size = 0
+        self.last_seen = time.time()
+        self.appended = 0  # messages ever appended; the seq of the next message
+        self.summary = ''
+        self.summary_upto = -1
+
+
+class MemoryConversationStore(ConversationStore):
+    """In-process store: one ring buffer of (role code, content) tuples per session"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._sessions: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._total_size = 0
+        self._evictions = 0
+        self._expirations = 0
+
+    def append(self, session_id: str, role: str, content: str) -> None:
+        entry = (_ROLE_CODES.get(role, role), content)
+        entry_size = sys.getsizeof(content)
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._sessions[session_id] = _Session(self.max_messages)
+            if len(session.entries) == session.entries.maxlen:
+                dropped = session.entries[0]
+                session.size -= sys.getsizeof(dropped[1])
+                self._total_size -= sys.getsizeof(dropped[1])
+                dropped_seq = session.appended - len(session.entries)
+                if self.fold and dropped_seq > session.summary_upto:
+                    message = {'role': _ROLE_NAMES.get(dropped[0], dropped[0]), 'content': dropped[1],
+                               'seq': dropped_seq}
+                    self._set_summary(session, self.fold(session.summary, [message]), dropped_seq)
+            session.entries.append(entry)
+            session.appended += 1
+            session.size += entry_size
+            session.last_seen = time.time()
+            self._total_size += entry_size
+            self._sessions.move_to_end(session_id)
+            self._evict(keep=session_id)
+
+    def get_context(self, session_id: str) -> ConversationContext:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return ConversationContext([])
+            if time.time() - session.last_seen > self.ttl:
+                self._drop(session_id)
+                self._expirations += 1
+                return ConversationContext([])
+            session.last_seen = time.time()
+            self._sessions.move_to_end(session_id)
+            first_seq = session.appended - len(session.entries)
+            messages = [{'role': _ROLE_NAMES.get(code, code), 'content': content, 'seq': first_seq + i}
+                        for i, (code, content) in enumerate(session.entries)]
+            return ConversationContext(messages, session.summary, session.summary_upto)
+
+    def set_summary(self, session_id: str, summary: str, summary_upto: int) -> None:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None and summary_upto > session.summary_upto:
+                self._set_summary(session, summary, summary_upto)
+
+    def clear(self, session_id: str) -> None:
+        with self._lock:
+            self._drop(session_id)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'backend': 'memory',
+                'sessions': len(self._sessions),
+                'bytes': self._total_size,
+                'memory_budget': self.memory_budget,
+                'evictions': self._evictions,
+                'expirations': self._expirations
+            }
+
+    def _set_summary(self, session: _Session, summary: str, summary_upto: int) -> None:
+        # Caller must hold self._lock
+        size = sys.getsizeof(summary) - sys.getsizeof(session.summary)
+        session.summary = summary
+        session.summary_upto = summary_upto
+        session.size += size
+        self._total_size += size
+
+    def _drop(self, session_id: str) -> None:
+        # Caller must hold self._lock
+        session = self._sessions.pop(session_id, None)
+        if session is not None:
+            self._total_size -= session.size
+
+    def _evict(self, keep: str) -> None:
+        # Caller must hold self._lock. Sessions are ordered least recently used first.
+        cutoff = time.time() - self.ttl
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if session.last_seen < cutoff:
+                self._expirations += 1
+            elif self._total_size > self.memory_budget and session_id != keep:
+                self._evictions += 1
+            else:
+                break
+            self._drop(session_id)
+
+
+class SQLiteConversationStore(ConversationStore):
+    """
+    Store shared by every worker on the host through a WAL-mode SQLite database.
+    The memory budget bounds the total content bytes kept in the database.
+    """
+
+    def __init__(self, db_path: str, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.db_path = db_path
+        self._local = threading.local()
+        self._writes = 0
+        self._evictions = 0
+        self._expirations = 0
+        with self._connection() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS conversation_sessions ('
+                'session_id TEXT PRIMARY KEY, last_seen REAL NOT NULL, bytes INTEGER NOT NULL DEFAULT 0, '
+                "summary TEXT NOT NULL DEFAULT '', summary_upto INTEGER NOT NULL DEFAULT -1)"
+            )
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS conversation_messages ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL, '
+                'role TEXT NOT NULL, content TEXT NOT NULL)'
+            )
+            conn.execute(
+                'CREATE INDEX IF NOT EXISTS conversation_messages_session '
+                'ON conversation_messages (session_id, id)'
+            )
+            conn.execute(
+                'CREATE INDEX IF NOT EXISTS conversation_sessions_last_seen '
+                'ON conversation_sessions (last_seen)'
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 connections must not cross threads or forked processes
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def append(self, session_id: str, role: str, content: str) -> None:
+        now = time.time()
+        size = len(content.encode('utf-8'))
+        try:
+            with self._connection() as conn:
+                conn.execute(
+                    'INSERT INTO conversation_messages (session_id, role, content) VALUES (?, ?, ?)',
+                    (session_id, _ROLE_CODES.get(role, role), content)
+                )
+                conn.execute(
+                    'INSERT INTO conversation_sessions (session_id, last_seen, bytes) VALUES (?, ?, ?) '
+                    'ON CONFLICT(session_id) DO UPDATE SET last_seen = excluded.last_seen, '
+                    'bytes = bytes + excluded.bytes',
+                    (session_id, now, size)
+                )
+                # Ring buffer: keep only the newest max_messages entries
+                dropped = conn.execute(
+                    'SELECT id, role, content FROM conversation_messages '
+                    'WHERE session_id = ? AND id NOT IN (SELECT id FROM conversation_messages '
+                    'WHERE session_id = ? ORDER BY id DESC LIMIT ?) ORDER BY id',
+                    (session_id, session_id, self.max_messages)
+                ).fetchall()
+                if dropped:
+                    conn.execute(
+                        'DELETE FROM conversation_messages WHERE session_id = ? AND id NOT IN ('
+                        'SELECT id FROM conversation_messages WHERE session_id = ? ORDER BY id DESC LIMIT ?)',
+                        (session_id, session_id, self.max_messages)
+                    )
+                    conn.execute('UPDATE conversation_sessions SET bytes = bytes - ? WHERE session_id = ?',
+                                 (sum(len(row[2].encode('utf-8')) for row in dropped), session_id))
+                    if self.fold:
+                        self._fold_dropped(conn, session_id, dropped)
+                self._writes += 1
+                if self._writes % 50 == 0:
+                    self._prune(conn, now, keep=session_id)
+        except sqlite3.Error as e:
+            logger.error(f"Conversation store write failed: {e}")
+
+    def get_context(self, session_id: str) -> ConversationContext:
+        now = time.time()
+        try:
+            with self._connection() as conn:
+                row = conn.execute(
+                    'SELECT last_seen, summary, summary_upto FROM conversation_sessions WHERE session_id = ?',
+                    (session_id,)
+                ).fetchone()
+                if row is None:
+                    return ConversationContext([])
+                if now - row[0] > self.ttl:
+                    self._delete_sessions(conn, [session_id])
+                    self._expirations += 1
+                    return ConversationContext([])
+                conn.execute('UPDATE conversation_sessions SET last_seen = ? WHERE session_id = ?',
+                             (now, session_id))
+                rows = conn.execute(
+                    'SELECT id, role, content FROM conversation_messages WHERE session_id = ? ORDER BY id',
+                    (session_id,)
+                ).fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"Conversation store read failed: {e}")
+            return ConversationContext([])
+        # Row IDs increase monotonically, so they double as message sequence numbers
+        messages = [{'role': _ROLE_NAMES.get(code, code), 'content': content, 'seq': seq}
+                    for seq, code, content in rows]
+        return ConversationContext(messages, row[1], row[2])
+
+    def set_summary(self, session_id: str, summary: str, summary_upto: int) -> None:
+        try:
+            with self._connection() as conn:
+                conn.execute(
+                    'UPDATE conversation_sessions SET summary = ?, summary_upto = ? '
+                    'WHERE session_id = ? AND summary_upto < ?',
+                    (summary, summary_upto, session_id, summary_upto)
+                )
+        except sqlite3.Error as e:
+            logger.error(f"Conversation store write failed: {e}")
+
+    def clear(self, session_id: str) -> None:
+        try:
+            with self._connection() as conn:
+                self._delete_sessions(conn, [session_id])
+        except sqlite3.Error as e:
+            logger.error(f"Conversation store clear failed: {e}")
+
+    def stats(self) -> Dict:
+        try:
+            sessions, total = self._connection().execute(
+                'SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM conversation_sessions'
+            ).fetchone()
+        except sqlite3.Error:
+            sessions, total = None, None
+        return {
+            'backend': 'sqlite',
+            'sessions': sessions,
+            'bytes': total,
+            'memory_budget': self.memory_budget,
+            'evictions': self._evictions,
+            'expirations': self._expirations
+        }
+
+    def _fold_dropped(self, conn: sqlite3.Connection, session_id: str, dropped: List) -> None:
+        """Fold the dropped rows the session's summary does not cover yet into it"""
+        summary, summary_upto = conn.execute(
+            'SELECT summary, summary_upto FROM conversation_sessions WHERE session_id = ?', (session_id,)
+        ).fetchone()
+        messages = [{'role': _ROLE_NAMES.get(code, code), 'content': content, 'seq': seq}
+                    for seq, code, content in dropped if seq > summary_upto]
+        if messages:
+            conn.execute('UPDATE conversation_sessions SET summary = ?, summary_upto = ? WHERE session_id = ?',
+                         (self.fold(summary, messages), messages[-1]['seq'], session_id))
+
+    @staticmethod
+    def _delete_sessions(conn: sqlite3.Connection, session_ids: List[str]) -> None:
+        conn.executemany('DELETE FROM conversation_messages WHERE session_id = ?', [(s,) for s in session_ids])
+        conn.executemany('DELETE FROM conversation_sessions WHERE session_id = ?', [(s,) for s in session_ids])
+
+    def _prune(self, conn: sqlite3.Connection, now: float, keep: str) -> None:
+        """Evict idle sessions, then least recently used ones while over the budget"""
+        expired = [row[0] for row in conn.execute(
+            'SELECT session_id FROM conversation_sessions WHERE last_seen < ?', (now - self.ttl,))]
+        if expired:
+            self._delete_sessions(conn, expired)
+            self._expirations += len(expired)
+
+        total = conn.execute('SELECT COALESCE(SUM(bytes), 0) FROM conversation_sessions').fetchone()[0]
+        if total <= self.memory_budget:
+            return
+        evict = []
+        for session_id, size in conn.execute(
+                'SELECT session_id, bytes FROM conversation_sessions ORDER BY last_seen'):
+            if total <= self.memory_budget:
+                break
+            if session_id == keep:
+                continue
+            evict.append(session_id)
+            total -= size
+        self._delete_sessions(conn, evict)
+        self._evictions += len(evict)
+
+
+def create_conversation_store(backend: Optional[str] = None,
+                              fold: Optional[Callable[[str, List[Dict]], str]] = None) -> ConversationStore:
+    """Build the conversation store selected by Config.CONVERSATION_BACKEND"""
+    backend = (backend or Config.CONVERSATION_BACKEND).lower()
+    options = {
+        'max_messages': Config.MAX_CONVERSATION_HISTORY,
+        'ttl': Config.CONVERSATION_TTL,
+        'memory_budget': Config.CONVERSATION_MEMORY_BUDGET,
+        'fold': fold
+    }
+    if backend == 'sqlite':
+        return SQLiteConversationStore(Config.CONVERSATION_DB, **options)
+    if backend != 'memory':
+        logger.warning(f"Unknown CONVERSATION_BACKEND '{backend}', using in-memory store")
+    return MemoryConversationStore(**options)
@@ -0,0 +1,56 @@
+# Gunicorn settings for the Flask app:
+#   gunicorn -c gunicorn.conf.py app:app
+# The master imports the app once (preload): the classifier tables, offline-answer index,
+# preloaded response cache and rendered page are built there and shared copy-on-write by
+# the forked workers. Each worker then opens its upstream connections before it accepts
+# traffic; /ready answers 200 once it has.
+import gc
+import glob
+import os
+import tempfile
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+# Workers share metric snapshots so /metrics counts every worker whichever one answers the
+# scrape; one directory per port keeps two deployments on a host apart
+os.environ.setdefault('METRICS_DIR', os.path.join('/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(),
+                                                  f"chatbot-metrics-{os.getenv('PORT', '5000')}"))
+workers = int(os.getenv('WEB_CONCURRENCY', '2'))
+# Threaded workers, so a worker holds more chats than it answers at once: MAX_ACTIVE_CHATS
+# defaults to half the threads and the rest wait in the session-fair admission queue. A sync
+# worker takes one request at a time and its queue never fills; connections beyond the
+# threads wait in gunicorn's own first-come queue
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', '16'))
+os.environ.setdefault('MAX_ACTIVE_CHATS', str(max(1, threads // 2)))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+graceful_timeout = 30
+keepalive = 5
+preload_app = os.getenv('GUNICORN_PRELOAD', 'True').lower() == 'true'
+
+
+def on_starting(server):
+    """Drop metric snapshots left behind by a previous run"""
+    metrics_dir = os.getenv('METRICS_DIR')
+    if metrics_dir:
+        for path in glob.glob(os.path.join(metrics_dir, 'metrics-*.json')):
+            os.remove(path)
+
+
+def when_ready(server):
+    """The preloaded app is built; drop its import garbage before the first fork"""
+    gc.collect()
+
+
+def pre_fork(server, worker):
+    """
+    Move everything the master has built into the collector's permanent
+    generation, so collections in the worker never write to (and so never
+    copy) the shared pages
+    """
+    gc.freeze()
+
+
+def post_worker_init(worker):
+    """Warm this worker's upstream connections before it takes its first request"""
+    from app import warm_up
+    warm_up()
@@ -0,0 +1,41 @@
+# Gunicorn settings for the asyncio serving mode:
+#   gunicorn -c gunicorn_async.conf.py asgi_app:app
+# Each uvicorn worker runs one event loop that can hold hundreds of in-flight chats,
+# so far fewer workers are needed than with the default sync workers. As with gunicorn.conf.py
+# the app is imported once in the master and shared copy-on-write; each worker warms its
+# upstream connections on its own event loop (asgi_app's lifespan) before serving.
+import gc
+import glob
+import os
+import tempfile
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+# Workers share metric snapshots so /metrics counts every worker whichever one answers the
+# scrape; one directory per port keeps two deployments on a host apart
+os.environ.setdefault('METRICS_DIR', os.path.join('/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(),
+                                                  f"chatbot-metrics-{os.getenv('PORT', '5000')}"))
+worker_class = 'uvicorn.workers.UvicornWorker'
+workers = int(os.getenv('WEB_CONCURRENCY', '2'))
+# Slow upstream calls no longer block the worker, but streamed answers can take a while
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+graceful_timeout = 30
+keepalive = 5
+preload_app = os.getenv('GUNICORN_PRELOAD', 'True').lower() == 'true'
+
+
+def on_starting(server):
+    """Drop metric snapshots left behind by a previous run"""
+    metrics_dir = os.getenv('METRICS_DIR')
+    if metrics_dir:
+        for path in glob.glob(os.path.join(metrics_dir, 'metrics-*.json')):
+            os.remove(path)
+
+
+def when_ready(server):
+    """The preloaded app is built; drop its import garbage before the first fork"""
+    gc.collect()
+
+
+def pre_fork(server, worker):
+    """Freeze the master's objects so collections in the worker leave the shared pages alone"""
+    gc.freeze()
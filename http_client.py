@@ -0,0 +1,368 @@
+import asyncio
+import logging
+import os
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+try:
+    import httpx
+except ImportError:  # HTTP/2 support is optional
+    httpx = None
+
+
+class _HttpxResponse:
+    """Wrap an httpx response so callers can treat it like a requests response"""
+
+    def __init__(self, response):
+        self._response = response
+        self.status_code = response.status_code
+        self.headers = response.headers
+
+    @property
+    def text(self) -> str:
+        self._response.read()
+        return self._response.text
+
+    def json(self):
+        self._response.read()
+        return self._response.json()
+
+    def iter_lines(self, decode_unicode: bool = True):
+        return self._response.iter_lines()
+
+    def close(self):
+        self._response.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class UpstreamClient:
+    """
+    Pooled keep-alive HTTP client for upstream API calls.
+
+    One instance is kept per worker process so the TCP+TLS handshake to the
+    upstream host is paid once per pooled connection instead of once per chat
+    message.
+    """
+
+    def __init__(self, pool_size: int = 10, connect_timeout: float = 5.0,
+                 read_timeout: float = 30.0, keepalive: bool = True, http2: bool = False):
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.keepalive = keepalive
+        self.http2 = http2 and httpx is not None
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._new_connections = 0
+        # Connections opened by warm() before any chat, not paid on the request path
+        self._warm_connections = 0
+        self._in_flight = 0
+
+        if http2 and httpx is None:
+            logger.warning("UPSTREAM_HTTP2 is enabled but httpx is not installed, using HTTP/1.1")
+
+        if self.http2:
+            self._client = httpx.Client(
+                http2=True,
+                timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+                limits=httpx.Limits(
+                    max_connections=pool_size,
+                    max_keepalive_connections=pool_size if keepalive else 0
+                )
+            )
+        else:
+            self._session = requests.Session()
+            socket_options = list(HTTPConnection.default_socket_options)
+            if keepalive:
+                socket_options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+            else:
+                self._session.headers['Connection'] = 'close'
+            self._adapter = _PoolAdapter(socket_options, self._count_connection, pool_connections=4,
+                                         pool_maxsize=pool_size, max_retries=0)
+            self._session.mount('https://', self._adapter)
+            self._session.mount('http://', self._adapter)
+
+    def post(self, url: str, headers: Optional[Dict] = None, json: Optional[Dict] = None,
+             stream: bool = False, timeout: Optional[Tuple[float, float]] = None):
+        """POST to the upstream, reusing a pooled connection when one is idle"""
+        timeout = timeout or self.timeout
+        with self._lock:
+            self._requests += 1
+            self._in_flight += 1
+        try:
+            if self.http2:
+                return self._post_httpx(url, headers, json, stream, timeout)
+            return self._session.post(url, headers=headers, json=json, stream=stream, timeout=timeout)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def warm(self, url: str, connections: int = 1) -> int:
+        """
+        Open up to `connections` pooled connections to url's host before any chat
+        needs them, with concurrent HEAD requests (any response will do).
+        Returns how many got a response.
+        """
+        target = _origin(url)
+        errors = httpx.HTTPError if self.http2 else requests.exceptions.RequestException
+
+        def head(_):
+            try:
+                if self.http2:
+                    self._client.head(target, timeout=httpx.Timeout(self.timeout[1], connect=self.timeout[0]))
+                else:
+                    self._session.head(target, timeout=self.timeout, allow_redirects=False).close()
+                return True
+            except errors as e:
+                logger.warning(f"Could not warm a connection to {target}: {e}")
+                return False
+
+        connections = min(connections, self.pool_size)
+        if connections <= 0:
+            return 0
+        opened = self._new_connections
+        with ThreadPoolExecutor(max_workers=connections) as pool:
+            warmed = sum(pool.map(head, range(connections)))
+        with self._lock:
+            self._warm_connections += self._new_connections - opened
+        return warmed
+
+    def _count_connection(self):
+        with self._lock:
+            self._new_connections += 1
+
+    def _post_httpx(self, url, headers, json, stream, timeout):
+        def trace(event_name, info):
+            if event_name == 'connection.connect_tcp.complete':
+                self._count_connection()
+
+        request = self._client.build_request(
+            'POST', url, headers=headers, json=json,
+            timeout=httpx.Timeout(timeout[1], connect=timeout[0]),
+            extensions={'trace': trace}
+        )
+        try:
+            response = self._client.send(request, stream=stream)
+        except httpx.TimeoutException as e:
+            raise requests.exceptions.Timeout(str(e)) from e
+        except httpx.HTTPError as e:
+            raise requests.exceptions.ConnectionError(str(e)) from e
+        return _HttpxResponse(response)
+
+    def stats(self) -> Dict:
+        """Connection pool statistics: request count, handshakes and reuse ratio"""
+        if self.http2:
+            pool = getattr(getattr(self._client, '_transport', None), '_pool', None)
+            open_connections = len(getattr(pool, 'connections', []))
+        else:
+            open_connections = 0
+            pools = self._adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools[key]
+                if pool is not None and pool.pool is not None:
+                    open_connections += sum(1 for conn in list(pool.pool.queue)
+                                            if conn is not None and conn.sock is not None)
+
+        requests_made = self._requests
+        new_connections = self._new_connections
+        reuse_ratio = 1 - (new_connections - self._warm_connections) / requests_made if requests_made else 0.0
+        return {
+            'protocol': 'HTTP/2' if self.http2 else 'HTTP/1.1',
+            'pool_size': self.pool_size,
+            'requests': requests_made,
+            'new_connections': new_connections,
+            'warm_connections': self._warm_connections,
+            'reuse_ratio': round(max(reuse_ratio, 0.0), 4),
+            'open_connections': open_connections,
+            'in_flight': self._in_flight
+        }
+
+    def close(self):
+        if self.http2:
+            self._client.close()
+        else:
+            self._session.close()
+
+
+def _origin(url: str) -> str:
+    parts = urlsplit(url)
+    return f'{parts.scheme}://{parts.netloc}/'
+
+
+def _counting_pool(pool_cls, on_connect):
+    """Subclass a urllib3 pool so every new socket connection (handshake) is counted"""
+    class CountingConnection(pool_cls.ConnectionCls):
+        def connect(self):
+            super().connect()
+            on_connect()
+
+    return type(f'Counting{pool_cls.__name__}', (pool_cls,), {'ConnectionCls': CountingConnection})
+
+
+class _PoolAdapter(HTTPAdapter):
+    """HTTPAdapter that applies TCP keep-alive options and counts new connections"""
+
+    def __init__(self, socket_options, on_connect, **kwargs):
+        self._socket_options = socket_options
+        self._on_connect = on_connect
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['socket_options'] = self._socket_options
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _counting_pool(HTTPConnectionPool, self._on_connect),
+            'https': _counting_pool(HTTPSConnectionPool, self._on_connect)
+        }
+
+
+class AsyncUpstreamClient:
+    """
+    Non-blocking counterpart of UpstreamClient for the asyncio serving mode.
+
+    Requires httpx. A single instance multiplexes every in-flight chat of the
+    worker's event loop over one connection pool.
+    """
+
+    def __init__(self, pool_size: int = 10, connect_timeout: float = 5.0,
+                 read_timeout: float = 30.0, keepalive: bool = True, http2: bool = False):
+        if httpx is None:
+            raise RuntimeError("The asyncio serving mode requires httpx (pip install -r requirements-async.txt)")
+        self.pool_size = pool_size
+        self.http2 = http2
+        self.timeout = (connect_timeout, read_timeout)
+        self._requests = 0
+        self._new_connections = 0
+        # Connections opened by warm() before any chat, not paid on the request path
+        self._warm_connections = 0
+        self._in_flight = 0
+        self._client = httpx.AsyncClient(
+            http2=http2,
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(
+                max_connections=pool_size,
+                max_keepalive_connections=pool_size if keepalive else 0
+            )
+        )
+
+    async def _trace(self, event_name, info):
+        if event_name == 'connection.connect_tcp.complete':
+            self._new_connections += 1
+
+    def _build(self, url, headers, json, timeout):
+        kwargs = {'headers': headers, 'json': json, 'extensions': {'trace': self._trace}}
+        if timeout is not None:
+            kwargs['timeout'] = httpx.Timeout(timeout[1], connect=timeout[0])
+        return self._client.build_request('POST', url, **kwargs)
+
+    async def post(self, url: str, headers: Optional[Dict] = None, json: Optional[Dict] = None,
+                   timeout: Optional[Tuple[float, float]] = None):
+        """POST to the upstream without blocking the event loop"""
+        self._requests += 1
+        self._in_flight += 1
+        try:
+            return await self._client.send(self._build(url, headers, json, timeout))
+        finally:
+            self._in_flight -= 1
+
+    async def warm(self, url: str, connections: int = 1) -> int:
+        """Non-blocking UpstreamClient.warm, run on the event loop that will use the connections"""
+        target = _origin(url)
+
+        async def head():
+            try:
+                await self._client.head(target, extensions={'trace': self._trace})
+                return True
+            except httpx.HTTPError as e:
+                logger.warning(f"Could not warm a connection to {target}: {e}")
+                return False
+
+        opened = self._new_connections
+        results = await asyncio.gather(*(head() for _ in range(min(connections, self.pool_size))))
+        self._warm_connections += self._new_connections - opened
+        return sum(results)
+
+    async def stream(self, url: str, headers: Optional[Dict] = None, json: Optional[Dict] = None,
+                     timeout: Optional[Tuple[float, float]] = None):
+        """POST and return a streaming response; the caller must aclose() it"""
+        self._requests += 1
+        return await self._client.send(self._build(url, headers, json, timeout), stream=True)
+
+    def stats(self) -> Dict:
+        pool = getattr(getattr(self._client, '_transport', None), '_pool', None)
+        requests_made = self._requests
+        reuse_ratio = 1 - (self._new_connections - self._warm_connections) / requests_made if requests_made else 0.0
+        return {
+            'protocol': 'HTTP/2' if self.http2 else 'HTTP/1.1',
+            'pool_size': self.pool_size,
+            'requests': requests_made,
+            'new_connections': self._new_connections,
+            'warm_connections': self._warm_connections,
+            'reuse_ratio': round(max(reuse_ratio, 0.0), 4),
+            'open_connections': len(getattr(pool, 'connections', [])),
+            'in_flight': self._in_flight
+        }
+
+    async def aclose(self):
+        await self._client.aclose()
+
+
+_client: Optional[UpstreamClient] = None
+_client_pid: Optional[int] = None
+_client_lock = threading.Lock()
+
+
+def get_upstream_client() -> UpstreamClient:
+    """Return this worker process's upstream client, creating it on first use"""
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is None or _client_pid != pid:
+        with _client_lock:
+            if _client is None or _client_pid != pid:
+                # Never share sockets inherited from a parent process across a fork
+                _client = UpstreamClient(
+                    pool_size=Config.UPSTREAM_POOL_SIZE,
+                    connect_timeout=Config.UPSTREAM_CONNECT_TIMEOUT,
+                    read_timeout=Config.UPSTREAM_READ_TIMEOUT,
+                    keepalive=Config.UPSTREAM_KEEPALIVE,
+                    http2=Config.UPSTREAM_HTTP2
+                )
+                _client_pid = pid
+    return _client
+
+
+_async_client: Optional[AsyncUpstreamClient] = None
+_async_client_loop = None
+
+
+def get_async_upstream_client() -> AsyncUpstreamClient:
+    """Return the upstream client for the running event loop, creating it on first use"""
+    global _async_client, _async_client_loop
+    # httpx connections are bound to the event loop (one per worker process) that opened them
+    loop = asyncio.get_running_loop()
+    if _async_client is None or _async_client_loop is not loop:
+        _async_client = AsyncUpstreamClient(
+            pool_size=Config.ASYNC_UPSTREAM_POOL_SIZE,
+            connect_timeout=Config.UPSTREAM_CONNECT_TIMEOUT,
+            read_timeout=Config.UPSTREAM_READ_TIMEOUT,
+            keepalive=Config.UPSTREAM_KEEPALIVE,
+            http2=Config.UPSTREAM_HTTP2
+        )
+        _async_client_loop = loop
+    return _async_client
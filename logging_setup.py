@@ -0,0 +1,226 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+from datetime import datetime, timezone
+from typing import List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: one process per log file
+    fcntl = None
+
+# Attributes every LogRecord has; anything else was passed through `extra=`
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+def truncate(text: Optional[str], limit: int = 500) -> str:
+    """Shorten a payload (e.g. an upstream error body) before it is put in a log message"""
+    if text is None:
+        return ''
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}... [{len(text) - limit} more chars]"
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, including any fields passed through `extra=`"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'pid': record.process,
+            'message': record.getMessage()
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and key not in entry:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class AccessSampler(logging.Filter):
+    """
+    Keep only a fraction of access-log records. Records at WARNING and above,
+    and access lines for error responses, are always kept.
+    """
+
+    def __init__(self, rate: float, loggers=('chatbot.access', 'werkzeug')):
+        super().__init__()
+        self.rate = rate
+        self.loggers = set(loggers)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.rate >= 1 or record.levelno >= logging.WARNING or record.name not in self.loggers:
+            return True
+        if getattr(record, 'status', 0) >= 400:
+            return True
+        return random.random() < self.rate
+
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to the listener thread. The message is rendered and capped
+    at max_length here; everything else (JSON encoding, disk and stdout
+    writes) happens off the request path. Records are dropped, and counted,
+    rather than blocking when the queue is full.
+    """
+
+    def __init__(self, log_queue: queue.Queue, max_length: int):
+        super().__init__(log_queue)
+        self.max_length = max_length
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = super().prepare(record)
+        if isinstance(record.msg, str) and len(record.msg) > self.max_length:
+            record.msg = truncate(record.msg, self.max_length)
+            record.message = record.msg
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _SharedRotation:
+    """
+    Rotation for a log file that every gunicorn worker appends to. The stdlib
+    handlers assume a single writer: each worker would rename the file under
+    the others, losing lines. Here a worker due to rotate takes an exclusive
+    lock on `<file>.lock` and checks again: if another worker has already
+    rotated, it just reopens the new file. So exactly one process renames the
+    files for each rollover, and the rest follow it to the new file on their
+    next record.
+    """
+
+    def _rotated_elsewhere(self) -> bool:
+        if self.stream is None:
+            return False
+        try:
+            current = os.stat(self.baseFilename)
+        except FileNotFoundError:
+            return True
+        own = os.fstat(self.stream.fileno())
+        return (current.st_dev, current.st_ino) != (own.st_dev, own.st_ino)
+
+    def _reopen(self) -> None:
+        self.stream.close()
+        self.stream = self._open()
+        self._reopened()
+
+    def _reopened(self) -> None:
+        pass
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if self._rotated_elsewhere():
+            self._reopen()
+        return super().shouldRollover(record)
+
+    def doRollover(self) -> None:
+        if fcntl is None:
+            super().doRollover()
+            return
+        with open(f'{self.baseFilename}.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            if self._rotated_elsewhere():
+                self._reopen()
+            else:
+                super().doRollover()
+
+
+class SharedRotatingFileHandler(_SharedRotation, logging.handlers.RotatingFileHandler):
+    """Size-based rotation that is safe with several writing processes"""
+
+
+class SharedTimedRotatingFileHandler(_SharedRotation, logging.handlers.TimedRotatingFileHandler):
+    """Time-based rotation that is safe with several writing processes"""
+
+    def _reopened(self) -> None:
+        self.rolloverAt = self.computeRollover(int(time.time()))
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_handlers: List[logging.Handler] = []
+_queue_handler: Optional[BoundedQueueHandler] = None
+
+
+def _start_listener() -> None:
+    global _listener
+    _listener = logging.handlers.QueueListener(_queue_handler.queue, *_handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def _stop_listener() -> None:
+    if _listener is not None and _listener._thread is not None:
+        _listener.stop()
+
+
+def setup_logging(level: str = 'INFO', log_file: str = 'chatbot.log', fmt: str = 'json',
+                  max_bytes: int = 10 * 1024 * 1024, backup_count: int = 5, rotate_when: str = '',
+                  max_length: int = 2000, access_sample_rate: float = 1.0, queue_size: int = 10000) -> None:
+    """
+    Route all logging through a bounded queue to a background listener that
+    writes to a rotating log file and stderr. Rotation is by size unless
+    rotate_when (e.g. 'midnight') selects time-based rotation; workers sharing
+    the file take turns to rotate it.
+    """
+    global _queue_handler
+    formatter = JsonFormatter() if fmt == 'json' else logging.Formatter(TEXT_FORMAT)
+
+    _handlers.clear()
+    if log_file:
+        if rotate_when:
+            file_handler = SharedTimedRotatingFileHandler(log_file, when=rotate_when, backupCount=backup_count,
+                                                          encoding='utf-8')
+        else:
+            file_handler = SharedRotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count,
+                                                     encoding='utf-8')
+        _handlers.append(file_handler)
+    _handlers.append(logging.StreamHandler(sys.stderr))
+    for handler in _handlers:
+        handler.setFormatter(formatter)
+
+    _stop_listener()
+    _queue_handler = BoundedQueueHandler(queue.Queue(queue_size), max_length)
+    _queue_handler.addFilter(AccessSampler(access_sample_rate))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_queue_handler)
+    root.setLevel(level)
+
+    _start_listener()
+
+
+def logging_stats() -> dict:
+    return {
+        'queued': _queue_handler.queue.qsize() if _queue_handler else 0,
+        'dropped': _queue_handler.dropped if _queue_handler else 0
+    }
+
+
+def _restart_after_fork() -> None:
+    # The listener thread does not survive fork(); give each worker its own
+    if _queue_handler is not None:
+        _queue_handler.queue = queue.Queue(_queue_handler.queue.maxsize)
+        _start_listener()
+
+
+atexit.register(_stop_listener)
+os.register_at_fork(after_in_child=_restart_after_fork)
@@ -0,0 +1,237 @@
+import atexit
+import bisect
+import glob
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (128, 256, 512, 1024, 2048, 4096, 8192, 16384, 65536)
+
+# name -> (type, help, buckets)
+METRICS = {
+    'chatbot_stage_duration_seconds': ('histogram', 'Time spent in each stage of handling a chat', LATENCY_BUCKETS),
+    'chatbot_http_requests_total': ('counter', 'HTTP requests by endpoint and status code', None),
+    'chatbot_upstream_requests_total': ('counter', 'LLM provider requests by provider and response status', None),
+    'chatbot_upstream_retries_total': ('counter', 'LLM provider requests retried after a failure, by provider', None),
+    'chatbot_provider_latency_seconds': ('histogram', 'Time to a complete answer or a first streamed chunk, by provider and kind', LATENCY_BUCKETS),
+    'chatbot_hedged_requests_total': ('counter', 'Calls that sent a hedged duplicate, by which request answered first', None),
+    'chatbot_provider_failovers_total': ('counter', 'Calls moved on to the next provider, by the provider that failed', None),
+    'chatbot_admission_rejections_total': ('counter', 'Chat requests turned away before any work was done, by reason', None),
+    'chatbot_deadline_exceeded_total': ('counter', 'LLM calls that ran out of their request deadline, by kind', None),
+    'chatbot_cancelled_calls_total': ('counter', 'LLM calls cancelled before answering, by reason (disconnect, clear)', None),
+    'chatbot_upstream_saved_total': ('counter', 'Provider requests skipped or closed early for a deadline or cancellation, by provider, reason and stage', None),
+    'chatbot_saved_prompt_tokens_total': ('counter', 'Estimated prompt tokens of provider requests skipped for a deadline or cancellation', None),
+    'chatbot_cache_lookups_total': ('counter', 'Standalone questions found in the exact cache, as a similar question, or missed', None),
+    'chatbot_fallbacks_total': ('counter', 'Answers not generated by an LLM provider, by source', None),
+    'chatbot_response_bytes': ('histogram', 'Size of generated answers (UTF-8 bytes) by language', SIZE_BUCKETS),
+    'chatbot_chat_body_bytes_total': ('counter', '/chat JSON bytes by language, before compression', None),
+    'chatbot_chat_wire_bytes_total': ('counter', '/chat JSON bytes sent, by language and content encoding', None),
+    'chatbot_circuit_breaker_state': ('gauge', "Each worker's circuit breaker per provider: 0 closed, 1 half-open, 2 open", None),
+    'chatbot_rate_limiter_rate': ('gauge', "Requests per second each worker's limiter allows a provider (host-wide with shared state)", None),
+}
+
+LabelKey = Tuple[Tuple[str, str], ...]
+# Called when a snapshot is taken: (name, labels, value) of each gauge to report
+GaugeSource = Callable[[], Iterable[Tuple[str, Dict[str, str], float]]]
+
+
+def _label_key(labels: Optional[Dict[str, str]]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items())) if labels else ()
+
+
+def _format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+    labels = list(labels)
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in labels) + '}'
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class StageTimer:
+    """Context manager that records its elapsed time as one stage observation"""
+
+    __slots__ = ('metrics', 'stage', 'started')
+
+    def __init__(self, metrics: 'Metrics', stage: str):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe('chatbot_stage_duration_seconds', time.perf_counter() - self.started,
+                             {'stage': self.stage})
+        return False
+
+
+class Metrics:
+    """
+    In-process counters and histograms rendered in the Prometheus text format.
+
+    With a directory configured, each worker writes a snapshot to
+    `<directory>/metrics-<pid>.json` from a background thread (at most every
+    flush_interval, only when something changed) and `/metrics` merges every
+    snapshot, so any worker can answer a scrape for the whole deployment.
+    Snapshots of exited workers are kept so counters never go backwards;
+    clear the directory when the server is (re)started. Gauges describe a
+    worker's current state, so they are labelled with its pid and only live
+    workers' gauges are rendered.
+    """
+
+    def __init__(self, directory: str = '', flush_interval: float = 1.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._counters: Dict[Tuple[str, LabelKey], float] = {}
+        self._histograms: Dict[Tuple[str, LabelKey], List] = {}  # [bucket counts..., +Inf count, sum]
+        self._gauge_sources: List[GaugeSource] = []
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._flusher_pid = None
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            atexit.register(self.flush)
+
+    def inc(self, name: str, labels: Optional[Dict[str, str]] = None, value: float = 1) -> None:
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, labels: Optional[Dict[str, str]] = None) -> None:
+        buckets = METRICS[name][2]
+        key = (name, _label_key(labels))
+        with self._lock:
+            series = self._histograms.get(key)
+            if series is None:
+                series = self._histograms[key] = [0] * (len(buckets) + 1) + [0.0]
+            # Non-cumulative counts; the +Inf slot catches values above the last bucket
+            series[bisect.bisect_left(buckets, value)] += 1
+            series[-1] += value
+
+    def timer(self, stage: str) -> StageTimer:
+        return StageTimer(self, stage)
+
+    def add_gauges(self, source: GaugeSource) -> None:
+        """Report the gauges `source` returns in every snapshot"""
+        self._gauge_sources.append(source)
+
+    def snapshot(self) -> Dict:
+        worker = str(os.getpid())
+        gauges = [[name, list(_label_key({**labels, 'worker': worker})), value]
+                  for source in self._gauge_sources for name, labels, value in source()]
+        with self._lock:
+            return {
+                'counters': [[name, list(labels), value] for (name, labels), value in self._counters.items()],
+                'histograms': [[name, list(labels), list(series)] for (name, labels), series in self._histograms.items()],
+                'gauges': gauges
+            }
+
+    def maybe_flush(self) -> None:
+        """Schedule a snapshot of this worker's metrics; called at the end of each request"""
+        if not self.directory:
+            return
+        self._dirty = True
+        if self._flusher_pid != os.getpid():
+            # First request in this (possibly forked) worker
+            self._flusher_pid = os.getpid()
+            threading.Thread(target=self._flush_loop, daemon=True).start()
+
+    def _flush_loop(self) -> None:
+        while True:
+            time.sleep(self.flush_interval)
+            if self._dirty:
+                self.flush()
+
+    def flush(self) -> None:
+        if not self.directory:
+            return
+        self._dirty = False
+        path = os.path.join(self.directory, f'metrics-{os.getpid()}.json')
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(self.snapshot(), f)
+            os.replace(tmp_path, path)
+        except OSError:
+            pass
+
+    def _collect(self) -> Tuple[Dict, Dict, Dict, int]:
+        """Merge the snapshots of every worker (just this process without a directory)"""
+        if not self.directory:
+            snapshots = [self.snapshot()]
+        else:
+            self.flush()
+            snapshots = []
+            for path in glob.glob(os.path.join(self.directory, 'metrics-*.json')):
+                try:
+                    with open(path) as f:
+                        snapshot = json.load(f)
+                except (OSError, ValueError):
+                    continue
+                if not _alive(int(os.path.basename(path)[len('metrics-'):-len('.json')])):
+                    snapshot.pop('gauges', None)
+                snapshots.append(snapshot)
+
+        counters: Dict[Tuple[str, LabelKey], float] = {}
+        histograms: Dict[Tuple[str, LabelKey], List] = {}
+        gauges: Dict[Tuple[str, LabelKey], float] = {}
+        for snapshot in snapshots:
+            for name, labels, value in snapshot.get('gauges', []):
+                gauges[(name, tuple(tuple(label) for label in labels))] = value
+            for name, labels, value in snapshot.get('counters', []):
+                key = (name, tuple(tuple(label) for label in labels))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, series in snapshot.get('histograms', []):
+                key = (name, tuple(tuple(label) for label in labels))
+                merged = histograms.get(key)
+                if merged is None:
+                    histograms[key] = list(series)
+                else:
+                    histograms[key] = [a + b for a, b in zip(merged, series)]
+        return counters, histograms, gauges, len(snapshots)
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        counters, histograms, gauges, workers = self._collect()
+        lines = [
+            '# HELP chatbot_metrics_workers Worker snapshots included in this scrape',
+            '# TYPE chatbot_metrics_workers gauge',
+            f'chatbot_metrics_workers {workers}'
+        ]
+        for name, (kind, help_text, buckets) in METRICS.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            if kind in ('counter', 'gauge'):
+                for (series_name, labels), value in sorted((counters if kind == 'counter' else gauges).items()):
+                    if series_name == name:
+                        lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+                continue
+            for (series_name, labels), series in sorted(histograms.items()):
+                if series_name != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets, series):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{_format_labels(labels + (("le", repr(float(bound))),))} {cumulative}')
+                cumulative += series[len(buckets)]
+                lines.append(f'{name}_bucket{_format_labels(labels + (("le", "+Inf"),))} {cumulative}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(series[-1])}')
+                lines.append(f'{name}_count{_format_labels(labels)} {cumulative}')
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,413 @@
+"""
+Offline answer engine: BM25 retrieval over the multilingual knowledge base.
+
+knowledge_base/<topic>.json holds short explanations, each written in every
+supported language. They are compiled into a single binary index whose
+postings carry precomputed BM25 weights, so a query is a few dictionary
+lookups and additions. The index is memory-mapped, which keeps its pages
+shared between worker processes. It is rebuilt automatically whenever it
+is missing or older than the knowledge base.
+
+    python offline_answers.py build
+    python offline_answers.py query "what is photosynthesis" --topic science
+"""
+import argparse
+import hashlib
+import heapq
+import json
+import logging
+import math
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+from collections import Counter, deque
+from typing import Dict, List, Optional, Tuple
+
+from config import Config
+from similarity_index import content_words
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'KBBM25\x00\x00'
+VERSION = 1
+# Magic, version, document count, then (offset, length) of the metadata,
+# terms, document id, weight and text sections. Everything is little-endian.
+_HEADER = struct.Struct('<8sII10Q')
+_SECTIONS = ('meta', 'terms', 'doc_ids', 'weights', 'texts')
+
+# Words at least this long also index their prefix, which stands in for a
+# stemmer: "newton"/"newtons" and Tamil/Telugu words with case suffixes meet on it
+PREFIX_LENGTH = 6
+# Title and keyword words count as this many occurrences in the text
+TITLE_WEIGHT = 3
+KEYWORD_WEIGHT = 2
+# Score multiplier for explanations in the topic the classifier picked
+TOPIC_BOOST = 1.25
+
+NO_MATCH_MESSAGES = {
+    'english': ("I can't reach my online teacher right now, and I don't have an offline explanation "
+                "for that question yet. Offline, I can explain: {titles}. Please ask again in a little while "
+                "for anything else."),
+    'hindi': ("अभी मैं ऑनलाइन शिक्षक से नहीं जुड़ पा रहा हूं, और इस प्रश्न की ऑफ़लाइन व्याख्या मेरे पास अभी नहीं है। "
+              "ऑफ़लाइन मैं ये विषय समझा सकता हूं: {titles}। बाकी प्रश्नों के लिए कृपया थोड़ी देर बाद फिर पूछें।"),
+    'telugu': ("ప్రస్తుతం నేను ఆన్‌లైన్ ఉపాధ్యాయుడిని చేరుకోలేకపోతున్నాను, ఈ ప్రశ్నకు ఆఫ్‌లైన్ వివరణ ఇంకా నా దగ్గర లేదు. "
+               "ఆఫ్‌లైన్‌లో నేను ఈ అంశాలను వివరించగలను: {titles}. ఇతర ప్రశ్నల కోసం దయచేసి కొద్దిసేపటి తర్వాత మళ్లీ అడగండి."),
+    'tamil': ("இப்போது இணைய ஆசிரியரை அணுக முடியவில்லை, இந்தக் கேள்விக்கான இணைப்பில்லா விளக்கம் இன்னும் என்னிடம் இல்லை. "
+              "இணைப்பில்லாமல் நான் இவற்றை விளக்க முடியும்: {titles}. மற்ற கேள்விகளுக்குச் சிறிது நேரம் கழித்து மீண்டும் கேளுங்கள்.")
+}
+
+
+def index_terms(text: str) -> List[str]:
+    """BM25 terms of a text: its content words, plus a prefix term for each long word"""
+    terms = []
+    for word in content_words(text):
+        if len(word) < 2 and not word.isdigit():
+            # Stray letters such as the "s" of "newton's"
+            continue
+        terms.append(word)
+        if len(word) >= PREFIX_LENGTH and not word.isdigit():
+            terms.append(word[:PREFIX_LENGTH] + '~')
+    return terms
+
+
+def _source_files(kb_dir: str) -> List[str]:
+    try:
+        names = sorted(name for name in os.listdir(kb_dir) if name.endswith('.json'))
+    except FileNotFoundError:
+        return []
+    return [os.path.join(kb_dir, name) for name in names]
+
+
+def knowledge_base_fingerprint(kb_dir: str) -> str:
+    """Digest of the knowledge base files; the index records the one it was built from"""
+    digest = hashlib.sha1()
+    for path in _source_files(kb_dir):
+        digest.update(os.path.basename(path).encode('utf-8') + b'\0')
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def load_knowledge_base(kb_dir: str) -> List[Dict]:
+    """One document per (entry, language) from every knowledge_base/<topic>.json file"""
+    documents = []
+    for path in _source_files(kb_dir):
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        topic = data.get('topic') or os.path.basename(path)[:-len('.json')]
+        for entry in data.get('entries', []):
+            for language in Config.SUPPORTED_LANGUAGES:
+                doc = entry.get(language)
+                if not doc or not doc.get('text'):
+                    continue
+                documents.append({
+                    'id': entry['id'],
+                    'topic': topic,
+                    'language': language,
+                    'title': doc.get('title', entry['id']),
+                    'text': doc['text'],
+                    'keywords': doc.get('keywords', [])
+                })
+    return documents
+
+
+def _pad(data: bytes) -> bytes:
+    # Keep every section 4-byte aligned so the arrays can be viewed in place
+    return data + b'\0' * (-len(data) % 4)
+
+
+def build_index(kb_dir: str, k1: float = 1.2, b: float = 0.75) -> bytes:
+    """Compile the knowledge base into the binary index format"""
+    documents = load_knowledge_base(kb_dir)
+
+    # Term frequencies with title and keyword words weighted up
+    frequencies = []
+    for doc in documents:
+        tf = Counter(index_terms(doc['text']))
+        for _ in range(TITLE_WEIGHT):
+            tf.update(index_terms(doc['title']))
+        for _ in range(KEYWORD_WEIGHT):
+            tf.update(index_terms(' '.join(doc['keywords'])))
+        frequencies.append(tf)
+
+    # Each language is its own collection for document counts and lengths
+    lengths: Dict[str, List[int]] = {}
+    document_frequency: Dict[str, Counter] = {}
+    for doc, tf in zip(documents, frequencies):
+        lengths.setdefault(doc['language'], []).append(sum(tf.values()))
+        document_frequency.setdefault(doc['language'], Counter()).update(tf.keys())
+    average_length = {language: sum(values) / len(values) for language, values in lengths.items()}
+
+    postings: Dict[Tuple[str, str], List[Tuple[int, float]]] = {}
+    for doc_index, (doc, tf) in enumerate(zip(documents, frequencies)):
+        language = doc['language']
+        count = len(lengths[language])
+        norm = k1 * (1 - b + b * sum(tf.values()) / average_length[language])
+        for term, freq in tf.items():
+            df = document_frequency[language][term]
+            idf = math.log(1 + (count - df + 0.5) / (df + 0.5))
+            postings.setdefault((language, term), []).append((doc_index, idf * freq * (k1 + 1) / (freq + norm)))
+
+    # language -> [terms, start of each term's postings plus the end of the last]
+    doc_ids = array('I')
+    weights = array('f')
+    terms: Dict[str, List[List]] = {}
+    for language, term in sorted(postings):
+        language_terms = terms.setdefault(language, [[], []])
+        language_terms[0].append(term)
+        language_terms[1].append(len(doc_ids))
+        for doc_index, weight in postings[language, term]:
+            doc_ids.append(doc_index)
+            weights.append(weight)
+        language_terms[1][len(language_terms[0]):] = [len(doc_ids)]
+    if sys.byteorder != 'little':
+        doc_ids.byteswap()
+        weights.byteswap()
+
+    texts = bytearray()
+    meta_docs = []
+    for doc in documents:
+        encoded = doc['text'].encode('utf-8')
+        meta_docs.append([doc['id'], doc['topic'], doc['language'], doc['title'], len(texts), len(encoded)])
+        texts += encoded
+
+    meta = {'fingerprint': knowledge_base_fingerprint(kb_dir), 'k1': k1, 'b': b, 'docs': meta_docs}
+    sections = [
+        _pad(json.dumps(meta, ensure_ascii=False).encode('utf-8')),
+        _pad(json.dumps(terms, ensure_ascii=False).encode('utf-8')),
+        doc_ids.tobytes(),
+        weights.tobytes(),
+        bytes(texts)
+    ]
+    layout = []
+    offset = _HEADER.size
+    for section in sections:
+        layout += [offset, len(section)]
+        offset += len(section)
+    return _HEADER.pack(MAGIC, VERSION, len(documents), *layout) + b''.join(sections)
+
+
+def write_index(kb_dir: str, path: str) -> int:
+    """Build the index and write it to `path` atomically; returns its size in bytes"""
+    data = build_index(kb_dir)
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return len(data)
+
+
+class OfflineAnswerEngine:
+    """
+    Answers questions from the knowledge base without any network access.
+
+    The postings and texts are read straight out of the memory-mapped index;
+    only the term dictionary and document metadata are decoded into Python
+    objects. A query scores every document sharing a term with it, boosts the
+    classifier's topic, and returns the best explanation in the question's
+    language when it scores at least `min_score`.
+    """
+
+    def __init__(self, kb_dir: str, index_path: str = '', min_score: float = 3.0):
+        self.kb_dir = kb_dir
+        self.index_path = index_path or None
+        self.min_score = min_score
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=1024)
+        self._counters = {'queries': 0, 'answered': 0, 'unanswered': 0}
+        self._buffer = None
+        self._docs: List[Tuple[str, str, str, str, int, int]] = []
+        self._terms: Dict[str, Dict[str, Tuple[int, int]]] = {}
+        self._titles: Dict[str, List[str]] = {}
+        self.index_bytes = 0
+        self.load_ms = 0.0
+        self.rebuilt = False
+        self.load()
+
+    def load(self) -> None:
+        """Map the index, rebuilding it first if it is missing or stale"""
+        started = time.perf_counter()
+        fingerprint = knowledge_base_fingerprint(self.kb_dir)
+        buffer = self._map_index(fingerprint) if self.index_path else None
+        self.rebuilt = buffer is None
+        if buffer is None:
+            buffer = self._rebuild()
+        self._open(buffer)
+        self.load_ms = (time.perf_counter() - started) * 1000
+        if not self._docs:
+            logger.warning(f"No offline explanations found in {self.kb_dir}")
+        else:
+            logger.info(f"Loaded {len(self._docs)} offline explanations ({self.index_bytes} byte index"
+                        f"{', rebuilt' if self.rebuilt else ''}) in {self.load_ms:.1f}ms")
+
+    def _map_index(self, fingerprint: str):
+        try:
+            with open(self.index_path, 'rb') as f:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            # Missing, unreadable, or empty (mmap refuses zero-length files)
+            return None
+        try:
+            header = _HEADER.unpack_from(buffer)
+            if header[0] != MAGIC or header[1] != VERSION:
+                return None
+            offset, length = header[3], header[4]
+            meta = json.loads(bytes(buffer[offset:offset + length]).rstrip(b'\0'))
+        except (struct.error, ValueError):
+            return None
+        return buffer if meta.get('fingerprint') == fingerprint else None
+
+    def _rebuild(self):
+        if not self.index_path:
+            return build_index(self.kb_dir)
+        try:
+            write_index(self.kb_dir, self.index_path)
+            with open(self.index_path, 'rb') as f:
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except OSError as e:
+            logger.error(f"Could not write offline index to {self.index_path}, keeping it in memory: {e}")
+            return build_index(self.kb_dir)
+
+    def _open(self, buffer) -> None:
+        header = _HEADER.unpack_from(buffer)
+        sections = {name: (header[3 + 2 * i], header[4 + 2 * i]) for i, name in enumerate(_SECTIONS)}
+
+        def section(name):
+            offset, length = sections[name]
+            return memoryview(buffer)[offset:offset + length]
+
+        meta = json.loads(bytes(section('meta')).rstrip(b'\0'))
+        terms = json.loads(bytes(section('terms')).rstrip(b'\0'))
+        doc_ids, weights = section('doc_ids'), section('weights')
+        if sys.byteorder == 'little':
+            doc_ids, weights = doc_ids.cast('I'), weights.cast('f')
+        else:
+            doc_ids, weights = array('I', doc_ids), array('f', weights)
+            doc_ids.byteswap()
+            weights.byteswap()
+
+        titles: Dict[str, List[str]] = {}
+        for _, _, language, title, _, _ in meta['docs']:
+            titles.setdefault(language, []).append(title)
+
+        self._buffer = buffer
+        self._docs = [tuple(doc) for doc in meta['docs']]
+        # language -> term -> (start, end) of its postings
+        self._terms = {
+            language: {term: (starts[i], starts[i + 1]) for i, term in enumerate(words)}
+            for language, (words, starts) in terms.items()
+        }
+        self._doc_ids = doc_ids
+        self._weights = weights
+        self._texts = section('texts')
+        self._titles = titles
+        self.index_bytes = len(buffer)
+
+    def text(self, doc_index: int) -> str:
+        _, _, _, _, offset, length = self._docs[doc_index]
+        return str(self._texts[offset:offset + length], 'utf-8')
+
+    def _score(self, query: str, language: str, topic: Optional[str]) -> Dict[int, float]:
+        scores: Dict[int, float] = {}
+        doc_ids, weights = self._doc_ids, self._weights
+        terms = self._terms.get(language, {})
+        for term in set(index_terms(query)):
+            span = terms.get(term)
+            if span is None:
+                continue
+            start, end = span
+            for doc_index, weight in zip(doc_ids[start:end], weights[start:end]):
+                scores[doc_index] = scores.get(doc_index, 0.0) + weight
+        if topic and topic != 'general':
+            for doc_index in scores:
+                if self._docs[doc_index][1] == topic:
+                    scores[doc_index] *= TOPIC_BOOST
+        return scores
+
+    def search(self, query: str, language: str, topic: Optional[str] = None, k: int = 3) -> List[Dict]:
+        """The `k` best explanations in `language`, best first"""
+        scores = self._score(query, language, topic)
+        results = []
+        for doc_index, score in heapq.nlargest(k, scores.items(), key=lambda item: item[1]):
+            doc_id, doc_topic, _, title, _, _ = self._docs[doc_index]
+            results.append({'id': doc_id, 'topic': doc_topic, 'title': title,
+                            'score': round(score, 4), 'text': self.text(doc_index)})
+        return results
+
+    def answer(self, query: str, language: str, topic: Optional[str] = None) -> str:
+        """Best explanation for the query, or a message listing what can be explained offline"""
+        started = time.perf_counter()
+        if language not in self._titles:
+            language = Config.DEFAULT_LANGUAGE
+        scores = self._score(query, language, topic)
+        best = max(scores.items(), key=lambda item: item[1], default=None)
+        answered = best is not None and best[1] >= self.min_score
+        if answered:
+            text = self.text(best[0])
+        else:
+            text = NO_MATCH_MESSAGES.get(language, NO_MATCH_MESSAGES['english']).format(
+                titles=', '.join(self._titles.get(language, [])) or '-')
+        with self._lock:
+            self._counters['queries'] += 1
+            self._counters['answered' if answered else 'unanswered'] += 1
+            self._latencies.append(time.perf_counter() - started)
+        return text
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._counters)
+            latencies = sorted(self._latencies)
+        stats['answer_ratio'] = round(stats['answered'] / stats['queries'], 4) if stats['queries'] else 0.0
+        if latencies:
+            stats['query_ms_p50'] = round(latencies[len(latencies) // 2] * 1000, 3)
+            stats['query_ms_p99'] = round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 3)
+        stats['documents'] = len(self._docs)
+        stats['terms'] = sum(len(terms) for terms in self._terms.values())
+        stats['index_bytes'] = self.index_bytes
+        stats['load_ms'] = round(self.load_ms, 3)
+        stats['memory_mapped'] = isinstance(self._buffer, mmap.mmap)
+        stats['min_score'] = self.min_score
+        return stats
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Build or query the offline answer index")
+    parser.add_argument('--kb', default=Config.KNOWLEDGE_BASE_DIR, help="knowledge base directory")
+    parser.add_argument('--index', default=Config.KNOWLEDGE_INDEX_FILE, help="index file")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('build', help="compile the knowledge base into the index file")
+    query = commands.add_parser('query', help="show the best matches for a question")
+    query.add_argument('question')
+    query.add_argument('--language', help="default: detected from the question")
+    query.add_argument('--topic', help="default: detected from the question")
+    query.add_argument('-k', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        started = time.perf_counter()
+        size = write_index(args.kb, args.index)
+        print(f"Wrote {args.index}: {len(load_knowledge_base(args.kb))} documents, {size} bytes "
+              f"in {(time.perf_counter() - started) * 1000:.1f}ms")
+        return 0
+
+    from classifier import classifier
+    language = args.language or classifier.detect_language(args.question)
+    topic = args.topic or classifier.detect_topic(args.question, language)
+    engine = OfflineAnswerEngine(args.kb, args.index)
+    started = time.perf_counter()
+    results = engine.search(args.question, language, topic, args.k)
+    elapsed = (time.perf_counter() - started) * 1000
+    print(f"language={language} topic={topic} ({elapsed:.3f}ms)")
+    for result in results:
+        print(f"{result['score']:8.3f}  {result['topic']}/{result['id']}  {result['title']}")
+    if not results:
+        print("no matches")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
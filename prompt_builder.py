@@ -0,0 +1,149 @@
+import json
+import math
+import re
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+# Gemini calls the assistant role 'model'
+_GEMINI_ROLES = {'user': 'user', 'assistant': 'model'}
+_SENTENCE_END = re.compile(r'(?<=[.!?।])\s')
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Rough token estimate without a tokenizer: ~4 characters per token for
+    ASCII text and ~2 per token for Indic scripts.
+    """
+    if text.isascii():
+        return math.ceil(len(text) / 4)
+    ascii_chars = len(text.encode('ascii', 'ignore'))
+    return math.ceil(ascii_chars / 4 + (len(text) - ascii_chars) / 2)
+
+
+def _clip(text: str, limit: int) -> str:
+    text = ' '.join(text.split())
+    return text if len(text) <= limit else text[:limit - 1].rstrip() + '…'
+
+
+class ConversationContext(NamedTuple):
+    """A session's stored turns plus the running summary of turns folded out of the prompt"""
+    messages: List[Dict]  # {'role', 'content', 'seq'}, oldest first
+    summary: str = ''
+    summary_upto: int = -1  # seq of the newest message already folded into the summary
+
+
+class ChatRequest(NamedTuple):
+    """A provider-neutral prompt: system text plus turns ({'role': 'user'|'assistant', 'content'}), oldest first"""
+    system: str
+    messages: List[Dict[str, str]]
+
+
+def gemini_payload(request: ChatRequest) -> Dict:
+    """The generateContent body for a request, with the system prompt sent through `systemInstruction`"""
+    return {
+        'systemInstruction': {'parts': [{'text': request.system}]},
+        'contents': [{'role': _GEMINI_ROLES.get(m['role'], 'user'), 'parts': [{'text': m['content']}]}
+                     for m in request.messages]
+    }
+
+
+class AssembledPrompt(NamedTuple):
+    request: ChatRequest
+    prompt_bytes: int
+    estimated_tokens: int
+    history_messages: int
+    has_summary: bool
+
+    @property
+    def standalone(self) -> bool:
+        """True when the answer depends on nothing but the current message"""
+        return self.history_messages == 0 and not self.has_summary
+
+
+class PromptAssembler:
+    """
+    Builds prompts that fit a token budget.
+
+    The per-topic system prompts are rendered once up front and sent as the
+    request's system text. The most recent turns that fit the budget are sent
+    verbatim. Older turns are folded into a running extractive summary that is
+    only ever appended to, never recomputed from the full history. The
+    conversation store folds the turns it evicts with the same fold(), so a
+    turn that leaves the stored history before it leaves the window is not lost.
+    """
+
+    def __init__(self, system_prompt: Callable[[Dict], str], topics: Iterable[str],
+                 token_budget: int = 2000, summary_tokens: int = 300):
+        self.token_budget = token_budget
+        self.summary_tokens = summary_tokens
+        self._system_prompts = {}
+        for topic in list(topics) + ['general']:
+            text = system_prompt({'topic': topic})
+            self._system_prompts[topic] = (text, estimate_tokens(text))
+
+    def system_prompt(self, topic: str) -> Tuple[str, int]:
+        return self._system_prompts.get(topic) or self._system_prompts['general']
+
+    def assemble(self, user_message: str, context: Dict[str, str],
+                 conversation: Optional[ConversationContext] = None) -> Tuple[AssembledPrompt, Optional[Tuple[str, int]]]:
+        """
+        Build the prompt for user_message. Returns the prompt and, when turns
+        were newly folded, the updated (summary, summary_upto) to persist once
+        the prompt has been sent.
+        """
+        conversation = conversation or ConversationContext([])
+        system_text, system_tokens = self.system_prompt(context.get('topic', 'general'))
+        user_text = f"{user_message}\n\nPlease respond in {context['language']} language."
+
+        remaining = self.token_budget - system_tokens - estimate_tokens(user_text)
+        if conversation.summary:
+            remaining -= estimate_tokens(conversation.summary)
+
+        # Newest turns first until the budget runs out
+        window: List[Dict] = []
+        for message in reversed(conversation.messages):
+            if message['seq'] <= conversation.summary_upto:
+                break
+            cost = estimate_tokens(message['content'])
+            if cost > remaining:
+                break
+            remaining -= cost
+            window.append(message)
+        window.reverse()
+        # Gemini expects the conversation to open with a user turn
+        while window and window[0]['role'] != 'user':
+            window.pop(0)
+
+        window_start = window[0]['seq'] if window else math.inf
+        folded = [m for m in conversation.messages
+                  if conversation.summary_upto < m['seq'] < window_start]
+        summary_update = None
+        summary = conversation.summary
+        if folded:
+            summary = self.fold(summary, folded)
+            summary_update = (summary, folded[-1]['seq'])
+
+        if summary:
+            system_text = f"{system_text}\n\nSummary of the earlier conversation:\n{summary}"
+
+        messages = [{'role': m['role'], 'content': m['content']} for m in window]
+        messages.append({'role': 'user', 'content': user_text})
+        request = ChatRequest(system_text, messages)
+
+        # Measured as a Gemini body; the OpenAI format differs only in its wrapping keys
+        prompt_bytes = len(json.dumps(gemini_payload(request), ensure_ascii=False).encode('utf-8'))
+        estimated = estimate_tokens(system_text) + sum(estimate_tokens(m['content']) for m in messages)
+        prompt = AssembledPrompt(request, prompt_bytes, estimated, len(window), bool(summary))
+        return prompt, summary_update
+
+    def fold(self, summary: str, messages: List[Dict]) -> str:
+        """Append one line per folded turn, dropping the oldest lines past summary_tokens"""
+        lines = summary.split('\n') if summary else []
+        for message in messages:
+            if message['role'] == 'user':
+                lines.append(f"Student asked: {_clip(message['content'], 120)}")
+            else:
+                first_sentence = _SENTENCE_END.split(message['content'].strip(), 1)[0]
+                lines.append(f"Teacher explained: {_clip(first_sentence, 160)}")
+        while len(lines) > 1 and estimate_tokens('\n'.join(lines)) > self.summary_tokens:
+            lines.pop(0)
+        return '\n'.join(lines)
@@ -0,0 +1,1007 @@
+"""
+LLM providers behind one interface, with latency-aware routing and hedged requests.
+
+Each provider only knows how to turn a ChatRequest into its HTTP request and
+how to read the answer back. The router does the rest: every provider has
+its own rate limiter and circuit breaker plus a rolling window of latencies
+and outcomes, and each call goes to the healthy provider expected to answer
+fastest. If that provider has not answered (or, when streaming, sent its
+first chunk) within its observed p95, a hedged duplicate goes to the next
+provider and whichever answers first wins. The loser is cancelled: asyncio
+tasks are cancelled outright, and a sync stream stops at its next chunk. A
+blocking complete request cannot be stopped before its answer arrives, so the
+sync path does not hedge complete calls. A provider that gives up
+hands the call to the next one. A call with a deadline is fitted into it and
+stops early, cancelling what is in flight, when it expires or is cancelled.
+"""
+import asyncio
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import AsyncIterator, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import requests
+
+from config import Config
+from http_client import get_async_upstream_client, get_upstream_client
+from logging_setup import truncate
+from metrics import Metrics
+from prompt_builder import ChatRequest, estimate_tokens, gemini_payload
+from resilience import AdaptiveRateLimiter, CircuitBreaker, Deadline, UpstreamGuard
+from shared_state import SharedState
+
+try:
+    import httpx
+except ImportError:  # only the asyncio serving mode needs it
+    httpx = None
+
+logger = logging.getLogger(__name__)
+
+# Latency windows: time to a complete answer, and time to the first chunk of a stream
+KINDS = ('complete', 'stream')
+# chatbot_circuit_breaker_state values
+BREAKER_STATES = {CircuitBreaker.CLOSED: 0, CircuitBreaker.HALF_OPEN: 1, CircuitBreaker.OPEN: 2}
+
+
+class ProviderError(Exception):
+    """A provider gave up on a call, or its stream broke off after sending text"""
+
+
+class DeadlineExceeded(ProviderError):
+    """A provider gave up on a call because its next request could not finish before the deadline"""
+
+
+def _sse_data(buffer: List[str]) -> Optional[Dict]:
+    data = '\n'.join(buffer)
+    # OpenAI ends its streams with a literal [DONE]
+    return None if data == '[DONE]' else json.loads(data)
+
+
+def iter_sse_data(lines: Iterable[str]) -> Iterator[Dict]:
+    """Parse the `data:` payloads of a Server-Sent Events stream"""
+    buffer = []
+    for line in lines:
+        if line:
+            if line.startswith('data:'):
+                buffer.append(line[5:].lstrip())
+            continue
+        # A blank line terminates the event
+        if buffer:
+            data = _sse_data(buffer)
+            buffer = []
+            if data is not None:
+                yield data
+    if buffer:
+        data = _sse_data(buffer)
+        if data is not None:
+            yield data
+
+
+async def aiter_sse_data(lines) -> AsyncIterator[Dict]:
+    """iter_sse_data over an async iterator of lines"""
+    buffer = []
+    async for line in lines:
+        if line:
+            if line.startswith('data:'):
+                buffer.append(line[5:].lstrip())
+            continue
+        if buffer:
+            data = _sse_data(buffer)
+            buffer = []
+            if data is not None:
+                yield data
+    if buffer:
+        data = _sse_data(buffer)
+        if data is not None:
+            yield data
+
+
+def _request_tokens(request: ChatRequest) -> int:
+    return estimate_tokens(request.system) + sum(estimate_tokens(message['content']) for message in request.messages)
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))]
+
+
+class Provider(ABC):
+    """
+    One LLM API: builds its requests and parses its responses, and keeps the
+    guard and rolling latency/outcome windows the router ranks it by.
+    """
+
+    def __init__(self, name: str, guard: UpstreamGuard, window: int = 200):
+        self.name = name
+        self.guard = guard
+        self._latencies = {kind: deque(maxlen=window) for kind in KINDS}
+        self._outcomes = deque(maxlen=window)  # True for an answer, False for a failed attempt
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._errors = 0
+        self._cancelled = 0
+
+    @abstractmethod
+    def build(self, request: ChatRequest, stream: bool) -> Tuple[str, Dict, Dict]:
+        """The URL, headers and JSON body for a call"""
+
+    @abstractmethod
+    def parse(self, data: Dict) -> Optional[str]:
+        """The answer text of a complete response"""
+
+    @abstractmethod
+    def parse_chunk(self, data: Dict) -> Optional[str]:
+        """The text of one streamed event"""
+
+    def record_latency(self, kind: str, seconds: float) -> None:
+        with self._lock:
+            self._latencies[kind].append(seconds)
+
+    def record_outcome(self, ok: bool) -> None:
+        with self._lock:
+            self._requests += 1
+            self._errors += not ok
+            self._outcomes.append(ok)
+
+    def record_cancel(self, kind: str, elapsed: Optional[float]) -> None:
+        """A request abandoned for a faster one; its elapsed time is a lower bound on its latency"""
+        with self._lock:
+            self._cancelled += 1
+            if elapsed is not None:
+                self._latencies[kind].append(elapsed)
+
+    def samples(self, kind: str) -> int:
+        return len(self._latencies[kind])
+
+    def explored(self, min_samples: int) -> bool:
+        return len(self._outcomes) >= min_samples
+
+    def percentile(self, kind: str, pct: float) -> Optional[float]:
+        with self._lock:
+            values = list(self._latencies[kind])
+        return _percentile(values, pct) if values else None
+
+    def error_rate(self) -> float:
+        with self._lock:
+            outcomes = list(self._outcomes)
+        return outcomes.count(False) / len(outcomes) if outcomes else 0.0
+
+    def stats(self) -> Dict:
+        stats = {
+            'requests': self._requests,
+            'errors': self._errors,
+            'cancelled': self._cancelled,
+            'error_rate': round(self.error_rate(), 4)
+        }
+        for kind in KINDS:
+            label = 'complete' if kind == 'complete' else 'stream_ttfb'
+            for pct in (50, 95):
+                value = self.percentile(kind, pct)
+                stats[f'{label}_p{pct}_ms'] = round(value * 1000, 1) if value is not None else None
+            stats[f'{label}_samples'] = self.samples(kind)
+        stats['resilience'] = self.guard.stats()
+        return stats
+
+
+class GeminiProvider(Provider):
+    """Google Gemini generateContent / streamGenerateContent"""
+
+    def __init__(self, url: str, api_key: str, guard: UpstreamGuard, window: int = 200, name: str = 'gemini'):
+        super().__init__(name, guard, window)
+        self.url = url
+        self.stream_url = url.replace(':generateContent', ':streamGenerateContent') + '?alt=sse'
+        self.headers = {'Content-Type': 'application/json', 'X-goog-api-key': api_key}
+
+    def build(self, request: ChatRequest, stream: bool) -> Tuple[str, Dict, Dict]:
+        return self.stream_url if stream else self.url, self.headers, gemini_payload(request)
+
+    def parse(self, data: Dict) -> Optional[str]:
+        try:
+            return data['candidates'][0]['content']['parts'][0]['text']
+        except (KeyError, IndexError, TypeError):
+            return None
+
+    parse_chunk = parse
+
+
+class OpenAIProvider(Provider):
+    """OpenAI (or any OpenAI-compatible) chat completions"""
+
+    def __init__(self, url: str, api_key: str, model: str, guard: UpstreamGuard, temperature: float = 0.5,
+                 max_tokens: int = 1000, window: int = 200, name: str = 'openai'):
+        super().__init__(name, guard, window)
+        self.url = url
+        self.model = model
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.headers = {'Content-Type': 'application/json', 'Authorization': f'Bearer {api_key}'}
+
+    def build(self, request: ChatRequest, stream: bool) -> Tuple[str, Dict, Dict]:
+        body = {
+            'model': self.model,
+            'messages': [{'role': 'system', 'content': request.system}] + list(request.messages),
+            'temperature': self.temperature,
+            'max_tokens': self.max_tokens,
+            'stream': stream
+        }
+        return self.url, self.headers, body
+
+    def parse(self, data: Dict) -> Optional[str]:
+        try:
+            return data['choices'][0]['message']['content']
+        except (KeyError, IndexError, TypeError):
+            return None
+
+    def parse_chunk(self, data: Dict) -> Optional[str]:
+        try:
+            return data['choices'][0]['delta'].get('content')
+        except (KeyError, IndexError, TypeError, AttributeError):
+            return None
+
+
+class ProviderRouter:
+    """
+    Sends each call to the healthy provider expected to answer fastest, hedges
+    it to the next one past the first provider's observed latency percentile,
+    and fails over when a provider gives up. Calls return None (or stream
+    nothing) when no provider could answer, so the caller can fall back.
+
+    A call given a Deadline stops waiting when it expires or is cancelled: no
+    request, retry, hedge or failover is started that the provider's median
+    latency says cannot finish in time, upstream timeouts are capped at the
+    time left, and requests still in flight are cancelled. A stream's deadline
+    covers its first chunk; once text is flowing only cancellation stops it.
+    """
+
+    def __init__(self, providers: List[Provider], metrics: Optional[Metrics] = None, hedge: bool = True,
+                 hedge_percentile: float = 95.0, hedge_min_delay: float = 0.05, hedge_max_delay: float = 10.0,
+                 min_samples: int = 20, threads: int = 64):
+        self.providers = providers
+        self.metrics = metrics or Metrics()
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_max_delay = hedge_max_delay
+        self.min_samples = min_samples
+        self.threads = threads
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_pid: Optional[int] = None
+        self._lock = threading.Lock()
+        self._calls = 0
+        self._hedged = 0
+        self._hedge_wins = 0
+        self._failovers = 0
+        self._unanswered = 0
+        self._deadline_exceeded = 0
+        self._cancelled = 0
+        self._skipped = 0
+        self._aborted = 0
+        self._saved_tokens = 0
+        self.metrics.add_gauges(self.gauges)
+
+    def provider(self, name: str) -> Optional[Provider]:
+        return next((p for p in self.providers if p.name == name), None)
+
+    def rank(self, kind: str) -> List[Provider]:
+        """
+        Providers whose breaker is not open, expected-fastest first: median
+        latency scaled up by the error rate (each failure costs another try).
+        Providers without min_samples outcomes yet go first, in configured order.
+        """
+        def expected(provider: Provider):
+            if not provider.explored(self.min_samples):
+                return 0, 0.0
+            median = provider.percentile(kind, 50)
+            if median is None:
+                return 1, float('inf')
+            return 1, median / max(1 - provider.error_rate(), 0.1)
+
+        healthy = [p for p in self.providers if p.guard.breaker.state != CircuitBreaker.OPEN]
+        return sorted(healthy, key=expected)
+
+    def hedge_delay(self, provider: Provider, kind: str) -> float:
+        """How long to wait on provider before hedging: its observed percentile, clamped"""
+        if provider.samples(kind) < self.min_samples:
+            return self.hedge_max_delay
+        observed = provider.percentile(kind, self.hedge_percentile)
+        return min(self.hedge_max_delay, max(self.hedge_min_delay, observed))
+
+    def complete(self, request: ChatRequest, deadline: Optional[Deadline] = None) -> Optional[str]:
+        """The first answer any provider produced, or None if none could (in time)"""
+        answer = None
+        # Run the race to its end so the winning request is never counted as cancelled
+        for answer in self._race(request, False, deadline):
+            pass
+        return answer
+
+    def stream(self, request: ChatRequest, deadline: Optional[Deadline] = None,
+               heartbeat: Optional[float] = None) -> Iterator[str]:
+        """
+        Text chunks from the first provider to start streaming; nothing if none
+        could. Raises ProviderError if the stream breaks off after text was yielded.
+        With a heartbeat, an empty string is yielded after every heartbeat seconds
+        spent waiting for the first chunk, so the caller can check on its client.
+        """
+        return self._race(request, True, deadline, heartbeat)
+
+    async def acomplete(self, request: ChatRequest, deadline: Optional[Deadline] = None) -> Optional[str]:
+        """Non-blocking complete"""
+        answer = None
+        async for answer in self._arace(request, False, deadline):
+            pass
+        return answer
+
+    def astream(self, request: ChatRequest, deadline: Optional[Deadline] = None,
+                heartbeat: Optional[float] = None) -> AsyncIterator[str]:
+        """Non-blocking stream"""
+        return self._arace(request, True, deadline, heartbeat)
+
+    def stats(self) -> Dict:
+        providers = {}
+        for provider in self.providers:
+            stats = provider.stats()
+            for kind in KINDS:
+                label = 'complete' if kind == 'complete' else 'stream_ttfb'
+                stats[f'{label}_hedge_after_ms'] = round(self.hedge_delay(provider, kind) * 1000, 1)
+            providers[provider.name] = stats
+        return {
+            'hedging': self.hedge,
+            'calls': self._calls,
+            'hedged': self._hedged,
+            'hedge_wins': self._hedge_wins,
+            'failovers': self._failovers,
+            'unanswered': self._unanswered,
+            'deadline_exceeded': self._deadline_exceeded,
+            'cancelled': self._cancelled,
+            'saved': {
+                'requests_skipped': self._skipped,
+                'requests_aborted': self._aborted,
+                'prompt_tokens': self._saved_tokens
+            },
+            'ranking': [p.name for p in self.rank('complete')],
+            'providers': providers
+        }
+
+    def gauges(self) -> List[Tuple[str, Dict[str, str], float]]:
+        """Each provider's breaker state and limiter rate, for /metrics"""
+        gauges = []
+        for provider in self.providers:
+            labels = {'provider': provider.name}
+            gauges.append(('chatbot_circuit_breaker_state', labels, BREAKER_STATES[provider.guard.breaker.state]))
+            gauges.append(('chatbot_rate_limiter_rate', labels, round(provider.guard.limiter.stats()['rate'], 3)))
+        return gauges
+
+    def _executor_for_process(self) -> ThreadPoolExecutor:
+        # Threads do not survive a fork: each worker process starts its own pool
+        pid = os.getpid()
+        if self._executor is None or self._executor_pid != pid:
+            with self._lock:
+                if self._executor is None or self._executor_pid != pid:
+                    self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='provider')
+                    self._executor_pid = pid
+        return self._executor
+
+    def _count(self, name: str, labels: Optional[Dict[str, str]] = None) -> None:
+        self.metrics.inc(name, labels)
+
+    def _observe(self, provider: Provider, kind: str, seconds: float) -> None:
+        provider.record_latency(kind, seconds)
+        self.metrics.observe('chatbot_provider_latency_seconds', seconds, {'provider': provider.name, 'kind': kind})
+
+    def _give_up(self, provider: Provider, response) -> ProviderError:
+        if response.status_code == 429:
+            return ProviderError(f"{provider.name} rate limit exceeded")
+        return ProviderError(f"{provider.name} API error: {response.status_code} - {truncate(response.text)}")
+
+    def _fits(self, provider: Provider, kind: str, deadline: Optional[Deadline], delay: float = 0.0) -> bool:
+        """Whether a request to provider, sent after delay, can still answer before the deadline"""
+        if deadline is None:
+            return True
+        if deadline.done:
+            return False
+        typical = provider.percentile(kind, 50) if provider.samples(kind) >= self.min_samples else None
+        return delay + (typical or 0.0) < deadline.remaining()
+
+    def _saved(self, provider: Provider, deadline: Deadline, stage: str,
+               request: Optional[ChatRequest] = None) -> None:
+        """Count an upstream request never sent ('skipped') or closed early ('aborted') for the deadline"""
+        reason = 'cancelled' if deadline.cancelled else 'deadline'
+        self._count('chatbot_upstream_saved_total', {'provider': provider.name, 'reason': reason, 'stage': stage})
+        if stage == 'skipped':
+            self._skipped += 1
+            tokens = _request_tokens(request)
+            self._saved_tokens += tokens
+            self.metrics.inc('chatbot_saved_prompt_tokens_total', {'reason': reason}, tokens)
+        else:
+            self._aborted += 1
+
+    def _stopped(self, provider: Provider, kind: str, deadline: Optional[Deadline],
+                 started: Optional[float]) -> bool:
+        """
+        After a timeout or broken stream: True if it only happened because the
+        deadline ran out (or was cancelled), in which case it is recorded as a
+        cancelled request rather than a provider failure
+        """
+        if deadline is None or not deadline.done:
+            return False
+        provider.record_cancel(kind, time.perf_counter() - started if started is not None else None)
+        provider.guard.on_cancel()
+        self._saved(provider, deadline, 'aborted')
+        return True
+
+    def _on_race_event(self, state: Dict, key: int, item) -> Optional[str]:
+        """
+        Shared bookkeeping for the sync and async races. Returns 'yield' to pass
+        a chunk on, 'done' when the call is over, 'launch' to fail over to the
+        next provider, or None to keep waiting.
+        """
+        if state['winner'] is not None and key != state['winner']:
+            # Leftovers of a cancelled loser
+            if item is None or isinstance(item, Exception):
+                state['active'] -= 1
+            return None
+        if item is None or isinstance(item, Exception):
+            state['active'] -= 1
+            if state['winner'] is not None:
+                if isinstance(item, Exception):
+                    state['result'] = 'broken'
+                    raise item
+                state['result'] = 'answered'
+                return 'done'
+            if isinstance(item, Exception):
+                logger.error(f"{item}")
+                state['skipped'] |= isinstance(item, DeadlineExceeded)
+            if state['active'] == 0:
+                if state['launched'] < len(state['ranked']):
+                    return 'launch'
+                self._settle(state)
+                return 'done'
+            return None
+        if state['winner'] is None:
+            state['winner'] = key
+            if state['hedged']:
+                winner = 'primary' if key == state['hedged_primary'] else 'hedge'
+                self._hedge_wins += winner == 'hedge'
+                self._count('chatbot_hedged_requests_total', {'winner': winner})
+        return 'yield'
+
+    def _on_race_timeout(self, state: Dict) -> Optional[str]:
+        """The race waited out its timeout: 'done' at the deadline, 'hedge' when due, else 'heartbeat'"""
+        deadline = state['deadline']
+        if deadline is not None and deadline.expired:
+            self._settle(state)
+            return 'done'
+        if state['hedge_at'] is not None and time.monotonic() >= state['hedge_at']:
+            return 'hedge'
+        return 'heartbeat' if state['heartbeat'] else None
+
+    def _race_timeout(self, state: Dict) -> Optional[float]:
+        """How long the race can wait for its next event before it has to act"""
+        if state['winner'] is not None:
+            return None
+        waits = []
+        if state['hedge_at'] is not None:
+            waits.append(state['hedge_at'] - time.monotonic())
+        if state['deadline'] is not None and state['deadline'].expires_at is not None:
+            waits.append(state['deadline'].remaining())
+        if state['heartbeat']:
+            waits.append(state['heartbeat'])
+        return max(0.0, min(waits)) if waits else None
+
+    def _new_race(self, request: ChatRequest, stream: bool, deadline: Optional[Deadline],
+                  heartbeat: Optional[float], hedge: bool) -> Dict:
+        kind = 'stream' if stream else 'complete'
+        self._calls += 1
+        ranked = self.rank(kind)
+        state = {'kind': kind, 'request': request, 'ranked': ranked, 'launched': 0, 'last': None, 'active': 0,
+                 'winner': None, 'hedged': False, 'hedged_primary': None, 'hedge_at': None, 'deadline': deadline,
+                 'heartbeat': heartbeat if stream else None, 'skipped': False, 'result': None, 'hedge': hedge}
+        if not ranked:
+            logger.warning("No LLM provider available (circuit open), using fallback")
+            state['result'] = 'unanswered'
+        return state
+
+    def _next_to_launch(self, state: Dict) -> Optional[int]:
+        """The next provider to send the call to, skipping any that cannot answer before the deadline"""
+        while state['launched'] < len(state['ranked']):
+            key = state['launched']
+            state['launched'] += 1
+            provider = state['ranked'][key]
+            if self._fits(provider, state['kind'], state['deadline']):
+                return key
+            state['skipped'] = True
+            if not state['deadline'].cancelled:
+                self._saved(provider, state['deadline'], 'skipped', state['request'])
+        return None
+
+    def _launched(self, state: Dict, key: int) -> None:
+        """Bookkeeping for a request just sent: start the hedge timer if another provider is left to hedge to"""
+        state['active'] += 1
+        state['last'] = key
+        state['hedge_at'] = None
+        if state['hedge'] and not state['hedged'] and state['launched'] < len(state['ranked']):
+            state['hedge_at'] = time.monotonic() + self.hedge_delay(state['ranked'][key], state['kind'])
+
+    def _hedge(self, state: Dict) -> Optional[int]:
+        """The provider to hedge the slow request to, or None if none can answer in time"""
+        state['hedge_at'] = None
+        primary = state['last']
+        key = self._next_to_launch(state)
+        if key is None:
+            return None
+        state['hedged'] = True
+        state['hedged_primary'] = primary
+        self._hedged += 1
+        logger.info(f"{state['ranked'][primary].name} slower than its p{self.hedge_percentile:g}, "
+                    f"hedging to {state['ranked'][key].name}")
+        return key
+
+    def _failover(self, state: Dict, failed: int) -> Optional[int]:
+        """The provider to try after every request so far failed, or None when the call is over"""
+        key = self._next_to_launch(state)
+        if key is None:
+            self._settle(state)
+            return None
+        self._failovers += 1
+        self._count('chatbot_provider_failovers_total', {'provider': state['ranked'][failed].name})
+        return key
+
+    def _settle(self, state: Dict) -> None:
+        """Record why a call ended without an answer"""
+        if state['hedged']:
+            self._count('chatbot_hedged_requests_total', {'winner': 'none'})
+        deadline = state['deadline']
+        if deadline is not None and deadline.cancelled:
+            state['result'] = 'cancelled'
+        elif deadline is not None and (deadline.expired or state['skipped']):
+            state['result'] = 'expired'
+        else:
+            state['result'] = 'unanswered'
+
+    def _finish(self, state: Dict) -> None:
+        """Count how a call ended; a caller that stopped reading early has gone away"""
+        deadline = state['deadline']
+        result = state['result']
+        if result is None and deadline is not None:
+            deadline.cancel('disconnect')
+            result = 'cancelled'
+        if result == 'expired':
+            self._deadline_exceeded += 1
+            self._count('chatbot_deadline_exceeded_total', {'kind': state['kind']})
+            logger.warning(f"LLM call ran out of its {deadline.budget:g}s deadline, using fallback")
+        elif result == 'cancelled':
+            self._cancelled += 1
+            self._count('chatbot_cancelled_calls_total', {'reason': deadline.reason})
+            logger.info(f"LLM call cancelled ({deadline.reason})")
+        elif result == 'unanswered':
+            self._unanswered += 1
+
+    # Sync path: each request runs on the router's thread pool and reports to a queue
+
+    def _race(self, request: ChatRequest, stream: bool, deadline: Optional[Deadline] = None,
+              heartbeat: Optional[float] = None) -> Iterator[str]:
+        # A blocking complete request cannot be interrupted before its whole answer arrives, so a
+        # losing hedge would cost a second full answer: only streams (stopped between chunks) are hedged
+        state = self._new_race(request, stream, deadline, heartbeat, self.hedge and stream)
+        events: queue.Queue = queue.Queue()
+        cancels: Dict[int, threading.Event] = {}
+        # A cancelled deadline wakes the race with a (None, None) event
+        unsubscribe = deadline.on_cancel(lambda: events.put((None, None))) if deadline is not None else None
+
+        def launch(key):
+            cancels[key] = threading.Event()
+            self._executor_for_process().submit(self._pump, key, state['ranked'][key], request, stream,
+                                                deadline, cancels[key], events)
+            self._launched(state, key)
+
+        try:
+            if not state['ranked']:
+                return
+            key = self._next_to_launch(state)
+            if key is None:
+                self._settle(state)
+                return
+            launch(key)
+            while True:
+                try:
+                    key, item = events.get(timeout=self._race_timeout(state))
+                except queue.Empty:
+                    action = self._on_race_timeout(state)
+                else:
+                    if key is None:
+                        state['result'] = 'cancelled'
+                        return
+                    action = self._on_race_event(state, key, item)
+                if action == 'yield':
+                    for other, cancel in cancels.items():
+                        if other != key:
+                            cancel.set()
+                    yield item
+                elif action == 'heartbeat':
+                    yield ''
+                elif action == 'hedge':
+                    key = self._hedge(state)
+                    if key is not None:
+                        launch(key)
+                elif action == 'launch':
+                    key = self._failover(state, key)
+                    if key is None:
+                        return
+                    launch(key)
+                elif action == 'done':
+                    return
+        finally:
+            if unsubscribe is not None:
+                unsubscribe()
+            self._finish(state)
+            # The answer is in, the deadline passed or the client went away: stop every request still running
+            for cancel in cancels.values():
+                cancel.set()
+
+    def _pump(self, key: int, provider: Provider, request: ChatRequest, stream: bool, deadline: Optional[Deadline],
+              cancel: threading.Event, events: queue.Queue) -> None:
+        kind = 'stream' if stream else 'complete'
+        attempts = self._attempts(provider, request, stream, deadline, cancel)
+        try:
+            for text in attempts:
+                if cancel.is_set():
+                    provider.record_cancel(kind, None)
+                    if deadline is not None and deadline.done:
+                        self._saved(provider, deadline, 'aborted')
+                    break
+                events.put((key, text))
+        except ProviderError as e:
+            events.put((key, e))
+        except Exception as e:
+            # Never leave the race waiting on a request that died
+            logger.exception(f"Unexpected error calling {provider.name}")
+            events.put((key, ProviderError(f"{provider.name} failed: {e}")))
+        else:
+            events.put((key, None))
+        finally:
+            attempts.close()
+
+    def _attempts(self, provider: Provider, request: ChatRequest, stream: bool, deadline: Optional[Deadline],
+                  cancel: threading.Event) -> Iterator[str]:
+        """
+        One provider's answer (the whole text, or chunks when streaming), retried
+        through its guard. Raises ProviderError when the provider gives up and
+        returns quietly once cancel is set or the deadline stops it.
+        """
+        guard = provider.guard
+        kind = 'stream' if stream else 'complete'
+        url, headers, body = provider.build(request, stream)
+        client = get_upstream_client()
+        streamed_any = False
+
+        for attempt in range(guard.max_retries):
+            wait = guard.admit(deadline.remaining() if deadline is not None else None)
+            if wait is None:
+                raise ProviderError(f"{provider.name} unavailable (circuit open or rate limited)")
+            if wait > 0:
+                with self.metrics.timer('rate_limit_wait'):
+                    if cancel.wait(wait):
+                        guard.on_cancel()
+                        return
+
+            started = time.perf_counter()
+            try:
+                with nullcontext() if stream else self.metrics.timer('upstream_request'):
+                    response = client.post(url, headers=headers, json=body, stream=stream,
+                                           timeout=deadline.cap(client.timeout) if deadline is not None else None)
+            except requests.exceptions.Timeout:
+                if self._stopped(provider, kind, deadline, started):
+                    return
+                self._count('chatbot_upstream_requests_total', {'provider': provider.name, 'status': 'timeout'})
+                provider.record_outcome(False)
+                guard.on_error(attempt, retryable=False)
+                raise ProviderError(f"{provider.name} request timeout")
+            except requests.exceptions.RequestException as e:
+                self._count('chatbot_upstream_requests_total', {'provider': provider.name, 'status': 'error'})
+                provider.record_outcome(False)
+                retry_delay = guard.on_error(attempt)
+                if retry_delay is None:
+                    raise ProviderError(f"{provider.name} request failed: {e}")
+            else:
+                with response:
+                    self._count('chatbot_upstream_requests_total',
+                                {'provider': provider.name, 'status': response.status_code})
+                    if response.status_code != 200:
+                        provider.record_outcome(False)
+                        retry_delay = guard.on_status(response.status_code, response.headers.get('Retry-After'),
+                                                      attempt)
+                        if retry_delay is None:
+                            raise self._give_up(provider, response)
+                    else:
+                        guard.on_success()
+                        try:
+                            if stream:
+                                for data in iter_sse_data(response.iter_lines(decode_unicode=True)):
+                                    text = provider.parse_chunk(data)
+                                    if text:
+                                        if not streamed_any:
+                                            streamed_any = True
+                                            self._observe(provider, kind, time.perf_counter() - started)
+                                        yield text
+                            else:
+                                text = provider.parse(response.json())
+                                if text:
+                                    self._observe(provider, kind, time.perf_counter() - started)
+                                    streamed_any = True
+                                    yield text
+                        except (requests.exceptions.RequestException, ValueError) as e:
+                            if not streamed_any and self._stopped(provider, kind, deadline, started):
+                                return
+                            provider.record_outcome(False)
+                            # Never retry once text has reached the caller
+                            retry_delay = None if streamed_any else guard.on_error(attempt)
+                            if retry_delay is None:
+                                raise ProviderError(f"{provider.name} stream broke off: {e}")
+                        else:
+                            provider.record_outcome(streamed_any)
+                            if streamed_any:
+                                return
+                            raise ProviderError(f"Unexpected response format from {provider.name}")
+
+            if not self._fits(provider, kind, deadline, retry_delay):
+                if deadline.cancelled:
+                    return
+                self._saved(provider, deadline, 'skipped', request)
+                raise DeadlineExceeded(f"{provider.name} retry skipped: it could not answer before the deadline")
+            logger.warning(f"{provider.name} retrying in {retry_delay:.1f} seconds... "
+                           f"(attempt {attempt + 1}/{guard.max_retries})")
+            self._count('chatbot_upstream_retries_total', {'provider': provider.name})
+            with self.metrics.timer('backoff'):
+                if cancel.wait(retry_delay):
+                    return
+        raise ProviderError(f"{provider.name} gave up after {guard.max_retries} attempts")
+
+    # Async path: each request is a task reporting to an asyncio queue, so losers are cancelled outright
+
+    async def _arace(self, request: ChatRequest, stream: bool, deadline: Optional[Deadline] = None,
+                     heartbeat: Optional[float] = None) -> AsyncIterator[str]:
+        state = self._new_race(request, stream, deadline, heartbeat, self.hedge)
+        events: asyncio.Queue = asyncio.Queue()
+        tasks: Dict[int, asyncio.Task] = {}
+        unsubscribe = None
+        if deadline is not None:
+            loop = asyncio.get_running_loop()
+            unsubscribe = deadline.on_cancel(lambda: loop.call_soon_threadsafe(events.put_nowait, (None, None)))
+
+        def launch(key):
+            tasks[key] = asyncio.ensure_future(self._apump(key, state['ranked'][key], request, stream,
+                                                           deadline, events))
+            self._launched(state, key)
+
+        getter = None
+        try:
+            if not state['ranked']:
+                return
+            key = self._next_to_launch(state)
+            if key is None:
+                self._settle(state)
+                return
+            launch(key)
+            while True:
+                if getter is None:
+                    getter = asyncio.ensure_future(events.get())
+                done, _ = await asyncio.wait({getter}, timeout=self._race_timeout(state))
+                if not done:
+                    action = self._on_race_timeout(state)
+                else:
+                    key, item = getter.result()
+                    getter = None
+                    if key is None:
+                        state['result'] = 'cancelled'
+                        return
+                    action = self._on_race_event(state, key, item)
+                if action == 'yield':
+                    for other, task in tasks.items():
+                        if other != key:
+                            task.cancel()
+                    yield item
+                elif action == 'heartbeat':
+                    yield ''
+                elif action == 'hedge':
+                    key = self._hedge(state)
+                    if key is not None:
+                        launch(key)
+                elif action == 'launch':
+                    key = self._failover(state, key)
+                    if key is None:
+                        return
+                    launch(key)
+                elif action == 'done':
+                    return
+        finally:
+            if unsubscribe is not None:
+                unsubscribe()
+            self._finish(state)
+            if getter is not None:
+                getter.cancel()
+            for task in tasks.values():
+                task.cancel()
+
+    async def _apump(self, key: int, provider: Provider, request: ChatRequest, stream: bool,
+                     deadline: Optional[Deadline], events: asyncio.Queue) -> None:
+        try:
+            async for text in self._aattempts(provider, request, stream, deadline):
+                events.put_nowait((key, text))
+        except ProviderError as e:
+            events.put_nowait((key, e))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception(f"Unexpected error calling {provider.name}")
+            events.put_nowait((key, ProviderError(f"{provider.name} failed: {e}")))
+        else:
+            events.put_nowait((key, None))
+
+    async def _aattempts(self, provider: Provider, request: ChatRequest, stream: bool,
+                         deadline: Optional[Deadline] = None) -> AsyncIterator[str]:
+        """Non-blocking _attempts; a cancelled request records its elapsed time as a latency lower bound"""
+        guard = provider.guard
+        kind = 'stream' if stream else 'complete'
+        url, headers, body = provider.build(request, stream)
+        client = get_async_upstream_client()
+        streamed_any = False
+
+        for attempt in range(guard.max_retries):
+            wait = guard.admit(deadline.remaining() if deadline is not None else None)
+            if wait is None:
+                raise ProviderError(f"{provider.name} unavailable (circuit open or rate limited)")
+            started = None
+            try:
+                if wait > 0:
+                    with self.metrics.timer('rate_limit_wait'):
+                        await asyncio.sleep(wait)
+
+                started = time.perf_counter()
+                timeout = deadline.cap(client.timeout) if deadline is not None else None
+                try:
+                    if stream:
+                        response = await client.stream(url, headers=headers, json=body, timeout=timeout)
+                    else:
+                        with self.metrics.timer('upstream_request'):
+                            response = await client.post(url, headers=headers, json=body, timeout=timeout)
+                except httpx.TimeoutException:
+                    if self._stopped(provider, kind, deadline, started):
+                        return
+                    self._count('chatbot_upstream_requests_total', {'provider': provider.name, 'status': 'timeout'})
+                    provider.record_outcome(False)
+                    guard.on_error(attempt, retryable=False)
+                    raise ProviderError(f"{provider.name} request timeout")
+                except httpx.HTTPError as e:
+                    self._count('chatbot_upstream_requests_total', {'provider': provider.name, 'status': 'error'})
+                    provider.record_outcome(False)
+                    retry_delay = guard.on_error(attempt)
+                    if retry_delay is None:
+                        raise ProviderError(f"{provider.name} request failed: {e}")
+                else:
+                    try:
+                        self._count('chatbot_upstream_requests_total',
+                                    {'provider': provider.name, 'status': response.status_code})
+                        if response.status_code != 200:
+                            await response.aread()
+                            provider.record_outcome(False)
+                            retry_delay = guard.on_status(response.status_code, response.headers.get('Retry-After'),
+                                                          attempt)
+                            if retry_delay is None:
+                                raise self._give_up(provider, response)
+                        else:
+                            guard.on_success()
+                            try:
+                                if stream:
+                                    async for data in aiter_sse_data(response.aiter_lines()):
+                                        text = provider.parse_chunk(data)
+                                        if text:
+                                            if not streamed_any:
+                                                streamed_any = True
+                                                self._observe(provider, kind, time.perf_counter() - started)
+                                            yield text
+                                else:
+                                    text = provider.parse(response.json())
+                                    if text:
+                                        self._observe(provider, kind, time.perf_counter() - started)
+                                        streamed_any = True
+                                        yield text
+                            except (httpx.HTTPError, ValueError) as e:
+                                if not streamed_any and self._stopped(provider, kind, deadline, started):
+                                    return
+                                provider.record_outcome(False)
+                                retry_delay = None if streamed_any else guard.on_error(attempt)
+                                if retry_delay is None:
+                                    raise ProviderError(f"{provider.name} stream broke off: {e}")
+                            else:
+                                provider.record_outcome(streamed_any)
+                                if streamed_any:
+                                    return
+                                raise ProviderError(f"Unexpected response format from {provider.name}")
+                    finally:
+                        await response.aclose()
+
+                if not self._fits(provider, kind, deadline, retry_delay):
+                    if deadline.cancelled:
+                        return
+                    self._saved(provider, deadline, 'skipped', request)
+                    raise DeadlineExceeded(f"{provider.name} retry skipped: it could not answer before the deadline")
+                logger.warning(f"{provider.name} retrying in {retry_delay:.1f} seconds... "
+                               f"(attempt {attempt + 1}/{guard.max_retries})")
+                self._count('chatbot_upstream_retries_total', {'provider': provider.name})
+                with self.metrics.timer('backoff'):
+                    await asyncio.sleep(retry_delay)
+            except asyncio.CancelledError:
+                elapsed = time.perf_counter() - started if started is not None and not streamed_any else None
+                provider.record_cancel(kind, elapsed)
+                guard.on_cancel()
+                if deadline is not None and deadline.done and started is not None:
+                    self._saved(provider, deadline, 'aborted')
+                raise
+        raise ProviderError(f"{provider.name} gave up after {guard.max_retries} attempts")
+
+
+def guard_from_config(shared_state: Optional[SharedState] = None, name: str = '') -> UpstreamGuard:
+    """
+    A rate limiter, circuit breaker and retry policy with the configured settings.
+    With shared state the provider's token bucket is shared by every worker on the host.
+    """
+    limiter = AdaptiveRateLimiter(
+        rate=Config.RATE_LIMIT_RPS,
+        burst=Config.RATE_LIMIT_BURST,
+        min_rate=Config.RATE_LIMIT_MIN_RPS,
+        max_rate=Config.RATE_LIMIT_MAX_RPS
+    )
+    if shared_state is not None and shared_state.enabled:
+        limiter.share(shared_state, f'rate_limit:{name}')
+    return UpstreamGuard(
+        limiter,
+        CircuitBreaker(
+            failure_threshold=Config.BREAKER_FAILURE_THRESHOLD,
+            reset_timeout=Config.BREAKER_RESET_TIMEOUT
+        ),
+        max_retries=Config.UPSTREAM_MAX_RETRIES,
+        base_delay=Config.RETRY_BASE_DELAY,
+        max_delay=Config.RETRY_MAX_DELAY,
+        max_wait=Config.RATE_LIMIT_MAX_WAIT
+    )
+
+
+def create_providers(shared_state: Optional[SharedState] = None) -> List[Provider]:
+    """Every provider named in LLM_PROVIDERS that has an API key, in that order"""
+    providers: List[Provider] = []
+    for name in Config.LLM_PROVIDERS:
+        if name == 'gemini':
+            if Config.GENAI_API_KEY:
+                providers.append(GeminiProvider(Config.GEMINI_API_URL, Config.GENAI_API_KEY,
+                                                guard_from_config(shared_state, name),
+                                                window=Config.PROVIDER_WINDOW))
+        elif name == 'openai':
+            if Config.OPENAI_API_KEY:
+                providers.append(OpenAIProvider(Config.OPENAI_API_URL, Config.OPENAI_API_KEY, Config.OPENAI_MODEL,
+                                                guard_from_config(shared_state, name),
+                                                temperature=Config.OPENAI_TEMPERATURE,
+                                                max_tokens=Config.OPENAI_MAX_TOKENS, window=Config.PROVIDER_WINDOW))
+        else:
+            logger.warning(f"Unknown LLM provider in LLM_PROVIDERS: {name}")
+    return providers
+
+
+def create_router(metrics: Optional[Metrics] = None, shared_state: Optional[SharedState] = None) -> ProviderRouter:
+    """A router over the configured providers (none configured means demo mode)"""
+    return ProviderRouter(
+        create_providers(shared_state),
+        metrics,
+        hedge=Config.HEDGE_REQUESTS,
+        hedge_percentile=Config.HEDGE_PERCENTILE,
+        hedge_min_delay=Config.HEDGE_MIN_DELAY,
+        hedge_max_delay=Config.HEDGE_MAX_DELAY,
+        min_samples=Config.PROVIDER_MIN_SAMPLES,
+        threads=Config.PROVIDER_THREADS
+    )
@@ -0,0 +1,364 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date)"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket shared by every request in the worker.
+
+    The refill rate adapts to the upstream: it is halved on a 429
+    (multiplicative decrease, at most once per `decrease_interval` so a burst
+    of concurrent 429s counts as one signal) and creeps back up by `increase`
+    requests/s on each success (additive increase). A Retry-After header
+    pauses the bucket for the requested time.
+
+    By default every worker process has its own bucket. share() moves the
+    bucket into the host's shared state, so the configured rate is what all
+    workers together send.
+    """
+
+    def __init__(self, rate: float = 10.0, burst: float = 20.0, min_rate: float = 0.5,
+                 max_rate: float = 50.0, increase: float = 0.5, decrease_interval: float = 1.0):
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease_interval = decrease_interval
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._last_decrease = float('-inf')
+        self._lock = threading.Lock()
+        self._throttled = 0
+        self._rejected = 0
+        self.shared = None
+
+    def share(self, state, key: str) -> bool:
+        """Keep the bucket in a SharedState record; False (bucket stays per process) if it has none to give"""
+        self.shared = state.record(key, (self.rate, self._tokens, self._updated, self._blocked_until,
+                                         self._last_decrease))
+        return self.shared is not None
+
+    @contextmanager
+    def _bucket(self) -> Iterator[None]:
+        """Hold the bucket, loading and saving its state when it is shared with other workers"""
+        with self._lock:
+            if self.shared is None:
+                yield
+                return
+            with self.shared.locked() as values:
+                self.rate, self._tokens, self._updated, self._blocked_until, self._last_decrease = values
+                yield
+                values[:] = self.rate, self._tokens, self._updated, self._blocked_until, self._last_decrease
+
+    def reserve(self, max_wait: Optional[float] = None) -> Optional[float]:
+        """
+        Take a token, returning how long the caller must wait before sending.
+        Returns None without taking a token if the wait would exceed max_wait.
+        """
+        with self._bucket():
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # Tokens may go negative: each waiter queues behind the previous ones
+            wait = max(self._blocked_until - now, 0.0) + max(0.0, (1 - self._tokens) / self.rate)
+            if max_wait is not None and wait > max_wait:
+                self._rejected += 1
+                return None
+            self._tokens -= 1
+            return wait
+
+    def on_success(self) -> None:
+        with self._bucket():
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_throttled(self, retry_after: Optional[float] = None) -> None:
+        with self._bucket():
+            self._throttled += 1
+            now = time.monotonic()
+            if now - self._last_decrease >= self.decrease_interval:
+                self._last_decrease = now
+                self.rate = max(self.min_rate, self.rate / 2)
+                self._tokens = min(self._tokens, 0.0)
+            if retry_after:
+                self._blocked_until = max(self._blocked_until, now + retry_after)
+
+    def stats(self) -> Dict:
+        with self._bucket():
+            return {
+                'rate': round(self.rate, 3),
+                'tokens': round(self._tokens, 3),
+                'blocked_for': round(max(0.0, self._blocked_until - time.monotonic()), 3),
+                'throttled': self._throttled,
+                'rejected': self._rejected,
+                'shared': self.shared is not None
+            }
+
+
+class CircuitBreaker:
+    """
+    Stops calling an unhealthy upstream.
+
+    After `failure_threshold` consecutive failures the breaker opens and every
+    call fast-fails for `reset_timeout` seconds. It then lets a single trial
+    call through (half-open): success closes the breaker, failure re-opens it.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+        self._opened = 0
+        self._short_circuited = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self) -> str:
+        # Caller must hold self._lock
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = self.HALF_OPEN
+            self._trial_in_flight = False
+        return self._state
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            self._short_circuited += 1
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._state = self.CLOSED
+            self._trial_in_flight = False
+
+    def release(self) -> None:
+        """Give back a half-open trial slot whose call was abandoned without an outcome"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            state = self._current_state()
+            if state == self.HALF_OPEN or (state == self.CLOSED and self._failures >= self.failure_threshold):
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._opened += 1
+            self._trial_in_flight = False
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'state': self._current_state(),
+                'consecutive_failures': self._failures,
+                'opened': self._opened,
+                'short_circuited': self._short_circuited
+            }
+
+
+class UpstreamGuard:
+    """
+    Combines the rate limiter, circuit breaker and jittered retry policy that
+    every upstream call goes through. The guard only decides; callers do the
+    waiting so the same guard serves sync and asyncio code.
+    """
+
+    RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+    def __init__(self, limiter: AdaptiveRateLimiter, breaker: CircuitBreaker, max_retries: int = 3,
+                 base_delay: float = 2.0, max_delay: float = 8.0, max_wait: float = 10.0):
+        self.limiter = limiter
+        self.breaker = breaker
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_wait = max_wait
+
+    def admit(self, max_wait: Optional[float] = None) -> Optional[float]:
+        """
+        Delay before the next attempt, or None to fast-fail (breaker open, or the
+        limiter wait longer than max_wait / the configured max_wait)
+        """
+        if not self.breaker.allow():
+            return None
+        wait = self.limiter.reserve(self.max_wait if max_wait is None else min(self.max_wait, max_wait))
+        if wait is None:
+            # Nothing was sent, so this says nothing about upstream health: give a half-open trial slot back
+            self.breaker.release()
+        return wait
+
+    def backoff(self, attempt: int) -> float:
+        """Full-jitter exponential backoff"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def on_success(self) -> None:
+        self.limiter.on_success()
+        self.breaker.record_success()
+
+    def on_status(self, status_code: int, retry_after: Optional[str], attempt: int) -> Optional[float]:
+        """Record a non-200 response. Returns the delay before retrying, or None to give up."""
+        if status_code not in self.RETRYABLE_STATUS:
+            # Client errors say nothing about upstream health
+            self.breaker.record_success()
+            return None
+        self.breaker.record_failure()
+        delay = parse_retry_after(retry_after)
+        if status_code == 429:
+            self.limiter.on_throttled(delay)
+        if attempt >= self.max_retries - 1 or self.breaker.state == CircuitBreaker.OPEN:
+            return None
+        return max(delay or 0.0, self.backoff(attempt))
+
+    def on_error(self, attempt: int, retryable: bool = True) -> Optional[float]:
+        """Record a transport error. Returns the delay before retrying, or None to give up."""
+        self.breaker.record_failure()
+        if not retryable or attempt >= self.max_retries - 1 or self.breaker.state == CircuitBreaker.OPEN:
+            return None
+        return self.backoff(attempt)
+
+    def on_cancel(self) -> None:
+        """Record a call abandoned before its outcome was known (e.g. the loser of a hedged pair)"""
+        self.breaker.release()
+
+    def stats(self) -> Dict:
+        return {
+            'rate_limiter': self.limiter.stats(),
+            'circuit_breaker': self.breaker.stats()
+        }
+
+
+class Deadline:
+    """
+    Time budget for one chat request, shared by everything done on its behalf.
+
+    Upstream timeouts are capped at the time left and work that cannot finish
+    in time is skipped. cancel() (the client went away, or cleared the chat)
+    runs the registered callbacks so waiting work stops early. A budget of
+    None never expires.
+    """
+
+    def __init__(self, budget: Optional[float] = None):
+        self.budget = budget
+        self.expires_at = None if budget is None else time.monotonic() + budget
+        self.reason: Optional[str] = None
+        self._lock = threading.Lock()
+        self._callbacks: List[Callable[[], None]] = []
+
+    def remaining(self) -> float:
+        if self.expires_at is None:
+            return float('inf')
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    @property
+    def cancelled(self) -> bool:
+        return self.reason is not None
+
+    @property
+    def done(self) -> bool:
+        return self.cancelled or self.expired
+
+    def cap(self, timeout: Tuple[float, float]) -> Tuple[float, float]:
+        """A (connect, read) timeout shortened to the time left"""
+        # HTTP clients reject a zero timeout
+        remaining = max(self.remaining(), 0.001)
+        return min(timeout[0], remaining), min(timeout[1], remaining)
+
+    def cancel(self, reason: str = 'cancelled') -> None:
+        with self._lock:
+            if self.reason is not None:
+                return
+            self.reason = reason
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def on_cancel(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """Run callback once on cancel (at once if already cancelled); returns a function that unregisters it"""
+        with self._lock:
+            if self.reason is None:
+                self._callbacks.append(callback)
+
+                def remove():
+                    with self._lock:
+                        if callback in self._callbacks:
+                            self._callbacks.remove(callback)
+                return remove
+        callback()
+        return lambda: None
+
+
+class DeadlineRegistry:
+    """Deadlines of the requests in flight in this worker by session, so clearing a chat can cancel its work"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_session: Dict[str, Set[Deadline]] = {}
+        self._cancelled = 0
+
+    def add(self, session: str, deadline: Deadline) -> None:
+        with self._lock:
+            self._by_session.setdefault(session, set()).add(deadline)
+
+    def discard(self, session: str, deadline: Deadline) -> None:
+        with self._lock:
+            deadlines = self._by_session.get(session)
+            if deadlines is not None:
+                deadlines.discard(deadline)
+                if not deadlines:
+                    del self._by_session[session]
+
+    def cancel(self, session: str, reason: str) -> int:
+        """Cancel every in-flight request of the session, returning how many there were"""
+        with self._lock:
+            deadlines = self._by_session.pop(session, set())
+            self._cancelled += len(deadlines)
+        for deadline in deadlines:
+            deadline.cancel(reason)
+        return len(deadlines)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'in_flight': sum(len(deadlines) for deadlines in self._by_session.values()),
+                'cancelled': self._cancelled
+            }
@@ -0,0 +1,221 @@
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from shared_state import SharedState
+
+logger = logging.getLogger(__name__)
+
+# Trailing punctuation that does not change the meaning of a question
+_TRAILING_PUNCTUATION = '?!.,;:।॥ '
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_message(message: str) -> str:
+    """Normalize a user message so trivially different spellings share a cache entry"""
+    return _WHITESPACE.sub(' ', message.lower()).strip(_TRAILING_PUNCTUATION)
+
+
+class ResponseCache:
+    """
+    Tiered cache for generated answers.
+
+    The first tier is an in-process LRU with a TTL. The optional second tier is
+    the hot-answer table of a SharedState, read in place from memory shared by
+    every worker on the host. The optional third tier is a SQLite database,
+    also shared by the workers, which survives restarts and holds more.
+    Entries found in a shared tier are promoted into the LRU.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 86400, db_path: Optional[str] = None,
+                 shared: Optional[SharedState] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.db_path = db_path or None
+        self.shared = shared if shared is not None and shared.enabled else None
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._writes = 0
+        self._counters = {
+            'hits': 0,
+            'memory_hits': 0,
+            'shared_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'expirations': 0
+        }
+
+        if self.db_path:
+            self._init_db()
+
+    @staticmethod
+    def make_key(message: str, language: str, topic: str) -> str:
+        raw = f"{language}\x1f{topic}\x1f{normalize_message(message)}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, created = entry
+                if now - created < self.ttl:
+                    self._entries.move_to_end(key)
+                    self._counters['hits'] += 1
+                    self._counters['memory_hits'] += 1
+                    return value
+                del self._entries[key]
+                self._counters['expirations'] += 1
+
+        if self.shared is not None:
+            found = self.shared.get_answer(key, self.ttl)
+            if found is not None:
+                value, created = found
+                with self._lock:
+                    self._store(key, value, created)
+                    self._counters['hits'] += 1
+                    self._counters['shared_hits'] += 1
+                return value
+
+        if self.db_path:
+            row = self._db_get(key, now)
+            if row is not None:
+                value, created = row
+                with self._lock:
+                    self._store(key, value, created)
+                    self._counters['hits'] += 1
+                    self._counters['disk_hits'] += 1
+                if self.shared is not None:
+                    self.shared.put_answer(key, value, created)
+                return value
+
+        with self._lock:
+            self._counters['misses'] += 1
+        return None
+
+    def set(self, key: str, value: str) -> None:
+        created = time.time()
+        with self._lock:
+            self._store(key, value, created)
+        if self.shared is not None:
+            self.shared.put_answer(key, value, created)
+        if self.db_path:
+            self._db_set(key, value, created)
+
+    def preload(self) -> int:
+        """
+        Fill the LRU with the newest unexpired answers from SQLite, so a new
+        process (or, with a preloading server, every worker) starts warm.
+        Returns how many were loaded.
+        """
+        if not self.db_path:
+            return 0
+        try:
+            rows = self._connection().execute(
+                'SELECT key, response, created FROM response_cache WHERE created > ? ORDER BY created DESC LIMIT ?',
+                (time.time() - self.ttl, self.max_entries)
+            ).fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"Response cache preload failed: {e}")
+            return 0
+        with self._lock:
+            # Oldest first, so the newest end up most recently used
+            for key, value, created in reversed(rows):
+                if key not in self._entries:
+                    self._store(key, value, created)
+        return len(rows)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+        if self.shared is not None:
+            self.shared.clear_answers()
+        if self.db_path:
+            try:
+                with self._connection() as conn:
+                    conn.execute('DELETE FROM response_cache')
+            except sqlite3.Error as e:
+                logger.error(f"Response cache clear failed: {e}")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._counters)
+            stats['entries'] = len(self._entries)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        stats['max_entries'] = self.max_entries
+        stats['ttl'] = self.ttl
+        stats['shared'] = self.shared is not None
+        stats['persistent'] = bool(self.db_path)
+        return stats
+
+    def _store(self, key: str, value: str, created: float) -> None:
+        # Caller must hold self._lock
+        self._entries[key] = (value, created)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._counters['evictions'] += 1
+
+    # SQLite tier
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 connections must not cross threads or forked processes
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _init_db(self) -> None:
+        try:
+            self._connection().execute(
+                'CREATE TABLE IF NOT EXISTS response_cache ('
+                'key TEXT PRIMARY KEY, response TEXT NOT NULL, created REAL NOT NULL)'
+            )
+        except sqlite3.Error as e:
+            logger.error(f"Could not open response cache database {self.db_path}: {e}")
+            self.db_path = None
+
+    def _db_get(self, key: str, now: float) -> Optional[Tuple[str, float]]:
+        try:
+            return self._connection().execute(
+                'SELECT response, created FROM response_cache WHERE key = ? AND created > ?',
+                (key, now - self.ttl)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.error(f"Response cache read failed: {e}")
+            return None
+
+    def _db_set(self, key: str, value: str, created: float) -> None:
+        try:
+            conn = self._connection()
+            conn.execute(
+                'INSERT OR REPLACE INTO response_cache (key, response, created) VALUES (?, ?, ?)',
+                (key, value, created)
+            )
+            self._writes += 1
+            if self._writes % 100 == 0:
+                self._db_prune(conn, created)
+        except sqlite3.Error as e:
+            logger.error(f"Response cache write failed: {e}")
+
+    def _db_prune(self, conn: sqlite3.Connection, now: float) -> None:
+        """Drop expired rows and keep the shared tier within 10x the memory tier"""
+        conn.execute('DELETE FROM response_cache WHERE created <= ?', (now - self.ttl,))
+        conn.execute(
+            'DELETE FROM response_cache WHERE key IN ('
+            'SELECT key FROM response_cache ORDER BY created DESC LIMIT -1 OFFSET ?)',
+            (self.max_entries * 10,)
+        )
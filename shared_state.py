@@ -0,0 +1,458 @@
+"""
+Host-wide state shared by every worker through one memory-mapped file.
+
+Each gunicorn worker keeps its own caches and rate limiters, so adding
+workers divides the cache hit rate and multiplies the request rate the
+providers see. The file at SHARED_STATE_FILE (best on tmpfs, e.g. /dev/shm)
+holds three fixed-layout tables that every worker on the host maps and reads
+in place, with no server to call and nothing to deserialize:
+
+- counters: one row per worker process, written only by that process, so
+  workers never wait on each other; readers add the rows up
+- hot answers: a set-associative table of recent answers keyed by a hash of
+  the cache key. Writers take a byte-range lock on the set. Readers take no
+  lock: each slot carries a sequence number (odd while a write is under way)
+  and a checksum, and a read that overlapped a write is retried
+- records: a few floats per key updated under a byte-range lock, used for
+  the providers' token buckets so every worker draws from one budget
+
+The file is created under a separate lock file, written to a temporary name
+and renamed into place, so a process that dies while creating it never
+leaves a half-built table behind. A file with another layout, or from
+before the last reboot (its monotonic timestamps would be meaningless), is
+replaced the same way; processes still mapping the old file keep it until
+they exit. The kernel drops the locks of a worker that dies, the next
+writer overwrites a slot it left half-written, and its counter row is taken
+over, counts included, by the next new worker.
+"""
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import uuid
+import zlib
+from contextlib import contextmanager
+from hashlib import blake2b
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: no byte-range locks, so no shared state
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'CHATSHM1'
+VERSION = 1
+
+# Host-wide counters, one column per name; changing them changes the layout
+COUNTERS = ('cache_hits', 'similar_hits', 'cache_misses', 'answers_stored', 'fallbacks')
+_COUNTER_INDEX = {name: i for i, name in enumerate(COUNTERS)}
+
+# magic, version, layout checksum, boot id, created (wall clock)
+_HEADER = struct.Struct('<8sII16sd')
+_HEADER_SIZE = 64
+# Bytes of the header used as host-wide locks for claiming counter rows and records
+_ROW_LOCK = 0
+_RECORD_LOCK = 1
+
+_U32 = struct.Struct('<I')
+_U64 = struct.Struct('<Q')
+_I64 = struct.Struct('<q')
+# Answer slot: sequence number, then key digest, created (wall clock), answer length and CRC-32
+_SLOT = struct.Struct('<I4x16sdII')
+_SLOT_BODY = struct.Struct('<16sdII')
+# Record: key digest and up to RECORD_FIELDS floats
+RECORD_FIELDS = 6
+_RECORD = struct.Struct(f'<16s{RECORD_FIELDS}d')
+
+_EMPTY_KEY = bytes(16)
+_SEQ_MASK = 0xFFFFFFFF
+
+
+def _digest(key: str) -> bytes:
+    return blake2b(key.encode('utf-8'), digest_size=16).digest()
+
+
+def _round_up(size: int, multiple: int) -> int:
+    return -(-size // multiple) * multiple
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _boot_id() -> bytes:
+    """Identifies the current boot (Linux); empty elsewhere"""
+    try:
+        with open('/proc/sys/kernel/random/boot_id') as f:
+            return uuid.UUID(f.read().strip()).bytes
+    except (OSError, ValueError):
+        return _EMPTY_KEY
+
+
+class SharedRecord:
+    """A few floats in the shared file that every worker updates under one host-wide lock"""
+
+    __slots__ = ('state', 'offset', '_values')
+
+    def __init__(self, state: 'SharedState', offset: int, fields: int):
+        self.state = state
+        self.offset = offset
+        self._values = struct.Struct(f'<{fields}d')
+
+    @contextmanager
+    def locked(self) -> Iterator[List[float]]:
+        """Hold the record: yields its values as a list, written back when the block ends"""
+        start = self.offset + len(_EMPTY_KEY)
+        with self.state._locked(self.offset):
+            values = list(self._values.unpack_from(self.state._mm, start))
+            yield values
+            self._values.pack_into(self.state._mm, start, *values)
+
+
+class SharedState:
+    """
+    Counters, hot answers and records shared by the processes on this host.
+    An empty path disables it: counters are dropped, answer lookups miss and
+    record() returns None, so callers keep their per-process state.
+    """
+
+    SET_WAYS = 4
+    READ_RETRIES = 16
+    RECORD_SLOTS = 64
+
+    def __init__(self, path: str = '', answer_slots: int = 1024, answer_bytes: int = 8192,
+                 max_workers: int = 128):
+        self.path = path or None
+        self.max_workers = max_workers
+        self.answer_sets = max(1, answer_slots // self.SET_WAYS)
+        self.slot_bytes = _round_up(max(answer_bytes, _SLOT.size + 64), 64)
+        self.max_answer_bytes = self.slot_bytes - _SLOT.size
+        self.created: Optional[float] = None
+        self._row = struct.Struct('<q' + 'Q' * len(COUNTERS))
+        self._rows_at = _HEADER_SIZE
+        self._records_at = self._rows_at + _round_up(self._row.size * max_workers, 64)
+        self._answers_at = self._records_at + _RECORD.size * self.RECORD_SLOTS
+        self.size = self._answers_at + self.answer_sets * self.SET_WAYS * self.slot_bytes
+        self._layout = zlib.crc32(repr((COUNTERS, max_workers, self.answer_sets, self.SET_WAYS, self.slot_bytes,
+                                        self.RECORD_SLOTS, RECORD_FIELDS)).encode())
+        self._fd: Optional[int] = None
+        self._mm: Optional[mmap.mmap] = None
+        self._view: Optional[memoryview] = None
+        # fcntl locks belong to the process, so threads also take a lock of their own
+        self._write_lock = threading.Lock()
+        self._counter_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._row_pid: Optional[int] = None
+        self._row_offset: Optional[int] = None
+        # This process's table activity (hits are counted by the caller, keeping lookups lock-free)
+        self._counts = {
+            'answer_writes': 0,
+            'too_large': 0,
+            'read_retries': 0,
+            'torn_reads': 0,
+            'locks': 0,
+            'contended': 0
+        }
+
+        if self.path:
+            if fcntl is None:
+                logger.warning("Shared state needs fcntl byte-range locks; keeping state per process")
+                self.path = None
+            else:
+                try:
+                    self._open()
+                except OSError as e:
+                    logger.error(f"Could not open shared state file {self.path}: {e}")
+                    self.path = None
+
+    @property
+    def enabled(self) -> bool:
+        return self._mm is not None
+
+    # Counters
+
+    def add(self, name: str, value: int = 1) -> None:
+        """Add to one of COUNTERS in this process's row"""
+        if self._mm is None:
+            return
+        with self._counter_lock:
+            row = self._own_row()
+            if row is None:
+                return
+            offset = row + 8 + 8 * _COUNTER_INDEX[name]
+            _U64.pack_into(self._mm, offset, _U64.unpack_from(self._mm, offset)[0] + value)
+
+    def counters(self) -> Dict[str, int]:
+        """Every worker's counts added up, including workers that have exited"""
+        totals = [0] * len(COUNTERS)
+        if self._mm is not None:
+            for i in range(self.max_workers):
+                row = self._row.unpack_from(self._mm, self._rows_at + i * self._row.size)
+                for j, value in enumerate(row[1:]):
+                    totals[j] += value
+        return dict(zip(COUNTERS, totals))
+
+    def _own_row(self) -> Optional[int]:
+        # Caller must hold self._counter_lock. Claimed on first use, and again after a fork.
+        pid = os.getpid()
+        if self._row_pid != pid:
+            self._row_pid = pid
+            self._row_offset = self._claim_row(pid)
+            if self._row_offset is None:
+                logger.warning(f"All {self.max_workers} shared counter rows are in use; worker {pid} is not counted")
+        return self._row_offset
+
+    def _claim_row(self, pid: int) -> Optional[int]:
+        with self._locked(_ROW_LOCK):
+            free = None
+            for i in range(self.max_workers):
+                offset = self._rows_at + i * self._row.size
+                owner = _I64.unpack_from(self._mm, offset)[0]
+                if owner == pid:
+                    return offset
+                if free is None and (owner == 0 or not _alive(owner)):
+                    free = offset
+            if free is not None:
+                # A dead worker's counts stay in the row, so the totals never go backwards
+                _I64.pack_into(self._mm, free, pid)
+            return free
+
+    # Hot answers
+
+    def get_answer(self, key: str, max_age: float) -> Optional[Tuple[str, float]]:
+        """(answer, created) stored under key less than max_age seconds ago, read without locking"""
+        if self._mm is None:
+            return None
+        digest = _digest(key)
+        base = self._set_offset(digest)
+        for way in range(self.SET_WAYS):
+            found = self._read_slot(base + way * self.slot_bytes, digest)
+            if found is not None:
+                return found if time.time() - found[1] < max_age else None
+        return None
+
+    def put_answer(self, key: str, value: str, created: Optional[float] = None) -> bool:
+        """Store an answer for every worker, replacing the oldest in its set; False if it does not fit a slot"""
+        if self._mm is None:
+            return False
+        data = value.encode('utf-8')
+        if len(data) > self.max_answer_bytes:
+            self._count('too_large')
+            return False
+        digest = _digest(key)
+        base = self._set_offset(digest)
+        with self._locked(base):
+            offset = self._choose_slot(base, digest)
+            self._write_slot(offset, digest, time.time() if created is None else created, data)
+        self._count('answer_writes')
+        return True
+
+    def clear_answers(self) -> None:
+        if self._mm is None:
+            return
+        for s in range(self.answer_sets):
+            base = self._answers_at + s * self.SET_WAYS * self.slot_bytes
+            with self._locked(base):
+                for way in range(self.SET_WAYS):
+                    self._write_slot(base + way * self.slot_bytes, _EMPTY_KEY, 0.0, b'')
+
+    def _set_offset(self, digest: bytes) -> int:
+        index = int.from_bytes(digest[:8], 'little') % self.answer_sets
+        return self._answers_at + index * self.SET_WAYS * self.slot_bytes
+
+    def _read_slot(self, offset: int, digest: bytes) -> Optional[Tuple[str, float]]:
+        for _ in range(self.READ_RETRIES):
+            seq, key, created, length, checksum = _SLOT.unpack_from(self._mm, offset)
+            if not seq & 1:
+                if key != digest:
+                    return None
+                if length <= self.max_answer_bytes:
+                    start = offset + _SLOT.size
+                    # Checksum and decode straight from the mapping
+                    with self._view[start:start + length] as data:
+                        try:
+                            answer = str(data, 'utf-8') if zlib.crc32(data) == checksum else None
+                        except UnicodeDecodeError:
+                            answer = None
+                    if answer is not None and _U32.unpack_from(self._mm, offset)[0] == seq:
+                        return answer, created
+            # A write is under way (or overlapped this read)
+            self._count('read_retries')
+        self._count('torn_reads')
+        return None
+
+    def _choose_slot(self, base: int, digest: bytes) -> int:
+        # Caller must hold the set's lock. The key's own slot, else an empty or abandoned one, else the oldest.
+        victim, victim_created = base, float('inf')
+        for way in range(self.SET_WAYS):
+            offset = base + way * self.slot_bytes
+            seq, key, created, _, _ = _SLOT.unpack_from(self._mm, offset)
+            if key == digest:
+                return offset
+            if key == _EMPTY_KEY or seq & 1:
+                # Odd with the lock held: the last writer died mid-write
+                created = float('-inf')
+            if created < victim_created:
+                victim, victim_created = offset, created
+        return victim
+
+    def _write_slot(self, offset: int, digest: bytes, created: float, data: bytes) -> None:
+        # Caller must hold the set's lock
+        seq = _U32.unpack_from(self._mm, offset)[0] | 1
+        # Readers retry while the sequence number is odd
+        _U32.pack_into(self._mm, offset, seq)
+        _SLOT_BODY.pack_into(self._mm, offset + 8, digest, created, len(data), zlib.crc32(data))
+        start = offset + _SLOT.size
+        self._mm[start:start + len(data)] = data
+        _U32.pack_into(self._mm, offset, (seq + 1) & _SEQ_MASK)
+
+    # Records
+
+    def record(self, key: str, initial: Sequence[float]) -> Optional[SharedRecord]:
+        """
+        The record stored under key, created with the `initial` values if no
+        worker has made it yet. None when disabled or every record is taken.
+        """
+        if self._mm is None:
+            return None
+        if len(initial) > RECORD_FIELDS:
+            raise ValueError(f"A shared record holds at most {RECORD_FIELDS} values")
+        digest = _digest(key)
+        start = int.from_bytes(digest[:8], 'little') % self.RECORD_SLOTS
+        with self._locked(_RECORD_LOCK):
+            for probe in range(self.RECORD_SLOTS):
+                offset = self._records_at + (start + probe) % self.RECORD_SLOTS * _RECORD.size
+                slot_key = _RECORD.unpack_from(self._mm, offset)[0]
+                if slot_key == _EMPTY_KEY:
+                    values = list(initial) + [0.0] * (RECORD_FIELDS - len(initial))
+                    _RECORD.pack_into(self._mm, offset, digest, *values)
+                    return SharedRecord(self, offset, len(initial))
+                if slot_key == digest:
+                    return SharedRecord(self, offset, len(initial))
+        logger.warning(f"All {self.RECORD_SLOTS} shared records are in use; {key} stays per process")
+        return None
+
+    # File and locks
+
+    def _open(self) -> None:
+        # Only one process at a time checks, creates or replaces the file
+        with open(f'{self.path}.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            fd = self._open_existing()
+            if fd is None:
+                fd = self._create()
+        self._fd = fd
+        self._mm = mmap.mmap(fd, self.size)
+        self._view = memoryview(self._mm)
+
+    def _open_existing(self) -> Optional[int]:
+        try:
+            fd = os.open(self.path, os.O_RDWR)
+        except FileNotFoundError:
+            return None
+        try:
+            if os.fstat(fd).st_size != self.size:
+                reason = 'a different size'
+            else:
+                magic, version, layout, boot_id, created = _HEADER.unpack(os.pread(fd, _HEADER.size, 0))
+                if magic != MAGIC or version != VERSION or layout != self._layout:
+                    reason = 'a different layout'
+                elif boot_id != _boot_id():
+                    reason = 'a previous boot'
+                else:
+                    self.created = created
+                    return fd
+        except (OSError, struct.error):
+            reason = 'an unreadable header'
+        os.close(fd)
+        logger.info(f"Replacing shared state file {self.path}: it has {reason}")
+        return None
+
+    def _create(self) -> int:
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        fd = os.open(tmp_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            # Zero-filled (and sparse): every table starts empty
+            os.ftruncate(fd, self.size)
+            self.created = time.time()
+            os.pwrite(fd, _HEADER.pack(MAGIC, VERSION, self._layout, _boot_id(), self.created), 0)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            os.close(fd)
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+        logger.info(f"Created shared state file {self.path} ({self.size // 1024} KiB)")
+        return fd
+
+    @contextmanager
+    def _locked(self, offset: int) -> Iterator[None]:
+        """This process's write lock plus a host-wide lock on one byte of the file"""
+        with self._write_lock:
+            try:
+                fcntl.lockf(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, offset)
+            except OSError:
+                self._count('contended')
+                fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, offset)
+            self._count('locks')
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, offset)
+
+    def _count(self, name: str) -> None:
+        with self._stats_lock:
+            self._counts[name] += 1
+
+    def close(self) -> None:
+        if self._mm is None:
+            return
+        self._view.release()
+        self._mm.close()
+        os.close(self._fd)
+        self._view = self._mm = self._fd = None
+
+    def stats(self) -> Dict:
+        if self._mm is None:
+            return {'enabled': False}
+        counters = self.counters()
+        lookups = counters['cache_hits'] + counters['similar_hits'] + counters['cache_misses']
+        workers = 0
+        for i in range(self.max_workers):
+            owner = _I64.unpack_from(self._mm, self._rows_at + i * self._row.size)[0]
+            if owner and _alive(owner):
+                workers += 1
+        used = sum(1 for s in range(self.answer_sets * self.SET_WAYS)
+                   if _SLOT.unpack_from(self._mm, self._answers_at + s * self.slot_bytes)[1] != _EMPTY_KEY)
+        records = sum(1 for r in range(self.RECORD_SLOTS)
+                      if _RECORD.unpack_from(self._mm, self._records_at + r * _RECORD.size)[0] != _EMPTY_KEY)
+        with self._stats_lock:
+            process = dict(self._counts)
+        return {
+            'enabled': True,
+            'path': self.path,
+            'size_bytes': self.size,
+            'created': self.created,
+            'workers': workers,
+            'counters': counters,
+            'hit_ratio': round((counters['cache_hits'] + counters['similar_hits']) / lookups, 4) if lookups else 0.0,
+            'answers': {
+                'slots': self.answer_sets * self.SET_WAYS,
+                'used': used,
+                'max_answer_bytes': self.max_answer_bytes
+            },
+            'records': records,
+            'this_worker': process
+        }
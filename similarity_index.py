@@ -0,0 +1,377 @@
+import atexit
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
+
+from response_cache import normalize_message
+
+try:
+    import fcntl
+except ImportError:  # Windows: one process per index file
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Words, including the combining vowel signs of Indic scripts, which \w alone splits on
+_TOKEN = re.compile(r'[\w\u0900-\u0DFF]+')
+# Numbers and operators: "what is 5+3" and "what is 5-4" are near-identical text but different questions
+_EXACT_TERMS = re.compile(r'\d+(?:\.\d+)?|[-+*/^=<>%×÷]')
+
+# Words that frame a question rather than say what it is about, so "explain X",
+# "what is X" and "X kya hai" all reduce to X. Single letters stay content words:
+# "World War I", "vitamin A" and "class X" are different questions from their siblings
+QUESTION_WORDS = frozenset("""
+    what is are was were explain tell me about the an of how does do did define definition describe
+    please can could you give meaning why who when where which in on to and for with us want know
+    क्या है हैं था थे बताएं बताइए बताओ समझाएं समझाइए के बारे में का की को मुझे कैसे क्यों कौन कब कहाँ
+    kya hai hain kaise kyon batao bataiye samjhao samjhaiye ke baare mein ka ki ko mujhe
+    అంటే ఏమిటి ఏమిటో గురించి వివరించండి చెప్పండి ఎలా ఎందుకు ఎవరు నాకు
+    என்றால் என்ன பற்றி விளக்கவும் சொல்லுங்கள் எப்படி ஏன் யார் எனக்கு
+""".split())
+
+# (language, topic, numbers and operators in order)
+Partition = Tuple[str, str, Tuple[str, ...]]
+
+
+def content_words(message: str) -> List[str]:
+    """The normalized words of a message that say what it is about, in order"""
+    return [w for w in _TOKEN.findall(normalize_message(message)) if w not in QUESTION_WORDS]
+
+
+def spelling_variants(a: str, b: str) -> bool:
+    """
+    Whether two different words are plausibly one word spelled two ways.
+
+    They must share a first letter, be at least 5 characters long and be one
+    edit apart (two from 9 characters), so "photosynthesis"/"photosynthsis"
+    match but "father"/"mother", "cell"/"call" and "ii"/"iii" do not.
+    """
+    if a[0] != b[0] or min(len(a), len(b)) < 5 or a.isdigit() or b.isdigit():
+        return False
+    limit = 2 if min(len(a), len(b)) >= 9 else 1
+    if abs(len(a) - len(b)) > limit:
+        return False
+    previous = list(range(len(b) + 1))
+    for i, x in enumerate(a, 1):
+        current = [i]
+        for j, y in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (x != y)))
+        if min(current) > limit:
+            return False
+        previous = current
+    return previous[-1] <= limit
+
+
+def same_question(words: FrozenSet[str], other: FrozenSet[str]) -> bool:
+    """Whether two sets of content words ask the same thing, allowing only spelling differences"""
+    left, right = words - other, other - words
+    if len(left) != len(right):
+        return False
+    unmatched = list(right)
+    for word in left:
+        match = next((w for w in unmatched if spelling_variants(word, w)), None)
+        if match is None:
+            return False
+        unmatched.remove(match)
+    return True
+
+
+def shingles(message: str, n: int = 3) -> Set[str]:
+    """
+    Character n-grams of the content words in a message.
+
+    Each word is padded and shingled on its own, so word order does not matter
+    and a small spelling change only touches the n-grams around it.
+    """
+    grams = set()
+    for word in content_words(message):
+        padded = f' {word} '
+        if len(padded) <= n:
+            grams.add(padded)
+        else:
+            grams.update(padded[i:i + n] for i in range(len(padded) - n + 1))
+    return grams
+
+
+def partition_key(message: str, language: str, topic: str) -> Partition:
+    # Operators only count next to numbers; elsewhere '-' and '/' are just punctuation
+    terms = tuple(_EXACT_TERMS.findall(message)) if any(c.isdigit() for c in message) else ()
+    return language, topic, terms
+
+
+class _Entry:
+    __slots__ = ('partition', 'signature', 'question', 'words', 'answer', 'created')
+
+    def __init__(self, partition: Partition, signature: Tuple[int, ...], question: str, answer: str, created: float):
+        self.partition = partition
+        self.signature = signature
+        self.question = question
+        self.words = frozenset(content_words(question))
+        self.answer = answer
+        self.created = created
+
+
+class SimilarityIndex:
+    """
+    Near-duplicate index over answered questions: character n-gram MinHash with LSH banding.
+
+    Entries are partitioned by (language, topic) so a lookup only ever matches
+    questions classified the same way, and by the numbers and operators they
+    contain, which must match exactly. A signature of `num_perm` minimums is
+    split into `bands` bands; questions sharing any band are candidates, and
+    candidates whose estimated Jaccard similarity clears `threshold` are
+    checked word by word, best first. The first whose content words are the
+    same, or differ only by spelling, is returned: n-gram overlap alone cannot
+    tell "World War I" from "World War II" or "father" from "mother". Memory
+    is bounded by `max_entries` (least recently used entries are evicted), and
+    the index can be persisted to a JSON file that every worker merges its
+    entries into.
+    """
+
+    def __init__(self, threshold: float = 0.8, max_entries: int = 10000, ttl: float = 86400,
+                 path: str = '', num_perm: int = 64, bands: int = 16, save_every: int = 100, seed: int = 1):
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({bands})")
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path or None
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.save_every = save_every
+        self.seed = seed
+        rng = random.Random(seed)
+        # Each "permutation" XORs a random mask into a 64-bit hash of the shingle: several times
+        # cheaper in pure Python than a*x + b mod p, and the blake2b hashes are already uniform
+        self._masks = [rng.getrandbits(64) for _ in range(num_perm)]
+
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[int, _Entry]' = OrderedDict()
+        # partition -> one {band values: entry ids} table per band
+        self._buckets: Dict[Partition, List[Dict[Tuple[int, ...], Set[int]]]] = {}
+        self._next_id = 0
+        self._unsaved = 0
+        self._saving = False
+        self._latencies = deque(maxlen=1024)
+        self._counters = {
+            'lookups': 0,
+            'hits': 0,
+            'misses': 0,
+            # Candidates over the threshold whose words differed
+            'rejected': 0,
+            'inserts': 0,
+            'evictions': 0,
+            'expirations': 0
+        }
+
+        if self.path:
+            self.load()
+            atexit.register(self.save)
+
+    @property
+    def enabled(self) -> bool:
+        return 0 < self.threshold <= 1
+
+    def signature(self, message: str) -> Optional[Tuple[int, ...]]:
+        grams = shingles(message)
+        if not grams:
+            return None
+        hashes = [int.from_bytes(hashlib.blake2b(g.encode('utf-8'), digest_size=8).digest(), 'little')
+                  for g in grams]
+        return tuple([min([h ^ mask for h in hashes]) for mask in self._masks])
+
+    def lookup(self, message: str, language: str, topic: str) -> Optional[Tuple[str, float]]:
+        """Best stored (answer, similarity) for a near-duplicate of `message`, or None"""
+        if not self.enabled:
+            return None
+        started = time.perf_counter()
+        signature = self.signature(message)
+        best = None
+        now = time.time()
+        with self._lock:
+            tables = self._buckets.get(partition_key(message, language, topic)) if signature else None
+            if tables:
+                candidates = set()
+                for band, table in enumerate(tables):
+                    candidates.update(table.get(signature[band * self.rows:(band + 1) * self.rows], ()))
+                scored = []
+                for entry_id in candidates:
+                    entry = self._entries[entry_id]
+                    if now - entry.created >= self.ttl:
+                        self._remove(entry_id)
+                        self._counters['expirations'] += 1
+                        continue
+                    score = sum(x == y for x, y in zip(signature, entry.signature)) / self.num_perm
+                    if score >= self.threshold:
+                        scored.append((score, entry_id))
+                if scored:
+                    words = frozenset(content_words(message))
+                    for score, entry_id in sorted(scored, reverse=True):
+                        if same_question(words, self._entries[entry_id].words):
+                            self._entries.move_to_end(entry_id)
+                            best = (self._entries[entry_id].answer, score)
+                            break
+                        self._counters['rejected'] += 1
+            self._counters['lookups'] += 1
+            self._counters['hits' if best else 'misses'] += 1
+            self._latencies.append(time.perf_counter() - started)
+        return best
+
+    def add(self, message: str, language: str, topic: str, answer: str) -> None:
+        if not self.enabled:
+            return
+        signature = self.signature(message)
+        if signature is None:
+            return
+        partition = partition_key(message, language, topic)
+        with self._lock:
+            tables = self._buckets.get(partition)
+            duplicate = next((entry_id for entry_id in tables[0].get(signature[:self.rows], ())
+                              if self._entries[entry_id].signature == signature), None) if tables else None
+            if duplicate is not None:
+                # Same question again: refresh the stored answer instead of adding a second copy
+                entry = self._entries[duplicate]
+                entry.answer, entry.created = answer, time.time()
+                self._entries.move_to_end(duplicate)
+            else:
+                self._insert(_Entry(partition, signature, message, answer, time.time()))
+            self._counters['inserts'] += 1
+            self._unsaved += 1
+            save = self.path and self._unsaved >= self.save_every and not self._saving
+            if save:
+                self._saving = True
+        if save:
+            threading.Thread(target=self._save_in_background, daemon=True).start()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+            self._unsaved += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._counters)
+            stats['entries'] = len(self._entries)
+            stats['partitions'] = len(self._buckets)
+            latencies = sorted(self._latencies)
+        stats['hit_ratio'] = round(stats['hits'] / stats['lookups'], 4) if stats['lookups'] else 0.0
+        if latencies:
+            stats['lookup_ms_p50'] = round(latencies[len(latencies) // 2] * 1000, 3)
+            stats['lookup_ms_p99'] = round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 3)
+        stats['threshold'] = self.threshold
+        stats['max_entries'] = self.max_entries
+        stats['persistent'] = bool(self.path)
+        return stats
+
+    def _insert(self, entry: _Entry) -> None:
+        # Caller must hold self._lock
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = entry
+        tables = self._buckets.get(entry.partition)
+        if tables is None:
+            tables = self._buckets[entry.partition] = [{} for _ in range(self.bands)]
+        for band, table in enumerate(tables):
+            table.setdefault(entry.signature[band * self.rows:(band + 1) * self.rows], set()).add(entry_id)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+            self._counters['evictions'] += 1
+
+    def _remove(self, entry_id: int) -> None:
+        # Caller must hold self._lock
+        entry = self._entries.pop(entry_id)
+        tables = self._buckets[entry.partition]
+        for band, table in enumerate(tables):
+            key = entry.signature[band * self.rows:(band + 1) * self.rows]
+            ids = table[key]
+            ids.discard(entry_id)
+            if not ids:
+                del table[key]
+        if not tables[0]:
+            del self._buckets[entry.partition]
+
+    # Persistence
+
+    def _save_in_background(self) -> None:
+        try:
+            self.save()
+        finally:
+            with self._lock:
+                self._saving = False
+
+    def save(self) -> None:
+        """
+        Merge the index into `path` and write it atomically (a temp file renamed
+        over the old one). Every worker saves to the same file, so the entries
+        other workers saved are kept: under a lock, the file is read back and
+        the newest copy of each question wins, up to `max_entries`.
+        """
+        if not self.path:
+            return
+        with self._lock:
+            if not self._unsaved:
+                return
+            entries = [[e.partition[0], e.partition[1], e.question, e.answer, e.created, list(e.signature)]
+                       for e in self._entries.values()]
+            self._unsaved = 0
+        tmp_path = f'{self.path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with open(f'{self.path}.lock', 'a') as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                data = self._read()
+                if data is not None and data.get('num_perm') == self.num_perm and data.get('seed') == self.seed:
+                    entries = self._merge(data.get('entries', []), entries)
+                data = {'num_perm': self.num_perm, 'seed': self.seed, 'entries': entries}
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, ensure_ascii=False)
+                os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error(f"Could not save similarity index to {self.path}: {e}")
+
+    def _merge(self, saved: List, entries: List) -> List:
+        """Saved and in-memory entries, one per (language, topic, question), newest first, unexpired"""
+        now = time.time()
+        merged = {}
+        for entry in saved + entries:
+            key = (entry[0], entry[1], entry[2])
+            if now - entry[4] < self.ttl and (key not in merged or merged[key][4] < entry[4]):
+                merged[key] = entry
+        newest = sorted(merged.values(), key=lambda entry: entry[4], reverse=True)[:self.max_entries]
+        # Oldest first, so a load inserts (and LRU-evicts) in age order
+        return newest[::-1]
+
+    def _read(self) -> Optional[Dict]:
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.error(f"Could not load similarity index from {self.path}: {e}")
+            return None
+
+    def load(self) -> None:
+        data = self._read()
+        if data is None:
+            return
+        # Signatures are only reusable with the same masks
+        reuse = data.get('num_perm') == self.num_perm and data.get('seed') == self.seed
+        now = time.time()
+        with self._lock:
+            for language, topic, question, answer, created, signature in data.get('entries', []):
+                if now - created >= self.ttl:
+                    continue
+                signature = tuple(signature) if reuse else self.signature(question)
+                if signature:
+                    self._insert(_Entry(partition_key(question, language, topic), signature, question, answer, created))
+        logger.info(f"Loaded {len(self._entries)} questions into the similarity index")
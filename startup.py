@@ -0,0 +1,132 @@
+"""
+Worker startup bookkeeping for the /ready check.
+
+Records how long the app took to import, whether this process is a worker
+forked from a master that preloaded the app (and so shares its tables and
+indexes copy-on-write), whether it has opened its upstream connections yet,
+and how much of its resident memory is shared.
+"""
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+# /proc/self/smaps_rollup fields reported by resident_memory(), in kB
+_SMAPS_FIELDS = {
+    'Rss': 'rss_kb',
+    'Pss': 'pss_kb',
+    'Shared_Clean': 'shared_clean_kb',
+    'Shared_Dirty': 'shared_dirty_kb',
+    'Private_Clean': 'private_clean_kb',
+    'Private_Dirty': 'private_dirty_kb'
+}
+
+
+def resident_memory(pid: Optional[int] = None) -> Dict[str, int]:
+    """
+    Resident memory of a process in kB: RSS, proportional share (PSS) and its
+    shared and private pages. Linux only; elsewhere just the peak RSS of this process.
+    """
+    try:
+        with open(f"/proc/{pid or 'self'}/smaps_rollup") as f:
+            memory = {}
+            for line in f:
+                name, _, rest = line.partition(':')
+                if name in _SMAPS_FIELDS:
+                    memory[_SMAPS_FIELDS[name]] = int(rest.split()[0])
+            return memory
+    except (OSError, ValueError, IndexError):
+        pass
+    if pid is not None:
+        return {}
+    try:
+        import resource
+    except ImportError:
+        return {}
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kB elsewhere
+    return {'max_rss_kb': peak // 1024 if sys.platform == 'darwin' else peak}
+
+
+class WorkerStartup:
+    """
+    Created when the app module starts importing. A worker is ready once it
+    has warmed its own upstream connections: the state of a preloaded master
+    is inherited on fork, so readiness is tracked per process.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.loaded_pid = os.getpid()
+        self.import_ms: Optional[float] = None
+        self._lock = threading.Lock()
+        self._ready_pid: Optional[int] = None
+        self._warm_ms = 0.0
+        self._warmed: Dict[str, int] = {}
+
+    def loaded(self) -> None:
+        """Mark the end of the app import"""
+        self.import_ms = round((time.perf_counter() - self.started) * 1000, 1)
+        logger.info(f"App imported in {self.import_ms}ms")
+
+    @property
+    def ready(self) -> bool:
+        return self._ready_pid == os.getpid()
+
+    @property
+    def preloaded(self) -> bool:
+        """True in a worker forked from the process that imported the app"""
+        return self.loaded_pid != os.getpid()
+
+    def warm_up(self, client, urls: List[str], connections: int) -> None:
+        """
+        Open `connections` keep-alive connections to each upstream URL with the
+        worker's client, then mark the worker ready. Unreachable upstreams are
+        logged, not fatal: the app still answers from its fallbacks.
+        """
+        with self._lock:
+            if self.ready:
+                return
+            started = time.perf_counter()
+            warmed = {}
+            if connections > 0 and urls:
+                with ThreadPoolExecutor(max_workers=len(urls)) as pool:
+                    counts = pool.map(lambda url: client.warm(url, connections), urls)
+                    warmed = dict(zip(urls, counts))
+            self._finish(started, warmed)
+
+    async def awarm_up(self, client, urls: List[str], connections: int) -> None:
+        """Non-blocking warm_up for the asyncio serving mode"""
+        if self.ready:
+            return
+        started = time.perf_counter()
+        warmed = {}
+        if connections > 0 and urls:
+            counts = await asyncio.gather(*(client.warm(url, connections) for url in urls))
+            warmed = dict(zip(urls, counts))
+        self._finish(started, warmed)
+
+    def _finish(self, started: float, warmed: Dict[str, int]) -> None:
+        self._warm_ms = round((time.perf_counter() - started) * 1000, 1)
+        self._warmed = {urlsplit(url).netloc: count for url, count in warmed.items()}
+        self._ready_pid = os.getpid()
+        logger.info(f"Worker ready: {sum(warmed.values())} upstream connections warmed in {self._warm_ms}ms"
+                    f"{' (preloaded app)' if self.preloaded else ''}")
+
+    def stats(self) -> Dict:
+        return {
+            'ready': self.ready,
+            'pid': os.getpid(),
+            'preloaded': self.preloaded,
+            'import_ms': self.import_ms,
+            'warm_up_ms': self._warm_ms if self.ready else None,
+            'warm_connections': self._warmed if self.ready else {},
+            'memory': resident_memory()
+        }
@@ -1,94 +1,101 @@
 # Import required libraries
+import os
+from typing import Dict, Iterator
+
 from dotenv import load_dotenv
-from itertools import zip_longest
 
 import streamlit as st
-from streamlit_chat import message
-
-from langchain_openai import ChatOpenAI
-from langchain_core.messages import (
-    SystemMessage,
-    HumanMessage,
-    AIMessage
-)
 
-# Load environment variables
+# Load environment variables before Config reads them
 load_dotenv()
 
+from prompt_builder import ChatRequest
+from providers import ProviderRouter, create_router
+
+# Messages sent to the model with each question (the system prompt is always added)
+MAX_CONTEXT_MESSAGES = int(os.getenv('STREAMLIT_CONTEXT_MESSAGES', 12))
+# Messages kept in the session for display; older ones are dropped
+MAX_TRANSCRIPT_MESSAGES = int(os.getenv('STREAMLIT_TRANSCRIPT_MESSAGES', 200))
+
+SYSTEM_PROMPT = """You are an AI-powered teacher chatbot. Your role is to:
+    
+    1. Provide educational, structured, and informative responses like a teacher would
+    2. Always respond in the SAME language as the user's input (English, Hindi, or Telugu)
+    3. Include definitions, explanations, and examples when appropriate
+    4. Break down complex topics into understandable parts
+    5. Encourage learning and ask follow-up questions when relevant
+    6. If you don't know something, admit it honestly and suggest where they might find the information
+    
+    Language Guidelines:
+    - If user writes in English, respond in English
+    - If user writes in Hindi (हिंदी), respond in Hindi
+    - If user writes in Telugu (తెలుగు), respond in Telugu
+    - Maintain the educational tone regardless of language"""
+
+# Reruns the chat panel on its own when available instead of the whole script
+fragment = getattr(st, 'fragment', None) or getattr(st, 'experimental_fragment', None) or (lambda func: func)
+
 # Set streamlit page configuration
 st.set_page_config(page_title="AI Teacher Chatbot", page_icon="🎓")
 st.title("🎓 AI Teacher Chatbot")
 st.markdown("*Ask me anything in English, Hindi, or Telugu - I'll respond in the same language!*")
 
 # Initialize session state variables
-if 'generated' not in st.session_state:
-    st.session_state['generated'] = []  # Store AI generated responses
+if 'messages' not in st.session_state:
+    st.session_state['messages'] = []  # {'role': 'user'|'assistant', 'content'} transcript, oldest first
+    st.session_state['added'] = 0  # messages ever added, including ones since dropped from the transcript
 
-if 'past' not in st.session_state:
-    st.session_state['past'] = []  # Store past user inputs
 
-if 'entered_prompt' not in st.session_state:
-    st.session_state['entered_prompt'] = ""  # Store the latest user input
-
-# Initialize the ChatOpenAI model
-chat = ChatOpenAI(
-    temperature=0.5,
-    model_name="gpt-3.5-turbo"
-)
+@st.cache_resource
+def get_router() -> ProviderRouter:
+    """
+    Create the LLM provider router once per server process and share it (with its latency
+    statistics) across reruns and sessions. Uses the same GENAI_/OPENAI_ settings as app.py.
+    """
+    return create_router()
 
 
-def build_message_list():
+def build_request() -> ChatRequest:
     """
-    Build a list of messages including system, human and AI messages.
+    Build the prompt from the system message and the most recent turns of the conversation.
     """
-    # Start zipped_messages with the SystemMessage for educational responses
-    zipped_messages = [SystemMessage(
-        content="""You are an AI-powered teacher chatbot. Your role is to:
-        
-        1. Provide educational, structured, and informative responses like a teacher would
-        2. Always respond in the SAME language as the user's input (English, Hindi, or Telugu)
-        3. Include definitions, explanations, and examples when appropriate
-        4. Break down complex topics into understandable parts
-        5. Encourage learning and ask follow-up questions when relevant
-        6. If you don't know something, admit it honestly and suggest where they might find the information
-        
-        Language Guidelines:
-        - If user writes in English, respond in English
-        - If user writes in Hindi (हिंदी), respond in Hindi
-        - If user writes in Telugu (తెలుగు), respond in Telugu
-        - Maintain the educational tone regardless of language""")]
-
-    # Zip together the past and generated messages
-    for human_msg, ai_msg in zip_longest(st.session_state['past'], st.session_state['generated']):
-        if human_msg is not None:
-            zipped_messages.append(HumanMessage(
-                content=human_msg))  # Add user messages
-        if ai_msg is not None:
-            zipped_messages.append(
-                AIMessage(content=ai_msg))  # Add AI messages
-
-    return zipped_messages
-
-
-def generate_response():
+    messages = st.session_state['messages'][-MAX_CONTEXT_MESSAGES:]
+    # Gemini expects the conversation to open with a user turn
+    while messages and messages[0]['role'] != 'user':
+        messages = messages[1:]
+    return ChatRequest(SYSTEM_PROMPT, messages)
+
+
+def add_message(msg: Dict[str, str]) -> None:
     """
-    Generate AI response using the ChatOpenAI model.
+    Append a message to the transcript, dropping the oldest ones past the display limit.
     """
-    # Build the list of messages
-    zipped_messages = build_message_list()
+    messages = st.session_state['messages']
+    messages.append(msg)
+    st.session_state['added'] += 1
+    if len(messages) > MAX_TRANSCRIPT_MESSAGES:
+        del messages[:len(messages) - MAX_TRANSCRIPT_MESSAGES]
 
-    # Generate response using the chat model
-    ai_response = chat(zipped_messages)
 
-    return ai_response.content
+def stream_response() -> Iterator[str]:
+    """
+    Yield the AI response chunk by chunk from the fastest provider to start streaming.
+    """
+    router = get_router()
+    if not router.providers:
+        yield "No AI provider is configured. Set GENAI_API_KEY or OPENAI_API_KEY and restart the app."
+        return
+    streamed = False
+    for chunk in router.stream(build_request()):
+        streamed = True
+        yield chunk
+    if not streamed:
+        yield "Sorry, I couldn't reach the AI service just now. Please try again in a moment."
 
 
-# Define function to submit user input
-def submit():
-    # Set entered_prompt to the current value of prompt_input
-    st.session_state.entered_prompt = st.session_state.prompt_input
-    # Clear prompt_input
-    st.session_state.prompt_input = ""
+def render_message(msg: Dict[str, str]) -> None:
+    with st.chat_message(msg['role']):
+        st.markdown(msg['content'])
 
 
 # Add example questions in different languages
@@ -110,32 +117,36 @@ with st.expander("📚 Example Questions / उदाहरण प्रश्न
     - కంప్యూటర్లు ఎలా పనిచేస్తాయి?
     """)
 
-# Create a text input for user
-st.text_input('YOU: ', key='prompt_input', on_change=submit, placeholder="Ask me anything in English, Hindi, or Telugu...")
+
+# A full run draws the whole transcript once, outside the fragment; the fragment's own reruns
+# only draw what was asked since then
+for msg in st.session_state['messages']:
+    render_message(msg)
+st.session_state['history_drawn'] = st.session_state['added']
 
 
-if st.session_state.entered_prompt != "":
-    # Get user query
-    user_query = st.session_state.entered_prompt
+@fragment
+def chat_panel():
+    # Exchanges since the last full run, oldest first
+    since = st.session_state['added'] - st.session_state['history_drawn']
+    messages = st.session_state['messages']
+    for msg in messages[max(0, len(messages) - since):] if since else []:
+        render_message(msg)
 
-    # Append user query to past queries
-    st.session_state.past.append(user_query)
+    # Create a chat input for user
+    user_query = st.chat_input("Ask me anything in English, Hindi, or Telugu...")
+    if user_query:
+        add_message({'role': 'user', 'content': user_query})
+        render_message(st.session_state['messages'][-1])
 
-    # Generate response
-    output = generate_response()
+        # Stream the response into the page as it is generated
+        with st.chat_message("assistant"):
+            output = st.write_stream(stream_response())
 
-    # Append AI response to generated responses
-    st.session_state.generated.append(output)
+        add_message({'role': 'assistant', 'content': output})
 
-# Display the chat history
-if st.session_state['generated']:
-    for i in range(len(st.session_state['generated'])-1, -1, -1):
-        # Display AI response
-        message(st.session_state["generated"][i], key=str(i))
-        # Display user message
-        message(st.session_state['past'][i],
-                is_user=True, key=str(i) + '_user')
 
+chat_panel()
 
 # Add credit
 st.markdown("""
@@ -0,0 +1,98 @@
+"""Provider race: hedged winner and loser, sync complete calls, and failover, against two local stubs"""
+import asyncio
+import time
+
+import pytest
+
+from gemini_stub import start_stub, stub_openai_url, stub_url
+from prompt_builder import ChatRequest
+from providers import GeminiProvider, OpenAIProvider, ProviderRouter
+from resilience import AdaptiveRateLimiter, CircuitBreaker, UpstreamGuard
+
+REQUEST = ChatRequest('You are a teacher.', [{'role': 'user', 'content': 'What is photosynthesis?'}])
+SLOW, FAST = 'Slow answer.', 'Fast answer.'
+
+
+def guard(max_retries: int = 3) -> UpstreamGuard:
+    return UpstreamGuard(AdaptiveRateLimiter(rate=1000, burst=1000, max_rate=1000),
+                         CircuitBreaker(failure_threshold=20, reset_timeout=1),
+                         max_retries=max_retries, base_delay=0.01, max_delay=0.02)
+
+
+@pytest.fixture
+def stubs():
+    servers = {}
+
+    def start(name: str, **options):
+        servers[name] = start_stub(chunks=2, **options)
+        return servers[name]
+
+    yield start
+    for server in servers.values():
+        server.shutdown()
+        server.server_close()
+
+
+def make_router(stubs, primary: dict, secondary: dict, hedge_after: float = 0.1, max_retries: int = 3):
+    """Gemini is tried first (neither provider has samples yet); a hedge goes to OpenAI after hedge_after"""
+    gemini = GeminiProvider(stub_url(stubs('gemini', **primary)), 'stub', guard(max_retries))
+    openai = OpenAIProvider(stub_openai_url(stubs('openai', **secondary)), 'stub', 'stub', guard(max_retries))
+    return ProviderRouter([gemini, openai], hedge=True, hedge_max_delay=hedge_after, min_samples=1000, threads=8)
+
+
+def upstream_requests(router: ProviderRouter, name: str) -> int:
+    return router.provider(name).stats()['requests'] + router.provider(name).stats()['cancelled']
+
+
+def test_async_hedge_wins_and_cancels_the_loser(stubs):
+    router = make_router(stubs, {'latency_ms': 2000, 'answer': SLOW}, {'latency_ms': 20, 'answer': FAST})
+    started = time.perf_counter()
+    answer = asyncio.run(router.acomplete(REQUEST))
+    assert answer == FAST
+    assert time.perf_counter() - started < 1.0
+    stats = router.stats()
+    assert (stats['hedged'], stats['hedge_wins']) == (1, 1)
+    # The primary's request was cancelled, not left to finish and counted as an answer
+    assert stats['providers']['gemini']['cancelled'] == 1
+    assert stats['providers']['gemini']['requests'] == 0
+
+
+def test_async_primary_answering_in_time_is_not_hedged(stubs):
+    router = make_router(stubs, {'latency_ms': 10, 'answer': SLOW}, {'latency_ms': 10, 'answer': FAST}, hedge_after=1)
+    assert asyncio.run(router.acomplete(REQUEST)) == SLOW
+    assert router.stats()['hedged'] == 0
+    assert upstream_requests(router, 'openai') == 0
+
+
+def test_sync_stream_hedge_wins(stubs):
+    router = make_router(stubs, {'latency_ms': 2000, 'answer': SLOW}, {'latency_ms': 20, 'answer': FAST})
+    started = time.perf_counter()
+    assert ''.join(router.stream(REQUEST)) == FAST
+    assert time.perf_counter() - started < 1.0
+    stats = router.stats()
+    assert (stats['hedged'], stats['hedge_wins']) == (1, 1)
+
+
+def test_sync_complete_is_not_hedged(stubs):
+    # A blocking complete request cannot be stopped, so a hedge would pay for two full answers
+    router = make_router(stubs, {'latency_ms': 300, 'answer': SLOW}, {'latency_ms': 10, 'answer': FAST})
+    assert router.complete(REQUEST) == SLOW
+    assert router.stats()['hedged'] == 0
+    assert upstream_requests(router, 'openai') == 0
+
+
+@pytest.mark.parametrize('path', ['sync', 'async'])
+def test_failing_provider_fails_over(stubs, path):
+    router = make_router(stubs, {'schedule': [503], 'answer': SLOW}, {'answer': FAST}, hedge_after=5,
+                         max_retries=1)
+    answer = router.complete(REQUEST) if path == 'sync' else asyncio.run(router.acomplete(REQUEST))
+    assert answer == FAST
+    stats = router.stats()
+    assert stats['failovers'] == 1
+    assert stats['providers']['gemini']['errors'] == 1
+
+
+def test_no_answer_from_any_provider_returns_none(stubs):
+    router = make_router(stubs, {'schedule': [503]}, {'schedule': [503]}, hedge_after=5, max_retries=1)
+    assert router.complete(REQUEST) is None
+    assert router.stats()['unanswered'] == 1
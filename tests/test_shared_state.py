@@ -0,0 +1,208 @@
+"""Shared state file: lock-free slot reads, dead writers and workers, and rebuilding the file"""
+import multiprocessing
+import os
+import struct
+
+import pytest
+
+import shared_state
+from shared_state import SharedState, _HEADER, _SLOT, _U32
+
+pytestmark = pytest.mark.skipif(shared_state.fcntl is None, reason='shared state needs fcntl')
+
+fork = multiprocessing.get_context('fork')
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'state')
+
+
+def open_state(path, **options):
+    # One set of four ways, so tests control which slots a key can use
+    options.setdefault('answer_slots', SharedState.SET_WAYS)
+    options.setdefault('answer_bytes', 256)
+    state = SharedState(path, **options)
+    assert state.enabled
+    return state
+
+
+def slot_of(state, key):
+    """Offset of the slot holding key"""
+    digest = shared_state._digest(key)
+    base = state._set_offset(digest)
+    for way in range(state.SET_WAYS):
+        offset = base + way * state.slot_bytes
+        if _SLOT.unpack_from(state._mm, offset)[1] == digest:
+            return offset
+    raise AssertionError(f'{key} is not stored')
+
+
+def test_disabled_without_a_path():
+    state = SharedState()
+    state.add('cache_hits')
+    assert not state.enabled
+    assert state.get_answer('k', 60) is None
+    assert not state.put_answer('k', 'v')
+    assert state.record('k', [1.0]) is None
+    assert state.stats() == {'enabled': False}
+
+
+def test_answers_are_shared_between_mappings(path):
+    writer, reader = open_state(path), open_state(path)
+    assert writer.put_answer('photosynthesis', 'प्रकाश संश्लेषण')
+    answer, created = reader.get_answer('photosynthesis', 60)
+    assert answer == 'प्रकाश संश्लेषण'
+    assert reader.get_answer('photosynthesis', 0) is None
+    assert reader.get_answer('osmosis', 60) is None
+
+
+def test_answer_larger_than_a_slot_is_refused(path):
+    state = open_state(path)
+    assert not state.put_answer('k', 'x' * (state.max_answer_bytes + 1))
+    assert state.get_answer('k', 60) is None
+    assert state.stats()['this_worker']['too_large'] == 1
+
+
+def test_odd_sequence_is_never_read(path):
+    state = open_state(path)
+    state.put_answer('k', 'answer')
+    offset = slot_of(state, 'k')
+    # A writer is (or died) mid-write
+    _U32.pack_into(state._mm, offset, _U32.unpack_from(state._mm, offset)[0] | 1)
+    assert state.get_answer('k', 60) is None
+    counts = state.stats()['this_worker']
+    assert counts['read_retries'] == SharedState.READ_RETRIES
+    assert counts['torn_reads'] == 1
+
+
+def test_torn_slot_fails_its_checksum(path):
+    state = open_state(path)
+    state.put_answer('k', 'answer')
+    start = slot_of(state, 'k') + _SLOT.size
+    # Even sequence, but the bytes do not match the checksum written with them
+    state._mm[start:start + 6] = b'ANSWER'
+    assert state.get_answer('k', 60) is None
+    assert state.stats()['this_worker']['torn_reads'] == 1
+
+
+def test_concurrent_writes_never_yield_a_mixed_answer(path):
+    state = open_state(path, answer_bytes=8192)
+    values = ['a' * 4000, 'b' * 4000]
+    state.put_answer('k', values[0])
+    stop = fork.Event()
+
+    def write():
+        other = open_state(path, answer_bytes=8192)
+        i = 0
+        while not stop.is_set():
+            i += 1
+            other.put_answer('k', values[i % 2])
+
+    writer = fork.Process(target=write)
+    writer.start()
+    try:
+        for _ in range(20000):
+            found = state.get_answer('k', 60)
+            assert found is None or found[0] in values
+    finally:
+        stop.set()
+        writer.join()
+
+
+def test_slot_left_mid_write_is_reused_first(path):
+    state = open_state(path)
+    for i in range(state.SET_WAYS):
+        state.put_answer(f'k{i}', f'answer {i}', created=1000.0 + i)
+    # k2's writer died after marking the slot busy; k0 is the oldest
+    abandoned = slot_of(state, 'k2')
+    _U32.pack_into(state._mm, abandoned, _U32.unpack_from(state._mm, abandoned)[0] | 1)
+    state.put_answer('new', 'fresh')
+    assert slot_of(state, 'new') == abandoned
+    assert state.get_answer('new', float('inf'))[0] == 'fresh'
+    assert state.get_answer('k0', float('inf'))[0] == 'answer 0'
+
+
+def test_dead_workers_row_is_taken_over_with_its_counts(path):
+    state = open_state(path, max_workers=1)
+
+    def count():
+        worker = open_state(path, max_workers=1)
+        worker.add('fallbacks', 5)
+
+    child = fork.Process(target=count)
+    child.start()
+    child.join()
+    assert state.counters()['fallbacks'] == 5
+    # The only row belongs to the exited child: this process takes it over
+    state.add('fallbacks')
+    assert state.counters()['fallbacks'] == 6
+    assert state.stats()['workers'] == 1
+
+
+def test_records_are_updated_under_one_lock(path):
+    first, second = open_state(path), open_state(path)
+    record = first.record('rate_limit:gemini', [10.0, 0.0])
+
+    def bump():
+        other = open_state(path).record('rate_limit:gemini', [99.0, 0.0])
+        for _ in range(200):
+            with other.locked() as values:
+                values[1] += 1
+
+    children = [fork.Process(target=bump) for _ in range(3)]
+    for child in children:
+        child.start()
+    for _ in range(200):
+        with record.locked() as values:
+            values[1] += 1
+    for child in children:
+        child.join()
+    with second.record('rate_limit:gemini', [0.0, 0.0]).locked() as values:
+        # Created once with the first caller's values; every increment landed
+        assert values == [10.0, 800.0]
+
+
+def test_file_with_another_layout_is_rebuilt(path):
+    state = open_state(path, answer_slots=8)
+    state.put_answer('k', 'answer')
+    state.add('cache_hits', 3)
+    state.close()
+
+    rebuilt = open_state(path, answer_slots=16)
+    assert rebuilt.get_answer('k', 60) is None
+    assert rebuilt.counters()['cache_hits'] == 0
+    assert os.path.getsize(path) == rebuilt.size
+
+
+def test_file_with_a_bad_header_is_rebuilt(path):
+    state = open_state(path)
+    state.put_answer('k', 'answer')
+    state.close()
+    with open(path, 'r+b') as f:
+        f.write(b'NOTSHM!!')
+
+    rebuilt = open_state(path)
+    assert rebuilt.get_answer('k', 60) is None
+    assert rebuilt._mm[:8] == shared_state.MAGIC
+
+
+@pytest.mark.skipif(shared_state._boot_id() == bytes(16), reason='no boot id on this platform')
+def test_file_from_a_previous_boot_is_rebuilt(path):
+    state = open_state(path)
+    state.put_answer('k', 'answer')
+    magic, version, layout, _, created = _HEADER.unpack_from(state._mm, 0)
+    _HEADER.pack_into(state._mm, 0, magic, version, layout, b'\x01' * 16, created)
+    state.close()
+
+    rebuilt = open_state(path)
+    assert rebuilt.get_answer('k', 60) is None
+    assert struct.unpack_from('<16s', rebuilt._mm, 16)[0] == shared_state._boot_id()
+
+
+def test_mapping_of_a_replaced_file_keeps_working(path):
+    old = open_state(path, answer_slots=8)
+    open_state(path, answer_slots=16)
+    # The old mapping still points at the unlinked file until this process closes it
+    assert old.put_answer('k', 'answer')
+    assert old.get_answer('k', 60)[0] == 'answer'